@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+""" Benchmark of SDNController and FlowScheduler on a simulated fleet of OpenFlow datapaths.
+Switches connect to the controller, hosts generate PacketIns towards the services, and the flows of a
+random traffic matrix follow the entries installed on the switches (fluid_sim.FluidFabric), so that the
+port counters reflect the paths created by the scheduler. The polling rounds run on a simulated clock at
+the intervals chosen by the scheduler, with the optimization cooldown. A reroute is a path that moves a
+destination to another core switch; the time spent by the simulated switches is not counted.
+
+Usage: python3 benchmarks/controller_bench.py [k] [n_flows] [n_rounds]
+"""
+from fake_datapath import FakeDatapath, load_controller, fat_tree_dpids, ipv4_packet, packet_in
+from ryu.controller import ofp_event
+import contextlib
+import functools
+import os
+import random
+import sys
+import tempfile
+import time
+import typing
+
+
+class Fabric():
+
+    def __init__(self, controller, k: int) -> None:
+        """ Fake k-ary fat-tree connected to a controller instance
+
+        @param controller: The controller module returned by load_controller
+        @param k: The fat-tree parameter
+        """
+        from switch import Switch
+        self.Switch = Switch
+        self.k: int = k
+        self.k_2: int = k // 2
+        self.app = controller.SDNController(k=k, start_scheduler=False)
+        self.datapaths: typing.Dict[int, FakeDatapath] = { dpid: FakeDatapath(dpid) for dpid in fat_tree_dpids(k) }
+        self.hosts: typing.List[str] = [ f'10.{n}.{s}.{h}' for n in range(k) for s in range(self.k_2) for h in range(2, self.k_2 + 2) ]
+
+
+    def connect(self) -> None:
+        """ Send the switch features of every datapath to the controller """
+        for datapath in self.datapaths.values():
+            msg = datapath.ofproto_parser.OFPSwitchFeatures(datapath, datapath_id=datapath.id)
+            self.app._SDNController__switch_features_handler(ofp_event.EventOFPSwitchFeatures(msg))
+
+
+    def edge_switch(self, host: str) -> FakeDatapath:
+        """ Return the edge switch the host is connected to """
+        _, pod, s, _ = host.split('.')
+        return self.datapaths[int(self.Switch.make_dpid(False, int(pod), int(s), self.k), 16)]
+
+
+    def packet_ins(self, flows: typing.List[typing.Tuple[str, str, int]]) -> list:
+        """ Create the PacketIn events sent by the edge switches for the first packet of each flow """
+        return [ ofp_event.EventOFPPacketIn(packet_in(self.edge_switch(src), ipv4_packet(src, dst))) for src, dst, _ in flows ]
+
+
+    def stats_round(self) -> None:
+        """ Send the port stats replies of the core switches, without traffic """
+        for dpid, datapath in self.datapaths.items():
+            if not self.Switch.get(dpid).is_core:
+                continue
+            parser = datapath.ofproto_parser
+            body = [ parser.OFPPortStats(port_no=port, tx_bytes=0, rx_bytes=0) for port in range(1, self.k + 1) ]
+            msg = parser.OFPPortStatsReply(datapath, body=body)
+            self.app._SDNController__port_stats_reply_handler(ofp_event.EventOFPPortStatsReply(msg))
+
+
+def timed(timings: typing.Dict[str, typing.List[float]], name: str, function: typing.Callable,
+          excluded: typing.Optional[typing.List[float]] = None) -> typing.Callable:
+    """ Wrap a function to append its execution time to timings[name], minus the time added to excluded[0] meanwhile """
+    excluded = excluded if excluded is not None else [0.0]
+    def wrapper(*args, **kwargs):
+        start, skipped = time.perf_counter(), excluded[0]
+        result = function(*args, **kwargs)
+        timings.setdefault(name, []).append(time.perf_counter() - start - (excluded[0] - skipped))
+        return result
+    return wrapper
+
+
+def main(k: int, n_flows: int, n_rounds: int) -> None:
+    from fluid_sim import FluidFabric     # Imports Fabric from this module
+    random.seed(0)
+    hosts = [ f'10.{n}.{s}.{h}' for n in range(k) for s in range(k // 2) for h in range(2, k // 2 + 2) ]
+    services = { str(i): host for i, host in enumerate(random.sample(hosts, max(1, len(hosts) // 8))) }
+    slices = { 0: list(hosts) }     # Every host can reach every service
+    directory = tempfile.NamedTemporaryFile(suffix='.dir', delete=False).name
+    controller = load_controller(k, slices, directory)
+
+    # The flows follow the entries installed on the simulated switches, so the counters reflect the paths
+    fabric = FluidFabric(controller, k)
+    scheduler = fabric.scheduler
+    scheduler.service_directory.publish(services)
+
+    # Traffic matrix: random clients towards random services, demand in bytes/s
+    traffic = []
+    for _ in range(n_flows):
+        src, srv = random.choice(hosts), random.choice(list(services))
+        traffic.append((src, srv, random.randint(1, 10) * 100000))
+
+    # Count the FlowMods committed by the scheduler and the paths that move a destination to another core switch
+    timings = {}
+    flowmods = [0]
+    commit = fabric.app.flow_programmer.commit
+    def counted_commit(datapath, msgs):
+        flowmods[0] += len(msgs)
+        commit(datapath, msgs)
+    fabric.app.flow_programmer.commit = counted_commit
+    switch_time = [0.0]     # Spent by the simulated switches decoding the messages, not by the controller
+    def excluded_send(buf, send):
+        start = time.perf_counter()
+        send(buf)
+        switch_time[0] += time.perf_counter() - start
+    for datapath in fabric.datapaths.values():
+        datapath.send = functools.partial(excluded_send, send=datapath.send)
+    for name in ('detect_flows', 'optimize_network'):
+        attr = f'_FlowScheduler__{name}'
+        setattr(scheduler, attr, timed(timings, name, getattr(scheduler, attr), switch_time))
+    reroutes, reroute_flowmods = [0], [0]
+    create_path = scheduler._FlowScheduler__create_path
+    def counted_create_path(dst_ip, via_switch):
+        if scheduler.paths.get(dst_ip) != via_switch:
+            reroutes[0] += 1
+        before = flowmods[0]
+        create_path(dst_ip, via_switch)
+        reroute_flowmods[0] += flowmods[0] - before
+    scheduler._FlowScheduler__create_path = timed(timings, 'create_path', counted_create_path, switch_time)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start, skipped = time.perf_counter(), switch_time[0]
+        fabric.connect()
+        connect_time = time.perf_counter() - start - (switch_time[0] - skipped)
+        connect_msgs = sum(datapath.sent_msgs for datapath in fabric.datapaths.values())
+
+        events = fabric.packet_ins([ (src, services[srv], demand) for src, srv, demand in traffic ])
+        start, skipped = time.perf_counter(), switch_time[0]
+        for ev in events:
+            fabric.app._SDNController__packet_in_handler(ev)
+        packet_in_rate = len(events) / (time.perf_counter() - start - (switch_time[0] - skipped))
+
+        # Polling rounds at the intervals chosen by the scheduler, optimizations respect the cooldown
+        fabric.set_traffic(traffic)
+        interval = scheduler.interval.value
+        for _ in range(n_rounds):
+            fabric.step(interval)
+            interval = fabric.poll()
+        fabric.scheduler.service_directory.close()
+
+    os.remove(directory)
+    calls = len(timings.get('create_path', []))
+    print(f'k={k}, switches={len(fabric.datapaths)}, hosts={len(hosts)}, services={len(services)}, flows={n_flows}, rounds={n_rounds}')
+    print(f'\t Switch connect:      {connect_msgs} messages in {connect_time * 1000:.1f} ms')
+    print(f'\t PacketIn:            {packet_in_rate:.0f} PacketIn/s')
+    for name in ('detect_flows', 'optimize_network'):
+        samples = timings.get(name, [0])
+        print(f'\t {name + ":":20} {sum(samples) / len(samples) * 1000:8.3f} ms avg, {max(samples) * 1000:8.3f} ms max ({len(timings.get(name, []))} calls)')
+    print(f'\t Reroutes:            {reroutes[0]} ({calls} paths created), '
+          f'{reroute_flowmods[0] / reroutes[0] if reroutes[0] else 0:.1f} FlowMods per reroute')
+    if 'optimize_network' not in timings:
+        print('Warning: no congestion, the scheduler never optimized the network (try more flows or rounds)', file=sys.stderr)
+    elif reroutes[0] == 0:
+        print('Warning: no reroute, every core downlink carries traffic (try fewer flows)', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    args = [ int(arg) for arg in sys.argv[1:] ]
+    k = args[0] if len(args) > 0 else 8
+    n_flows = args[1] if len(args) > 1 else 50
+    n_rounds = args[2] if len(args) > 2 else 10
+    main(k, n_flows, n_rounds)
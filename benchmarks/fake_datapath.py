@@ -0,0 +1,88 @@
+""" Fake OpenFlow datapaths used by the benchmarks to run the controller without switches """
+import pathlib
+import sys
+
+# Make the controller modules importable as they are by `ryu run network/controller.py`
+repo_path = pathlib.Path(__file__).parent.parent.resolve()
+sys.path[:0] = [ str(repo_path), str(repo_path / 'network') ]
+
+from ryu.base import app_manager    # Must be imported before ryu.controller.controller
+from ryu.ofproto import ofproto_v1_5, ofproto_v1_5_parser
+from ryu.lib.packet import packet, ethernet, ipv4
+
+
+class FakeDatapath():
+
+    def __init__(self, dpid: int) -> None:
+        """ Datapath that records the OpenFlow messages sent by the controller instead of sending them
+
+        @param dpid: The 64-bit dpid of the switch
+        """
+        self.id: int = dpid
+        self.ofproto = ofproto_v1_5
+        self.ofproto_parser = ofproto_v1_5_parser
+        self.xid: int = 0
+        self.sent_msgs: int = 0     # Number of messages sent with send_msg
+        self.sent_bytes: int = 0    # Number of bytes sent with send_msg or send
+
+
+    def set_xid(self, msg) -> int:
+        self.xid = (self.xid + 1) & self.ofproto.MAX_XID
+        msg.set_xid(self.xid)
+        return self.xid
+
+
+    def send_msg(self, msg) -> None:
+        if msg.xid is None:
+            self.set_xid(msg)
+        msg.serialize()
+        self.sent_msgs += 1
+        self.sent_bytes += len(msg.buf)
+
+
+    def send(self, buf: bytes) -> None:
+        self.sent_bytes += len(buf)
+
+
+def load_controller(k: int, slices: dict, services_directory: str):
+    """ Set the global parameters read by the controller modules, then import the controller.
+    Must be called before any other controller module (e.g. switch) is imported.
+
+    @param k: The fat-tree parameter
+    @param slices: The slices dict used for the admission control
+    @param services_directory: Path of the service directory file used by the scheduler
+    @return: The controller module
+    """
+    import globals as controller_globals
+    import network.globals as topology_globals
+    for module in (controller_globals, topology_globals):
+        module.FAT_TREE_K = k
+        module.slices = slices
+        module.SERVICES_DIRECTORY = services_directory
+    import controller
+    return controller
+
+
+def fat_tree_dpids(k: int) -> list:
+    """ Return the 64-bit dpids of all the switches of a k-ary fat-tree, as assigned by FatTreeTopo """
+    from switch import Switch
+    dpids = [ int(Switch.make_dpid(False, n, s, k), 16) for n in range(k) for s in range(k) ]
+    dpids += [ int(Switch.make_dpid(True, j, i, k), 16) for i in range(1, k // 2 + 1) for j in range(1, k // 2 + 1) ]
+    return dpids
+
+
+def ipv4_packet(src: str, dst: str) -> bytes:
+    """ Serialize an Ethernet/IPv4 packet between two hosts """
+    pkt = packet.Packet()
+    pkt.add_protocol(ethernet.ethernet(ethertype=0x0800))
+    pkt.add_protocol(ipv4.ipv4(src=src, dst=dst, proto=17))
+    pkt.serialize()
+    return bytes(pkt.data)
+
+
+def packet_in(datapath: FakeDatapath, data: bytes):
+    """ Create a PacketIn message sent by the datapath for the provided packet """
+    parser = datapath.ofproto_parser
+    msg = parser.OFPPacketIn(datapath, buffer_id=datapath.ofproto.OFP_NO_BUFFER, total_len=len(data),
+                             reason=datapath.ofproto.OFPR_TABLE_MISS, table_id=0, cookie=0, match=parser.OFPMatch(), data=data)
+    return msg
@@ -0,0 +1,450 @@
+#!/usr/bin/python3
+""" Offline fluid simulation of the fat-tree data plane, to evaluate the scheduler policies without Mininet.
+The switches apply the FlowMods and select groups actually sent by SDNController (table-miss entries raise
+PacketIns to the controller), every flow of the traffic matrix follows the flow tables hop by hop, and the
+link rates are the max-min fair share of the link capacity. Port and flow stats requests are answered from
+the simulated counters, so FlowScheduler runs unmodified on a simulated clock. Service migrations requested
+by the scheduler complete after a fixed delay.
+
+Usage: python3 benchmarks/fluid_sim.py [k] [n_scenarios] [duration]
+"""
+from fake_datapath import FakeDatapath, load_controller, ipv4_packet, packet_in
+from controller_bench import Fabric
+from ryu.controller import ofp_event
+from ryu.ofproto import ofproto_parser
+import numpy as np
+import contextlib
+import os
+import random
+import sys
+import tempfile
+import time
+import typing
+import zlib
+
+# Capacity of every link (bytes/s), 10 Mbit/s as the Mininet links of the simulation
+LINK_CAPACITY = 1.25e6
+
+
+def max_min_rates(links: np.ndarray, demands: np.ndarray, capacity: np.ndarray) -> np.ndarray:
+    """ Allocate the link capacity to the flows with progressive filling: the rates of all the flows grow
+    together until a link saturates or a flow reaches its demand, then the flows of that link are frozen.
+
+    @param links: (link x flow) incidence matrix
+    @param demands: Demand (bytes/s) of each flow
+    @param capacity: Capacity (bytes/s) of each link
+    @return: Rate (bytes/s) of each flow
+    """
+    links = links.astype(np.float64)
+    rates = np.zeros(len(demands))
+    remaining = capacity.astype(np.float64)
+    active = demands > 0
+    while active.any():
+        users = links @ active              # Active flows on each link
+        used = users > 0
+        increment = min((remaining[used] / users[used]).min(), (demands - rates)[active].min())
+        rates[active] += increment
+        remaining -= links @ np.where(active, increment, 0)
+        saturated = used & (remaining <= 1e-9 * capacity)
+        active &= ~links[saturated].any(axis=0) & (rates < demands * (1 - 1e-9))
+    return rates
+
+
+class FlowEntry():
+
+    __slots__ = ('ip', 'mask', 'priority', 'port', 'group', 'idle_timeout', 'notify', 'last_used', 'byte_count')
+
+    def __init__(self, ip: int, mask: int, priority: int, port: typing.Optional[int], group: typing.Optional[int], idle_timeout: int,
+                 notify: bool, now: float) -> None:
+        self.ip: int = ip
+        self.mask: int = mask
+        self.priority: int = priority
+        self.port: typing.Optional[int] = port
+        self.group: typing.Optional[int] = group
+        self.idle_timeout: int = idle_timeout
+        self.notify: bool = notify      # Send a FlowRemoved when the entry expires
+        self.last_used: float = now
+        self.byte_count: float = 0
+
+
+class SimDatapath(FakeDatapath):
+
+    def __init__(self, dpid: int) -> None:
+        """ Datapath that applies the FlowMods and GroupMods it receives to a simulated flow table
+
+        @param dpid: The 64-bit dpid of the switch
+        """
+        super().__init__(dpid)
+        from slice_registry import ip_to_int
+        self.ip_to_int = ip_to_int
+        self.entries: typing.Dict[typing.Tuple[int, int, int], FlowEntry] = {}    # (ip, mask, priority) -> entry
+        self.groups: typing.Dict[int, typing.Tuple[typing.List[int], np.ndarray]] = {}   # group id -> (ports, cumulative weights)
+        self.requests: list = []        # Stats and barrier requests waiting for a reply
+        self.changes: int = 0           # Incremented at every change of the flow table or the groups
+        self.now: float = 0             # Simulated time, used as installation time of the entries
+        self.cache: typing.Dict[int, typing.Optional[FlowEntry]] = {}     # Destination -> matching entry
+
+
+    def send_msg(self, msg) -> None:
+        super().send_msg(msg)
+        self.apply(msg)
+
+
+    def send(self, buf: bytes) -> None:
+        """ Decode the messages coalesced by the flow programmer, including the ones inside bundles """
+        super().send(buf)
+        ofp = self.ofproto
+        offset = 0
+        while offset < len(buf):
+            version, msg_type, msg_len, xid = ofproto_parser.header(buf[offset:])
+            body = buf[offset:offset + msg_len]
+            if msg_type == ofp.OFPT_BUNDLE_ADD_MESSAGE:
+                inner = body[16:]   # Header, bundle id, pad and flags precede the bundled message
+                version, msg_type, msg_len, xid = ofproto_parser.header(inner)
+                body = inner[:msg_len]
+            if msg_type in (ofp.OFPT_FLOW_MOD, ofp.OFPT_GROUP_MOD):
+                self.apply(ofproto_parser.msg(self, version, msg_type, msg_len, xid, body))
+            elif msg_type == ofp.OFPT_BARRIER_REQUEST:
+                request = self.ofproto_parser.OFPBarrierRequest(self)
+                request.xid = xid
+                self.requests.append(request)
+            offset += msg_len
+
+
+    def apply(self, msg) -> None:
+        """ Update the flow table or the groups, queue the requests that need a reply """
+        ofp = self.ofproto
+        parser = self.ofproto_parser
+        if isinstance(msg, parser.OFPFlowMod):
+            if 'ipv4_src' in msg.match:
+                return      # Drop entry of a denied pair, the flows of the pair are dropped by the slice policy anyway
+            dst = msg.match.get('ipv4_dst_nxm', msg.match.get('ipv4_dst', ('0.0.0.0', 0)))
+            ip, mask = dst if isinstance(dst, tuple) else (dst, 0xFFFFFFFF)
+            mask = self.ip_to_int(mask) if isinstance(mask, str) else mask
+            key = (self.ip_to_int(ip) & mask, mask, msg.priority)
+            if msg.command == ofp.OFPFC_ADD:
+                actions = [ action for inst in msg.instructions for action in getattr(inst, 'actions', []) ]
+                port = next(( action.port for action in actions if isinstance(action, parser.OFPActionOutput) ), None)
+                group = next(( action.group_id for action in actions if isinstance(action, parser.OFPActionGroup) ), None)
+                notify = bool(msg.flags & ofp.OFPFF_SEND_FLOW_REM)
+                self.entries[key] = FlowEntry(key[0], mask, msg.priority, port, group, msg.idle_timeout, notify, self.now)
+            elif msg.command == ofp.OFPFC_DELETE_STRICT:
+                self.entries.pop(key, None)
+        elif isinstance(msg, parser.OFPGroupMod):
+            if msg.command == ofp.OFPGC_DELETE:
+                self.groups.pop(msg.group_id, None)
+            else:
+                ports = [ bucket.actions[0].port for bucket in msg.buckets ]
+                weights = [ next(( prop.weight for prop in bucket.properties ), 1) for bucket in msg.buckets ]
+                self.groups[msg.group_id] = (ports, np.cumsum(weights))
+        elif isinstance(msg, (parser.OFPPortStatsRequest, parser.OFPFlowDescStatsRequest, parser.OFPBarrierRequest)):
+            self.requests.append(msg)
+            return
+        else:
+            return
+        self.changes += 1
+        self.cache = {}
+
+
+    def lookup(self, dst: int) -> typing.Optional[FlowEntry]:
+        """ Return the highest priority entry matching a destination address """
+        if dst not in self.cache:
+            matching = [ entry for entry in self.entries.values() if dst & entry.mask == entry.ip ]
+            self.cache[dst] = max(matching, key=lambda entry: entry.priority, default=None)
+        return self.cache[dst]
+
+
+    def select(self, group_id: int, flow_hash: int) -> typing.Optional[int]:
+        """ Return the port of the bucket chosen for a flow, as a switch hashing the flow headers """
+        group = self.groups.get(group_id)
+        if group is None:
+            return None
+        ports, cumulative = group
+        return ports[int(np.searchsorted(cumulative, flow_hash % cumulative[-1], side='right'))]
+
+
+    def expire(self, now: float) -> typing.List[FlowEntry]:
+        """ Remove the entries idle for longer than their idle timeout
+
+        @return: The expired entries that requested a FlowRemoved
+        """
+        expired = [ key for key, entry in self.entries.items() if entry.idle_timeout > 0 and now - entry.last_used >= entry.idle_timeout ]
+        removed = [ self.entries.pop(key) for key in expired ]
+        if len(expired) > 0:
+            self.changes += 1
+            self.cache = {}
+        return [ entry for entry in removed if entry.notify ]
+
+
+class FluidFabric(Fabric):
+
+    def __init__(self, controller, k: int, capacity: float = LINK_CAPACITY, migration_delay: float = 5) -> None:
+        """ Fat-tree with simulated switches connected to a controller instance
+
+        @param controller: The controller module returned by load_controller
+        @param k: The fat-tree parameter
+        @param capacity: Capacity of every link (bytes/s)
+        @param migration_delay: Time (seconds) needed by a service to start on its new host
+        """
+        super().__init__(controller, k)
+        self.datapaths: typing.Dict[int, SimDatapath] = { dpid: SimDatapath(dpid) for dpid in self.datapaths }
+        self.scheduler = self.app.scheduler
+        self.migration_delay: float = migration_delay
+        self.now: float = time.time()       # Simulated clock, starting from the current time
+        self.last_poll: float = self.now
+        self.app.admission.clock = lambda: self.now     # Rate limits and coalescing on the simulated clock
+        self.migrations: typing.Dict[str, float] = {}       # Service ID -> time the migration was requested
+        self.completed_migrations: int = 0
+
+        # Same ports of FatTreeTopo: (node, port) -> (peer node, peer port), hosts have a single port 0
+        self.links: typing.Dict[tuple, tuple] = {}
+        dpid = lambda core, x, y: int(self.Switch.make_dpid(core, x, y, k), 16)
+        for n in range(k):
+            for s in range(self.k_2):
+                for h in range(2, self.k_2 + 2):
+                    self.__add_link((f'10.{n}.{s}.{h}', 0), (dpid(False, n, s), h - 1))
+                for aggr in range(self.k_2, k):
+                    self.__add_link((dpid(False, n, s), aggr + 1), (dpid(False, n, aggr), s + 1))
+        for i in range(1, self.k_2 + 1):
+            for j in range(1, self.k_2 + 1):
+                for n in range(k):
+                    self.__add_link((dpid(True, j, i), n + 1), (dpid(False, n, self.k_2 + j - 1), self.k_2 + i))
+
+        self.link_index: typing.Dict[tuple, int] = { link: n for n, link in enumerate(self.links) }     # Egress (node, port) -> link
+        self.capacity = np.full(len(self.links), capacity)
+        self.link_bytes = np.zeros(len(self.links))     # Bytes transmitted on each link
+        self.link_rates = np.zeros(len(self.links))     # Rate (bytes/s) of each link in the last step
+
+        self.traffic: typing.List[typing.Tuple[str, str, float]] = []   # (source host, service ID or host IP, demand)
+        self.demands = np.zeros(0)
+        self.rates = np.zeros(0)            # Rate (bytes/s) of each flow in the last step
+        self.routes: typing.List[typing.Optional[tuple]] = []
+        self.routes_key: typing.Optional[tuple] = None
+
+
+    def __add_link(self, a: tuple, b: tuple) -> None:
+        self.links[a] = b
+        self.links[b] = a
+
+
+    def set_traffic(self, traffic: typing.List[typing.Tuple[str, str, float]]) -> None:
+        """ Set the traffic matrix
+
+        @param traffic: List of (source host IP, destination service ID or host IP, demand in bytes/s)
+        """
+        self.traffic = traffic
+        self.demands = np.array([ demand for _, _, demand in traffic ], dtype=np.float64)
+        self.routes_key = None
+
+
+    def route(self, src: str, dst: str) -> typing.Optional[tuple]:
+        """ Follow the flow tables from the source host to the destination, raising a PacketIn to the
+        controller on a table miss as the switches do
+
+        @return: (links crossed, entries matched), None if the packets are dropped
+        """
+        from slice_registry import ip_to_int
+        dst_int = ip_to_int(dst)
+        flow_hash = zlib.crc32(f'{src}>{dst}'.encode())
+        links, entries = [ self.link_index[(src, 0)] ], []
+        node = self.links[(src, 0)][0]
+
+        while not isinstance(node, str):
+            datapath = self.datapaths[node]
+            ofp = datapath.ofproto
+            entry = datapath.lookup(dst_int)
+            if entry is not None and entry.port == ofp.OFPP_CONTROLLER:
+                self.app._SDNController__packet_in_handler(ofp_event.EventOFPPacketIn(packet_in(datapath, ipv4_packet(src, dst))))
+                entry = datapath.lookup(dst_int)
+            if entry is None or entry.port == ofp.OFPP_CONTROLLER:
+                return None     # Dropped by the slice policy
+            port = entry.port if entry.group is None else datapath.select(entry.group, flow_hash)
+            if (node, port) not in self.link_index or len(links) > 6:
+                return None     # Output to a missing group or forwarding loop
+            links.append(self.link_index[(node, port)])
+            entries.append(entry)
+            node = self.links[(node, port)][0]
+
+        return (links, entries) if node == dst else None
+
+
+    def step(self, dt: float) -> None:
+        """ Advance the simulated clock: complete the due migrations, route the flows and update the counters """
+        self.now += dt
+        for datapath in self.datapaths.values():
+            datapath.now = self.now
+
+        directory = self.scheduler.service_directory
+        _, services, pending = directory.read_pending()
+        for srv in pending.keys() - self.migrations.keys():
+            self.migrations[srv] = self.now
+        for srv, requested in list(self.migrations.items()):
+            if srv not in pending:
+                del self.migrations[srv]
+            elif self.now - requested >= self.migration_delay:
+                directory.complete_migration(srv)
+                services = directory.read()[1]
+                del self.migrations[srv]
+                self.completed_migrations += 1
+
+        # Route again only if a flow table, a group or the services changed
+        key = (sum(datapath.changes for datapath in self.datapaths.values()), tuple(sorted(services.items())))
+        if key != self.routes_key:
+            self.routes = [ self.route(src, services.get(dst, dst)) for src, dst, _ in self.traffic ]
+            key = (sum(datapath.changes for datapath in self.datapaths.values()), key[1])   # PacketIns changed the tables
+            incidence = np.zeros((len(self.links), len(self.traffic)), dtype=bool)
+            for n, route in enumerate(self.routes):
+                if route is not None:
+                    incidence[route[0], n] = True
+            self.rates = max_min_rates(incidence, np.where([ route is not None for route in self.routes ], self.demands, 0), self.capacity)
+            self.link_rates = incidence @ self.rates
+            self.routes_key = key
+
+        self.link_bytes += self.link_rates * dt
+        for route, rate in zip(self.routes, self.rates):
+            if route is not None and rate > 0:
+                for entry in route[1]:
+                    entry.byte_count += rate * dt
+                    entry.last_used = self.now
+        for datapath in self.datapaths.values():
+            for entry in datapath.expire(self.now):
+                self.__flow_removed(datapath, entry)
+
+
+    def poll(self) -> float:
+        """ Run a scheduler cycle at the current simulated time
+
+        @return: The polling interval chosen by the scheduler
+        """
+        scheduler = self.scheduler
+        scheduler._FlowScheduler__send_port_stats_req()
+        scheduler.round_start = self.now
+        scheduler.round_duration = self.now - self.last_poll
+        self.last_poll = self.now
+        self.reply()
+        scheduler.port_stats.commit_round()
+        scheduler.cycle(now=self.now)
+        self.reply()    # Barriers of the FlowMods sent by the cycle
+        return scheduler.interval.update(scheduler._FlowScheduler__get_peak_rate())
+
+
+    def run(self, duration: float, dt: float = 1) -> None:
+        """ Simulate the network and the scheduler for a duration (seconds) """
+        end = self.now + duration
+        next_poll = self.now + self.scheduler.interval.value
+        while self.now < end:
+            self.step(dt)
+            if self.now >= next_poll:
+                next_poll = self.now + self.poll()
+
+
+    def reply(self) -> None:
+        """ Answer the stats and barrier requests sent by the controller """
+        for dpid, datapath in self.datapaths.items():
+            requests, datapath.requests = datapath.requests, []
+            parser = datapath.ofproto_parser
+            for request in requests:
+                if isinstance(request, parser.OFPPortStatsRequest):
+                    body = [ parser.OFPPortStats(port_no=port, tx_bytes=int(self.link_bytes[self.link_index[(dpid, port)]]),
+                                                 rx_bytes=int(self.link_bytes[self.link_index[self.links[(dpid, port)]]]))
+                             for port in range(1, self.k + 1) ]
+                    msg = parser.OFPPortStatsReply(datapath, body=body)
+                    msg.flags = 0
+                    self.app._SDNController__port_stats_reply_handler(ofp_event.EventOFPPortStatsReply(msg))
+                elif isinstance(request, parser.OFPFlowDescStatsRequest):
+                    body = [ self.__flow_desc(datapath, entry) for entry in datapath.entries.values() ]
+                    msg = parser.OFPFlowDescStatsReply(datapath, body=body)
+                    msg.flags = 0
+                    self.app._SDNController__flow_desc_stats_reply_handler(ofp_event.EventOFPFlowDescStatsReply(msg))
+                else:
+                    msg = parser.OFPBarrierReply(datapath)
+                    msg.xid = request.xid
+                    self.app._SDNController__barrier_reply_handler(ofp_event.EventOFPBarrierReply(msg))
+
+
+    def __flow_removed(self, datapath: SimDatapath, entry: FlowEntry) -> None:
+        """ Notify the controller that an entry expired """
+        from slice_registry import int_to_ip
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch(eth_type_nxm=0x0800, ipv4_dst_nxm=(int_to_ip(entry.ip), entry.mask))
+        msg = parser.OFPFlowRemoved(datapath, table_id=0, reason=datapath.ofproto.OFPRR_IDLE_TIMEOUT, priority=entry.priority,
+                                    idle_timeout=entry.idle_timeout, hard_timeout=0, cookie=0, match=match, stats=parser.OFPStats())
+        self.app._SDNController__flow_removed_handler(ofp_event.EventOFPFlowRemoved(msg))
+
+
+    def __flow_desc(self, datapath: SimDatapath, entry: FlowEntry):
+        """ Describe a flow entry as in a flow stats reply """
+        from slice_registry import int_to_ip
+        parser = datapath.ofproto_parser
+        ofp = datapath.ofproto
+        match = parser.OFPMatch(eth_type_nxm=0x0800, ipv4_dst_nxm=(int_to_ip(entry.ip), entry.mask)) if entry.mask else parser.OFPMatch(eth_type=0x0800)
+        action = parser.OFPActionOutput(entry.port) if entry.group is None else parser.OFPActionGroup(entry.group)
+        return parser.OFPFlowDesc(table_id=0, priority=entry.priority, idle_timeout=entry.idle_timeout, hard_timeout=0, flags=0,
+                                  importance=0, cookie=0, match=match, stats=parser.OFPStats(byte_count=int(entry.byte_count)),
+                                  instructions=[ parser.OFPInstructionActions(ofp.OFPIT_APPLY_ACTIONS, [ action ]) ])
+
+
+    def core_utilization(self) -> float:
+        """ Return the utilization of the busiest core switch downlink in the last step """
+        downlinks = [ n for (node, port), n in self.link_index.items() if not isinstance(node, str) and self.Switch.get(node).is_core ]
+        return float((self.link_rates[downlinks] / self.capacity[downlinks]).max())
+
+
+    def throughput(self) -> float:
+        """ Return the fraction of the traffic demand delivered in the last step """
+        return float(self.rates.sum() / self.demands.sum()) if self.demands.sum() > 0 else 1
+
+
+def random_scenario(rng: random.Random, k: int) -> typing.Tuple[dict, dict, list]:
+    """ Place k services and 2k clients on random hosts, each service in its own slice with its clients
+
+    @return: The slices, the services and the traffic matrix (client, service ID, demand)
+    """
+    hosts = [ f'10.{n}.{s}.{h}' for n in range(k) for s in range(k // 2) for h in range(2, k // 2 + 2) ]
+    chosen = rng.sample(hosts, 3 * k)
+    services = { str(n): host for n, host in enumerate(chosen[:k]) }
+    slices = { int(srv): [ host ] for srv, host in services.items() }
+    traffic = []
+    for client in chosen[k:]:
+        srv = rng.choice(list(services))
+        slices[int(srv)].append(client)
+        traffic.append((client, srv, rng.uniform(0.2, 1) * LINK_CAPACITY))
+    return slices, services, traffic
+
+
+def main(k: int, n_scenarios: int, duration: float) -> None:
+    rng = random.Random(0)
+    directory = tempfile.NamedTemporaryFile(suffix='.dir', delete=False).name
+    controller = load_controller(k, {}, directory)
+
+    results = []
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(n_scenarios):
+            slices, services, traffic = random_scenario(rng, k)
+            controller.slices = slices      # Read by the SDNController constructor
+            fabric = FluidFabric(controller, k)
+            fabric.scheduler.service_directory.publish(services)
+            fabric.connect()
+            fabric.set_traffic(traffic)
+
+            fabric.step(1)
+            before = (fabric.throughput(), fabric.core_utilization())
+            fabric.run(duration)
+            results.append((*before, fabric.throughput(), fabric.core_utilization(),
+                            len(fabric.scheduler.paths), fabric.completed_migrations))
+            fabric.scheduler.service_directory.close()
+    elapsed = time.perf_counter() - start
+    os.remove(directory)
+
+    results = np.array(results)
+    print(f'k={k}, {n_scenarios} scenarios of {duration:.0f} s simulated in {elapsed:.2f} s ({n_scenarios / elapsed:.1f} scenarios/s)')
+    print(f'\t {"":22} {"before":>8} {"after":>8}')
+    print(f'\t {"Delivered traffic:":22} {results[:, 0].mean():8.1%} {results[:, 2].mean():8.1%}')
+    print(f'\t {"Max core downlink:":22} {results[:, 1].mean():8.1%} {results[:, 3].mean():8.1%}')
+    print(f'\t Paths created: {int(results[:, 4].sum())}, migrations: {int(results[:, 5].sum())}')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(int(args[0]) if len(args) > 0 else 4, int(args[1]) if len(args) > 1 else 100, float(args[2]) if len(args) > 2 else 300)
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+""" Benchmark of the SDNController PacketIn handler throughput, building the switch descriptor of
+every PacketIn as the baseline did (string-based dpid decoding and a new port stats dict at every
+lookup) or using the interned Switch descriptors, and parsing the
+packets with the Ryu packet library or with the fixed offsets fast path. The storm replays a host of
+the slices flooding an edge switch with packets towards a host of another slice, mixed with the regular
+PacketIns, without and with the PacketIn admission (rate limits, coalescing, drop entries): the fake
+switches drop the packets matched by the drop entries, and the flood PacketIns that still reach the
+controller are counted.
+
+Usage: python3 benchmarks/packet_in.py [n_packets]
+"""
+from fake_datapath import FakeDatapath, load_controller, fat_tree_dpids, ipv4_packet, packet_in
+from ryu.controller import ofp_event
+from ryu.lib.packet import packet, ipv4
+from globals import FAT_TREE_K, slices
+from switch import Switch
+import os
+import random
+import sys
+import tempfile
+import time
+import typing
+
+
+class DropDatapath(FakeDatapath):
+
+    def __init__(self, dpid: int) -> None:
+        """ Datapath that also applies the drop entries of the denied pairs sent by the controller """
+        super().__init__(dpid)
+        self.drops: typing.Set[typing.Tuple[int, int]] = set()     # (source, destination) packed addresses
+
+
+    def send_msg(self, msg) -> None:
+        from slice_registry import ip_to_int
+        super().send_msg(msg)
+        if isinstance(msg, self.ofproto_parser.OFPFlowMod) and 'ipv4_src' in msg.match:
+            pair = tuple( ip if isinstance(ip, int) else ip_to_int(ip) for ip in (msg.match['ipv4_src'], msg.match['ipv4_dst']) )
+            self.drops.add(pair)
+        elif isinstance(msg, self.ofproto_parser.OFPFlowMod) and msg.command == self.ofproto.OFPFC_DELETE:
+            self.drops.clear()
+
+
+class PortStats():
+    """ Port counters allocated by the baseline switch descriptor """
+
+    def __init__(self, tx_bytes: int = 0, rx_bytes: int = 0) -> None:
+        self.tx_bytes: int = tx_bytes
+        self.rx_bytes: int = rx_bytes
+        self.dtx_bytes: int = tx_bytes
+        self.drx_bytes: int = rx_bytes
+        self.downlink_flows: int = 0
+
+
+class BaselineSwitch():
+    """ Copy of the switch descriptor before the interning: built at every lookup, it decodes the dpid
+    from the string of its bits (16-bit dpid written as hex digits) and allocates a port stats dict.
+    The length check of the copy still skips the decoding of the pod 0 aggregation switches.
+    """
+
+    dpids: typing.Dict[int, int] = {}   # Current 64-bit dpid -> baseline dpid of the same switch
+
+    @classmethod
+    def get(cls, dpid: int) -> 'BaselineSwitch':
+        return cls(cls.dpids[dpid])
+
+
+    @classmethod
+    def register(cls, dpid: int, k: int) -> None:
+        """ Compute the baseline dpid of a switch, as assigned by the baseline topology """
+        switch = Switch.get(dpid)
+        x, y = (switch.j, switch.i) if switch.is_core else (switch.pod, switch.swn)
+        cls.dpids[dpid] = int(bin(switch.is_core << 15 | (y < k // 2) << 14 | x << 8 | y)[2:], 16)
+
+
+    def __init__(self, dpid: int = 0) -> None:
+        self.dpid64 = dpid
+        if len(bin(dpid)) > 18:
+            dpid = self.__dpid64_to_dpid16(dpid)
+
+        self.dpid: int = dpid
+        self.is_core: bool = self.dpid >> 15
+        self.port_stats: typing.Dict[int, PortStats] = { i : PortStats(0, 0) for i in range(1, FAT_TREE_K + 1) }
+
+        if self.is_core:
+            self.j: int = (self.dpid & 0x3F00) >> 8
+            self.i: int = self.dpid & 0xFF
+            self.name: str = f"c{self.j}{self.i}"
+            self.is_edge: bool = False
+        else:
+            self.pod: int = (self.dpid & 0x3F00) >> 8
+            self.swn: int = self.dpid & 0xFF
+            self.name: str = f"p{self.pod}_s{self.swn}"
+            self.is_edge: bool = self.dpid >> 14
+
+
+    def get_uplink_port(self, dst_hostid: int, k: int) -> int:
+        k_2 = k // 2
+        return (dst_hostid - 2 + self.swn) % k_2 + k_2 + 1
+
+
+    def __dpid64_to_dpid16(self, dpid_64: int) -> int:
+        dpid_16 = ''
+        dpid_bin = bin(dpid_64)
+        for i in range(2, len(dpid_bin), 4):
+            dpid_16 += dpid_bin[i]
+        return int(dpid_16, 2)
+
+
+def full_parse(data: bytes):
+    """ Decode the whole packet with the Ryu packet library, as done before the fast path """
+    from slice_registry import ip_to_int
+    ip_pkt = packet.Packet(data).get_protocol(ipv4.ipv4)
+    return ip_to_int(ip_pkt.src), ip_to_int(ip_pkt.dst)
+
+
+def parse_rate(parse, frames: list) -> float:
+    """ Return the throughput (packets/s) of a parser """
+    start = time.perf_counter()
+    for data in frames:
+        parse(data)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def lookup_rate(switch_class, dpids: list) -> float:
+    """ Return the throughput (lookups/s) of the switch descriptor lookup done by the handler """
+    start = time.perf_counter()
+    for dpid in dpids:
+        switch_class.get(dpid).get_uplink_port(2, FAT_TREE_K)
+    return len(dpids) / (time.perf_counter() - start)
+
+
+def run(app, events: list) -> float:
+    """ Feed the PacketIn events to the controller and return the throughput (PacketIn/s) """
+    start = time.perf_counter()
+    for ev in events:
+        app._SDNController__packet_in_handler(ev)
+    return len(events) / (time.perf_counter() - start)
+
+
+def storm(app, events: list, flood) -> typing.Tuple[int, float]:
+    """ Feed the PacketIn events not dropped by the switches and return the number of flood PacketIns
+    that reached the controller and the time (seconds) spent by the handler
+    """
+    from packet_parser import parse_ipv4_addresses
+    reached, elapsed = 0, 0
+    for ev in events:
+        datapath = ev.msg.datapath
+        if len(datapath.drops) > 0 and parse_ipv4_addresses(ev.msg.data) in datapath.drops:
+            continue    # Dropped by the switch
+        reached += ev is flood
+        start = time.perf_counter()
+        app._SDNController__packet_in_handler(ev)
+        elapsed += time.perf_counter() - start
+    return reached, elapsed
+
+
+def main(n_packets: int) -> None:
+    random.seed(0)
+    directory = tempfile.NamedTemporaryFile(suffix='.dir', delete=False).name
+    controller = load_controller(FAT_TREE_K, slices, directory)
+    app = controller.SDNController(start_scheduler=False)
+    datapaths = [ DropDatapath(dpid) for dpid in fat_tree_dpids(FAT_TREE_K) if not Switch.get(dpid).is_core ]
+    for datapath in datapaths:
+        BaselineSwitch.register(datapath.id, FAT_TREE_K)
+    hosts = [ host for srvs in slices.values() for host in srvs ]
+
+    events = []
+    for _ in range(n_packets):
+        datapath = random.choice(datapaths)
+        data = ipv4_packet(random.choice(hosts), random.choice(hosts))
+        events.append(ofp_event.EventOFPPacketIn(packet_in(datapath, data)))
+
+    # A denied pair floods one edge switch, 9 PacketIns out of 10
+    edge = next( datapath for datapath in datapaths if Switch.get(datapath.id).is_edge )
+    flood = ofp_event.EventOFPPacketIn(packet_in(edge, ipv4_packet(slices[0][0], slices[1][0])))
+    storm_events = [ flood if i % 10 else event for i, event in enumerate(events) ]
+
+    frames = [ ev.msg.data for ev in events ]
+    fast_parse = controller.parse_ipv4_addresses
+    assert all(fast_parse(data) == full_parse(data) for data in frames)
+
+    admission = app.admission
+    app.admission = controller.PacketInAdmission()      # No admission, every PacketIn is handled
+    dpids = [ ev.msg.datapath.id for ev in events ]
+    baseline, interned, fast_baseline, fast, full_parser, fast_parser, baseline_lookup, interned_lookup = 0, 0, 0, 0, 0, 0, 0, 0
+    for _ in range(3):
+        controller.parse_ipv4_addresses = full_parse
+        controller.Switch = BaselineSwitch
+        baseline = max(baseline, run(app, events))
+        controller.Switch = Switch
+        interned = max(interned, run(app, events))
+        controller.parse_ipv4_addresses = fast_parse
+        fast = max(fast, run(app, events))
+        controller.Switch = BaselineSwitch
+        fast_baseline = max(fast_baseline, run(app, events))
+        controller.Switch = Switch
+        full_parser = max(full_parser, parse_rate(full_parse, frames))
+        fast_parser = max(fast_parser, parse_rate(fast_parse, frames))
+        baseline_lookup = max(baseline_lookup, lookup_rate(BaselineSwitch, dpids))
+        interned_lookup = max(interned_lookup, lookup_rate(Switch, dpids))
+    open_storm = storm(app, storm_events, flood)
+    app.admission = admission
+    guarded_storm = storm(app, storm_events, flood)
+    n_flood = sum(ev is flood for ev in storm_events)
+    os.remove(directory)
+
+    print(f'k={FAT_TREE_K}, PacketIn={n_packets}')
+    print(f'\t Baseline switch: {baseline:10.0f} PacketIn/s')
+    print(f'\t Interned switch: {interned:10.0f} PacketIn/s  ({interned / baseline:.2f}x)')
+    print(f'\t Fast path:       {fast:10.0f} PacketIn/s  ({fast / baseline:.2f}x), '
+          f'{fast_baseline:.0f} PacketIn/s with the baseline switch ({fast / fast_baseline:.2f}x from the interning)')
+    print(f'\t Lookup only:     {baseline_lookup:10.0f} switches/s with the baseline descriptor, {interned_lookup:.0f} switches/s interned')
+    print(f'\t Parsing only:    {full_parser:10.0f} packets/s with the Ryu packet library, {fast_parser:.0f} packets/s with the fast path')
+    print(f'\t Storm:           {open_storm[0]:10d} of {n_flood} flood packets reached the controller, '
+          f'handler busy {open_storm[1] * 1000:.1f} ms without admission')
+    print(f'\t                  {guarded_storm[0]:10d} of {n_flood} flood packets reached the controller, '
+          f'handler busy {guarded_storm[1] * 1000:.1f} ms with admission')
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
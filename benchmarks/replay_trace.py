@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+""" Replay a scheduler trace (SCHEDULER_TRACE) through FlowScheduler without Mininet: the port counters
+recorded at every cycle are fed to the scheduler of a controller connected to fake datapaths, so that
+optimization policies and parameters can be compared with the recorded decisions at full speed.
+The replay is open loop: the recorded stats do not reflect the decisions taken during the replay, and the
+services are reset to the ones read by every recorded optimization (with the recorded migrations completed).
+The trace must hold a single scheduler run (e.g. fluid_sim.py with one scenario).
+Traces recorded with FLOW_DETECTION = 'flows' are replayed with the port stats detection.
+
+Usage: python3 benchmarks/replay_trace.py <trace.jsonl> [replayed_trace.jsonl]
+"""
+from fake_datapath import load_controller
+from ryu.controller import ofp_event
+import collections
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+
+def summarize(cycles: list) -> collections.Counter:
+    """ Count the events recorded in the cycles of a trace """
+    summary = collections.Counter(cycles=len(cycles))
+    for cycle in cycles:
+        summary['flows'] += len(cycle['flows'])
+        summary['congestions'] += sum(1 for event, _, _ in cycle['congestions'] if event == 'begin')
+        summary['flowmods'] += len(cycle['flowmods'])
+        for decision in cycle['decisions']:
+            if decision['action'] != 'optimize':
+                summary[decision['action']] += 1
+    return summary
+
+
+def main(path: str, output: str) -> None:
+    from scheduler_trace import read_trace
+    header, cycles = read_trace(path)
+    k = header['k']
+
+    # Services and pending migrations read by every recorded optimization: the replay directory is set to
+    # the recorded snapshot before the cycle, as the simulation completed the recorded migrations
+    snapshots = [ next(( (decision['services'], decision['pending']) for decision in cycle['decisions']
+                         if decision['action'] == 'optimize' ), None) for cycle in cycles ]
+    services, pending = next(( snapshot for snapshot in snapshots if snapshot is not None ), ({}, {}))
+
+    import globals as controller_globals
+    controller_globals.SCHEDULER_TRACE = output
+    controller_globals.FLOW_DETECTION = 'ports'
+    directory = tempfile.NamedTemporaryFile(suffix='.dir', delete=False).name
+    controller = load_controller(k, { int(slice_id): hosts for slice_id, hosts in header['slices'].items() }, directory)
+
+    from controller_bench import Fabric
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        fabric = Fabric(controller, k)
+        scheduler = fabric.app.scheduler
+        scheduler.service_directory.publish(services, pending)
+        fabric.connect()
+
+        start = time.perf_counter()
+        for cycle, snapshot in zip(cycles, snapshots):
+            if snapshot is not None:
+                scheduler.service_directory.publish(*snapshot)
+            for dpid, ports in cycle['stats'].items():
+                datapath = fabric.datapaths[int(dpid)]
+                parser = datapath.ofproto_parser
+                body = [ parser.OFPPortStats(port_no=port + 1, tx_bytes=tx, rx_bytes=rx) for port, (tx, rx) in enumerate(ports) ]
+                msg = parser.OFPPortStatsReply(datapath, body=body)
+                fabric.app._SDNController__port_stats_reply_handler(ofp_event.EventOFPPortStatsReply(msg))
+            scheduler.round_start = cycle['t']
+            scheduler.round_duration = cycle['round_duration']
+            scheduler.port_stats.commit_round()
+            scheduler.cycle(now=cycle['t'])
+        elapsed = time.perf_counter() - start
+        scheduler.trace.close()
+
+    os.remove(directory)
+    recorded, replayed = summarize(cycles), summarize(read_trace(output)[1])
+    print(f'k={k}, {len(cycles)} cycles replayed in {elapsed * 1000:.1f} ms ({len(cycles) / elapsed:.0f} cycles/s)')
+    print(f'\t {"":14} {"recorded":>9} {"replayed":>9}')
+    for name in ('flows', 'congestions', 'reroute', 'migrate', 'keep', 'flowmods'):
+        print(f'\t {name + ":":14} {recorded[name]:9} {replayed[name]:9}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        exit(__doc__)
+    main(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else tempfile.NamedTemporaryFile(suffix='.jsonl', delete=False).name)
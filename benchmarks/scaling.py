@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+""" Benchmark of the fat-tree scaling: time to build the FatTreeTopo graph (requires Mininet and Comnetsemu)
+and to bring up the controller with every switch of the fabric connected, for increasing values of k.
+
+Usage: python3 benchmarks/scaling.py [k ...]
+"""
+from fake_datapath import load_controller
+from controller_bench import Fabric
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+
+def build_topology(k: int) -> str:
+    """ Return the time needed to build the Mininet topology graph, without starting the network """
+    try:
+        from network.topology import FatTreeTopo
+    except ImportError:
+        return '     n/a'   # Mininet or Comnetsemu not installed
+    start = time.perf_counter()
+    FatTreeTopo(k)
+    return f'{(time.perf_counter() - start) * 1000:8.1f}'
+
+
+def main(ks: list) -> None:
+    directory = tempfile.NamedTemporaryFile(suffix='.dir', delete=False).name
+    controller = load_controller(ks[0], {}, directory)
+
+    print(f'{"k":>4} {"switches":>9} {"hosts":>7} {"topo (ms)":>10} {"init (ms)":>10} {"connect (ms)":>13} {"messages":>9} {"round (ms)":>11}')
+    for k in ks:
+        topo_time = build_topology(k)
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            fabric = Fabric(controller, k)
+            init_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            fabric.connect()
+            connect_time = time.perf_counter() - start
+
+            # First polling round of the scheduler, without traffic
+            scheduler = fabric.app.scheduler
+            start = time.perf_counter()
+            fabric.stats_round()
+            scheduler.port_stats.commit_round()
+            scheduler._FlowScheduler__detect_flows()
+            round_time = time.perf_counter() - start
+
+        messages = sum(datapath.sent_msgs for datapath in fabric.datapaths.values())
+        print(f'{k:4} {len(fabric.datapaths):9} {len(fabric.hosts):7} {topo_time:>10} {init_time * 1000:10.1f} '
+              f'{connect_time * 1000:13.1f} {messages:9} {round_time * 1000:11.2f}')
+        fabric.app.scheduler.service_directory.close()
+
+    os.remove(directory)
+
+
+if __name__ == '__main__':
+    main([ int(arg) for arg in sys.argv[1:] ] or [4, 8, 16, 32])
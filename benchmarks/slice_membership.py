@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+""" Micro-benchmark of the PacketIn slice admission check: list scan over the slices
+dict (previous implementation) against the SliceRegistry index.
+
+Usage: python3 benchmarks/slice_membership.py [k] [n_slices] [n_lookups]
+"""
+import pathlib
+import random
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve() / 'network'))
+from slice_registry import SliceRegistry, ip_to_int
+
+
+def build_slices(k: int, n_slices: int) -> dict:
+    """ Randomly assign every host of a k-ary fat-tree to one of n_slices slices """
+    hosts = [ f'10.{pod}.{s}.{h}' for pod in range(k) for s in range(k // 2) for h in range(2, k // 2 + 2) ]
+    slices = { i: [] for i in range(n_slices) }
+    for host in hosts:
+        slices[random.randrange(n_slices)].append(host)
+    return slices
+
+
+def main(k: int, n_slices: int, n_lookups: int) -> None:
+    random.seed(0)
+    slices = build_slices(k, n_slices)
+    hosts = [ host for srvs in slices.values() for host in srvs ]
+    pairs = [ (random.choice(hosts), random.choice(hosts)) for _ in range(n_lookups) ]
+    packed_pairs = [ (ip_to_int(src), ip_to_int(dst)) for src, dst in pairs ]
+    registry = SliceRegistry(slices)
+
+    def list_scan():
+        for src, dst in pairs:
+            any( src in slice and dst in slice for slice in slices.values() )
+
+    def registry_lookup():
+        for src, dst in packed_pairs:
+            registry.is_allowed(src, dst)
+
+    scan_time = min(timeit.repeat(list_scan, number=1, repeat=3))
+    registry_time = min(timeit.repeat(registry_lookup, number=1, repeat=3))
+
+    print(f'k={k}, hosts={len(hosts)}, slices={n_slices}, lookups={n_lookups}')
+    print(f'\t List scan: {n_lookups / scan_time:12.0f} lookups/s')
+    print(f'\t Registry:  {n_lookups / registry_time:12.0f} lookups/s  ({scan_time / registry_time:.1f}x)')
+
+
+if __name__ == '__main__':
+    args = [ int(arg) for arg in sys.argv[1:] ]
+    k = args[0] if len(args) > 0 else 16
+    n_slices = args[1] if len(args) > 1 else 200
+    n_lookups = args[2] if len(args) > 2 else 10000
+    main(k, n_slices, n_lookups)
@@ -2,60 +2,221 @@ from mininet.node import OVSKernelSwitch, RemoteController
 from mininet.cli import CLI
 from mininet.link import TCLink
 from comnetsemu.net import Containernet, VNFManager, APPContainer
-from network.globals import FAT_TREE_K, services, clients
+from mininet.util import natural
+from network.globals import FAT_TREE_K, SERVICES_DIRECTORY, BRINGUP_WORKERS, DEFER_UNUSED_HOSTS, services, clients, slices
+from network.globals import MIGRATION_READY_TIMEOUT, MIGRATION_DRAIN, STANDBY_PER_POD, CLIENT_LOAD, SERVICE_PAYLOAD
 from network.topology import FatTreeTopo 
+from network.slice_registry import ip_to_int
+from services.service_directory import ServiceDirectory
+from concurrent.futures import ThreadPoolExecutor
 from os import system
-import pickle
+from threading import Lock, Timer
+import contextlib
+import itertools
 import pathlib
 import time
 import typing
 
 
+class StagedContainernet(Containernet):
+
+    def __init__(self, *args, workers: int = 8, timings: typing.Optional[typing.Dict[str, float]] = None, **kwargs) -> None:
+        """ Containernet that creates the Docker hosts of the topology concurrently, before the switches and links
+
+        @param workers: Maximum number of hosts created at the same time
+        @param timings: Dict where to save the duration (seconds) of the build stages
+        """
+        self.workers: int = workers
+        self.timings: typing.Dict[str, float] = timings if timings is not None else {}
+        super().__init__(*args, **kwargs)
+
+
+    def buildFromTopo(self, topo=None) -> None:
+        # MACs are assigned by the topology, since the counter used by autoSetMacs is not thread safe
+        hosts = [ (name, topo.nodeInfo(name)) for name in topo.hosts() ]
+        with stage('hosts', self.timings):
+            with ThreadPoolExecutor(self.workers) as pool:
+                list(pool.map(lambda host: Containernet.addHost(self, host[0], **host[1]), hosts))
+            self.hosts.sort(key=lambda host: natural(host.name))     # p2_* before p10_*
+
+        # The hosts already created are skipped by addHost
+        with stage('switches and links', self.timings):
+            super().buildFromTopo(topo)
+
+
+    def addHost(self, name: str, cls=None, **params):
+        if name in self.nameToNode:
+            return self.nameToNode[name]
+        return super().addHost(name, cls, **params)
+
+
 mgr: VNFManager = None
+net: StagedContainernet = None
+topo: FatTreeTopo = None
+directory: ServiceDirectory = None
 running_services: typing.Dict[str, str] = {}    # Local list of running services, 
-                                                # to be compared to the global one save in services.obj
+                                                # to be compared to the global one in the service directory
+containers: typing.Dict[str, str] = {}          # Service -> name of the container running it
+standby: typing.Dict[str, str] = {}             # Hostname -> name of the standby container started on it
+standby_names = itertools.count()               # Suffix of the standby container names, never reused
+draining: typing.Set[str] = set()               # Hosts whose old service container is still serving (drain period)
+migrating: typing.Set[str] = set()              # Services with a migration in progress
+standby_lock = Lock()
 abs_path = pathlib.Path(__file__).parent.resolve()
 
 
-def migrate_service(name: str, old_ip: str, new_ip: str) -> APPContainer:
-    """ Move the container running on a host to a new host
+def migrate_service(name: str, old_ip: str, new_ip: str) -> None:
+    """ Move a service to a new host, make before break: the new container is started (or a standby
+    container is adopted) and probed until it answers, then the migration is completed in the service
+    directory so that the clients switch to it, and the old container is removed after a drain period.
+    If the new container cannot be started, the migration is cancelled and the service keeps its host.
 
+    @param name: The ID of the service
     @param old_ip: The IP address of the host running the container
     @param new_ip: The IP address of the host where to run the new container
     """
-    old_hostname = get_hostname(old_ip)
+    start = time.perf_counter()
+    old_container = containers.get(name)
+    completed = False
+    try:
+        start_service(name, new_ip)
+        if not wait_ready(new_ip, MIGRATION_READY_TIMEOUT):
+            print(f'Service {name} not ready on host {new_ip} after {MIGRATION_READY_TIMEOUT} s, migrating anyway')
 
-    new_srv = spawn_service(name, new_ip)
-    
+        directory.complete_migration(name)
+        completed = True
+        running_services[name] = new_ip
+        print(f'Migrated service {name} to host {new_ip} in {time.perf_counter() - start:.2f} s')
+
+        # Let the clients switch to the new host before removing the old container
+        if old_container is not None:
+            with standby_lock:
+                draining.add(old_ip)
+            Timer(MIGRATION_DRAIN, drain_container, [old_container, old_ip]).start()
+        fill_standby(int(new_ip.split('.')[1]))
+    except Exception as ex:
+        print(f'Migration of service {name} from host {old_ip} to host {new_ip} failed: {ex!r}')
+        if not completed:
+            # Release the pending migration, so that the scheduler can place the service again
+            directory.cancel_migration(name)
+            new_container = containers.get(name)
+            if new_container is not None and new_container != old_container:
+                try:
+                    remove_container(new_container)
+                except Exception as error:
+                    print(f'Cannot remove container {new_container}: {error!r}')
+            if old_container is not None:
+                containers[name] = old_container
+            running_services[name] = old_ip
+    finally:
+        migrating.discard(name)
+
+
+def start_service(name: str, ip: str) -> None:
+    """ Run a service on a host, adopting the standby container of the host if there is one
+
+    @param name: The ID of the service
+    @param ip: The IP Address of the target host
+    """
+    hostname = get_hostname(ip)
+    with standby_lock:
+        container = standby.pop(hostname, None)
+    if container is not None:
+        containers[name] = container
+        print(f'Adopted standby container on host {ip} for service {name}')
+    else:
+        add_deferred_host(hostname)
+        spawn_service(name, ip)
+
+
+def fill_standby(pod: int) -> None:
+    """ Start standby containers on the first free hosts of a pod, the ones preferred by the placement.
+    Hosts still serving an old container during its drain period are not free.
+
+    @param pod: The pod
+    """
+    if STANDBY_PER_POD == 0:
+        return
+    _, current, pending = directory.read_pending()
+    with standby_lock:
+        used = set(current.values()) | set(pending.values()) | set(running_services.values()) | draining
+    k_2 = FAT_TREE_K // 2
+    free = sorted(( f'10.{pod}.{s}.{h}' for s in range(k_2) for h in range(2, k_2 + 2) if f'10.{pod}.{s}.{h}' not in used ), key=ip_to_int)
+    for ip in free[:STANDBY_PER_POD]:
+        hostname = get_hostname(ip)
+        with standby_lock:
+            if hostname in standby:
+                continue
+            container = standby[hostname] = f'standby{next(standby_names)}_{hostname}'    # Unique, an adopted standby keeps its name
+        add_deferred_host(hostname)
+        spawn_service(None, ip, container)
+
+
+def wait_ready(ip: str, timeout: float) -> bool:
+    """ Probe the service port of a host until it accepts connections
+
+    @param ip: The IP address of the host
+    @param timeout: Maximum waiting time in seconds
+    @return True if the service is ready, False if the timeout expired
+    """
+    host = net[get_hostname(ip)]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if 'ready' in host.cmd(f"bash -c 'echo > /dev/tcp/{ip}/8080' 2>/dev/null && echo ready"):
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def drain_container(name: str, ip: str) -> None:
+    """ Remove the old container of a migrated service at the end of the drain period, then release its host
+
+    @param name: The name of the container
+    @param ip: The IP address of the host running the container
+    """
+    try:
+        remove_container(name)
+    finally:
+        with standby_lock:
+            draining.discard(ip)
+
+
+def remove_container(name: str) -> None:
+    """ Remove a container
+
+    @param name: The name of the container
+    """
     try:   
-        mgr.removeContainer( f'srv{name}_{old_hostname}' )
+        mgr.removeContainer(name)
     except:
         # Workaround to fix Permission Denied error on container removal
-        system(f'docker exec -it srv{name}_{old_hostname} kill 1')
-        mgr.removeContainer( f'srv{name}_{old_hostname}' )
-    
-    running_services[name] = new_ip
-    return new_srv
+        system(f'docker exec -it {name} kill 1')
+        mgr.removeContainer(name)
 
 
-def spawn_service(name: str, ip: str) -> APPContainer:
+def spawn_service(name: typing.Optional[str], ip: str, container: typing.Optional[str] = None) -> APPContainer:
     """ Run a new container as a service inside specified host
 
-    @param name: The name of the container
+    @param name: The ID of the service, None for a standby container
     @param ip: The IP Address of the target host
+    @param container: The name of the container, srv{name}_{hostname} by default
     @return The created container object  
     """
     hostname = get_hostname(ip)
-    running_services[name] = ip
-    return mgr.addContainer( 
-        name=f'srv{name}_{hostname}', 
+    container = container or f'srv{name}_{hostname}'
+    app = mgr.addContainer( 
+        name=container, 
         dhost=hostname, 
         dimage='service_migration', 
-        dcmd='python3 /home/server.py ' + ip, 
+        dcmd=f'python3 /home/server.py {ip} --payload {SERVICE_PAYLOAD}', 
         docker_args={
             'volumes': {f'{abs_path}/services/' : { 'bind': '/home', 'mode': 'ro' } } 
         }
     )
+    if name is not None:    # Only once the container exists
+        running_services[name] = ip
+        containers[name] = container
+    return app
 
 
 def spawn_client(name: str, host: str, target_srv: str) -> APPContainer:
@@ -66,17 +227,60 @@ def spawn_client(name: str, host: str, target_srv: str) -> APPContainer:
     @param target_srv: The service IP that the client will connect to
     @return The created container object  
     """
+    dcmd = 'python3 /home/client.py ' + target_srv
+    volumes = {f'{abs_path}/services/' : { 'bind': '/home', 'mode': 'ro' } }
+    if CLIENT_LOAD is not None:
+        # Load generator mode, results of every client are saved in results/<client name>.jsonl
+        (abs_path / 'results').mkdir(exist_ok=True)
+        dcmd += f' {CLIENT_LOAD} --results /results/{name}.jsonl'
+        volumes[f'{abs_path}/results/'] = { 'bind': '/results', 'mode': 'rw' }
     return mgr.addContainer(
         name=name,
         dhost=host,
         dimage='service_migration',
-        dcmd='python3 /home/client.py ' + target_srv,
+        dcmd=dcmd,
         docker_args={
-            'volumes': {f'{abs_path}/services/' : { 'bind': '/home', 'mode': 'ro' } } 
+            'volumes': volumes
         }
     )
 
 
+def add_deferred_host(hostname: str) -> None:
+    """ Create a host that was deferred at startup, if not created yet, and connect it to its edge switch
+
+    @param hostname: The mininet host name
+    """
+    if hostname not in topo.deferred:
+        return
+    params, switch, port = topo.deferred.pop(hostname)
+    start = time.perf_counter()
+    host = net.addHost(hostname, **params)
+    link = net.addLink(host, net[switch], port2=port)
+    net[switch].attach(link.intf2)
+    host.configDefault()
+    for other in net.hosts:
+        if other is not host:
+            other.setARP(host.IP(), host.MAC())
+            host.setARP(other.IP(), other.MAC())
+    print(f'Added deferred host {hostname} in {time.perf_counter() - start:.2f} s')
+
+
+def get_used_hosts() -> typing.Set[str]:
+    """ Return the names of the hosts used by the slices, the services and the clients """
+    hosts = { get_hostname(ip) for slice_hosts in slices.values() for ip in slice_hosts }
+    hosts |= { get_hostname(ip) for ip in services.values() }
+    hosts |= { c_host for _, c_host, _ in clients }
+    return hosts
+
+
+@contextlib.contextmanager
+def stage(name: str, timings: typing.Dict[str, float]):
+    """ Save the duration of a bring-up stage in timings[name] """
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
 def get_hostname(ip: str) -> str:
     """ Get mininet host name given its ip address
     
@@ -88,14 +292,17 @@ def get_hostname(ip: str) -> str:
 
 
 def main():
-    # Dump services dict to make it globally available
-    global services
-    with open('./services/services.obj', 'wb') as file:
-        pickle.dump(services, file)
+    # Publish services dict to make it globally available
+    global services, directory
+    directory = ServiceDirectory(SERVICES_DIRECTORY, writable=True)
+    version = directory.publish(services)
 
     # Create topology and start network
-    topo = FatTreeTopo(FAT_TREE_K)
-    net = Containernet(
+    global mgr, net, topo
+    timings = {}
+    with stage('topology', timings):
+        topo = FatTreeTopo(FAT_TREE_K, get_used_hosts() if DEFER_UNUSED_HOSTS else None)
+    net = StagedContainernet(
         topo=topo,
         controller = RemoteController("c0", ip="127.0.0.1"),
         switch=OVSKernelSwitch,
@@ -103,45 +310,57 @@ def main():
         autoSetMacs=True,
         autoStaticArp=True,
         link=TCLink,
+        workers=BRINGUP_WORKERS,
+        timings=timings,
     )
-
-    global mgr
     mgr = VNFManager(net)
 
-    net.build()
-    net.start()
-    
-    # Spawn clients
-    for c_name, c_host, target in clients:
-        spawn_client(name=c_name, host=c_host, target_srv=target)
+    with stage('build', timings):
+        net.build()
+    with stage('start', timings):
+        net.start()
+
+    with ThreadPoolExecutor(BRINGUP_WORKERS) as pool:
+        # Spawn services and clients
+        with stage('services', timings):
+            list(pool.map(lambda srv: spawn_service(*srv), services.items()))
+        with stage('clients', timings):
+            list(pool.map(lambda client: spawn_client(name=client[0], host=client[1], target_srv=client[2]), clients))
+        with stage('standby', timings):
+            list(pool.map(fill_standby, range(FAT_TREE_K)))
+
+    print(f'Bring-up of {len(net.hosts)} hosts ({len(topo.deferred)} deferred):')
+    for name, duration in timings.items():
+        print(f'\t {name + ":":20} {duration:8.2f} s')
 
     simulation_running = True
+    migrations = ThreadPoolExecutor(BRINGUP_WORKERS)
+    pending = {}
     
     while simulation_running:
         try:
-            # Check if services were updated by scheduler
+            # Check for updates on services
             for srv, ip in services.items():
-
-                # Load services
-                with open('./services/services.obj', 'rb') as file:
-                    services = pickle.load(file)
-
-                # Check for updates on services
                 if srv not in running_services.keys():
                     # A new service was spawned
-                    spawn_service(srv, ip)
+                    start_service(srv, ip)
                     print(f'Created service {srv} on host {ip}')
-                if running_services[srv] != ip:
-                    # A service must be migrated
-                    migrate_service(srv, running_services[srv], ip)
-                    print(f'Migrated service {srv} to host {ip}')
-
-            time.sleep(2)
-        except EOFError:
-            print('Cannot access services.obj file')
+                if srv in migrating:
+                    continue
+                target = pending.get(srv, ip)
+                if running_services[srv] != target:
+                    # A service must be migrated, requested by the scheduler or moved in the directory
+                    migrating.add(srv)
+                    migrations.submit(migrate_service, srv, running_services[srv], target)
+
+            # Wait for the scheduler to update the services
+            version, _ = directory.wait(version)
+            version, services, pending = directory.read_pending()
         except KeyboardInterrupt:
             simulation_running = False
 
+    migrations.shutdown()
+
     CLI(net)
     net.stop()
 
@@ -0,0 +1,69 @@
+from switch import Switch
+import typing
+
+CONGESTION_BEGIN = 'begin'
+CONGESTION_END = 'end'
+
+
+class DownLink():
+
+    def __init__(self, switch: Switch, dst_pod: int):
+        self.switch: Switch = switch
+        self.dst_pod: int = dst_pod
+
+
+class CongestionIndex():
+
+    def __init__(self) -> None:
+        """ Count the flows of every downlink (core switch, destination pod) as flows are added and expire,
+        so that the congested downlinks are known without recounting all the flows at every round.
+        """
+        self.flows: typing.Dict[typing.Tuple[int, int], int] = {}                 # (core dpid, dst pod) -> number of flows
+        self.congestions: typing.Dict[typing.Tuple[int, int], DownLink] = {}      # Downlinks with more than one flow
+        self.__listeners: typing.List[typing.Callable] = []                      # Called when a congestion begins or ends
+
+
+    def add_listener(self, callback: typing.Callable) -> None:
+        """ Register a callback to be invoked with (CONGESTION_BEGIN | CONGESTION_END, DownLink)
+        every time a downlink becomes congested or is no longer congested
+
+        @param callback: The function to call
+        """
+        self.__listeners.append(callback)
+
+
+    def add(self, dpid: int, dst_pod: int) -> None:
+        """ Count a new flow on a downlink
+
+        @param dpid: The 64-bit datapath id of the core switch
+        @param dst_pod: The pod reached by the downlink
+        """
+        key = (dpid, dst_pod)
+        count = self.flows.get(key, 0) + 1
+        self.flows[key] = count
+        if count == 2:
+            downlink = DownLink(Switch.get(dpid), dst_pod)
+            self.congestions[key] = downlink
+            self.__notify(CONGESTION_BEGIN, downlink)
+
+
+    def remove(self, dpid: int, dst_pod: int) -> None:
+        """ Forget an expired flow on a downlink
+
+        @param dpid: The 64-bit datapath id of the core switch
+        @param dst_pod: The pod reached by the downlink
+        """
+        key = (dpid, dst_pod)
+        count = self.flows.get(key, 0) - 1
+        if count <= 0:
+            self.flows.pop(key, None)
+        else:
+            self.flows[key] = count
+        if count == 1:
+            self.__notify(CONGESTION_END, self.congestions.pop(key))
+
+
+    def __notify(self, event: str, downlink: DownLink) -> None:
+        """ Inform the listeners that a congestion began or ended """
+        for callback in self.__listeners:
+            callback(event, downlink)
@@ -4,25 +4,63 @@ from ryu.controller.controller import Datapath
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_5
-from ryu.lib.packet import packet, ipv4
+from ryu.lib import hub
 from switch import Switch
-from globals import FAT_TREE_K, slices
+from globals import FAT_TREE_K, PROACTIVE_ROUTING, FLOW_BUNDLES, ECMP_GROUPS, METRICS_PORT, slices
+from globals import FLOW_TABLE_BUDGET, FLOW_TABLE_AGGREGATION, FLOW_DETECTION
+from globals import PACKET_IN_SWITCH_RATE, PACKET_IN_SWITCH_BURST, PACKET_IN_SOURCE_RATE, PACKET_IN_SOURCE_BURST, PACKET_IN_COALESCE, DENY_TIMEOUT
 from flow_scheduler import FlowScheduler
+from flow_programmer import FlowProgrammer
+from flow_table import DROP_PRIORITY
+from slice_registry import SliceRegistry
+from packet_parser import parse_ipv4_addresses
+from packet_in_admission import PacketInAdmission
+from uplink_compiler import UplinkCompiler
+from uplink_groups import UplinkGroups, UPLINK_GROUP
+from metrics import REGISTRY
+from time import perf_counter, time
 import typing
 
+PACKET_IN = REGISTRY.histogram('sdn_packet_in_seconds', 'PacketIn handler latency').labels()
+PACKET_IN_DENIED = REGISTRY.counter('sdn_packet_in_denied_total', 'PacketIns dropped by the slice policy').labels()
+PACKET_IN_DROPPED = REGISTRY.counter('sdn_packet_in_dropped_total', 'PacketIns dropped by the admission', ('reason',))
+SWITCH_LIMITED = PACKET_IN_DROPPED.labels('switch_rate')
+SOURCE_LIMITED = PACKET_IN_DROPPED.labels('source_rate')
+COALESCED = PACKET_IN_DROPPED.labels('coalesced')
+FLOW_MODS = REGISTRY.counter('sdn_flow_mods_total', 'FlowMods sent to the switches', ('source',)).labels('two_level')
+STATS_REPLY_LAG = REGISTRY.histogram('sdn_stats_reply_lag_seconds', 'Time from the port stats request of the round to the reply').labels()
+
+DROP_COOKIE = 0xD0   # Cookie of the drop entries of the denied pairs, to remove them all when the slices change
+
 
 class SDNController(app_manager.RyuApp):
 
     OFP_VERSIONS = [ ofproto_v1_5.OFP_VERSION ]
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, k: int = FAT_TREE_K, start_scheduler: bool = True, **kwargs):
         super(SDNController, self).__init__(*args, **kwargs)
-        self.k: int = FAT_TREE_K
-        self.k_2: int = int(FAT_TREE_K / 2)       
+        self.k: int = k
+        self.k_2: int = int(k / 2)
         self.switches: typing.Dict[int, Datapath] = {}    # Contains all the datapaths connected to the controller
+        self.slice_registry = SliceRegistry(slices)         # Host -> slices index used for admission control
+        self.flow_programmer = FlowProgrammer(self.build_two_level_flow, self.build_delete_two_level_flow, FLOW_BUNDLES, FLOW_TABLE_BUDGET,
+                                              FLOW_TABLE_AGGREGATION and (FLOW_DETECTION != 'flows' or ECMP_GROUPS))    # Flow detection needs the /32 counters
+
+        self.uplink_groups = UplinkGroups(self.k, self.switches) if ECMP_GROUPS else None
+        self.uplink_compiler = UplinkCompiler(self.k, self.switches, self.slice_registry, self.flow_programmer, self.uplink_groups is not None)
+        if PROACTIVE_ROUTING:
+            self.slice_registry.add_listener(self.uplink_compiler.update)
+
+        self.admission = PacketInAdmission(PACKET_IN_SWITCH_RATE, PACKET_IN_SWITCH_BURST, PACKET_IN_SOURCE_RATE, PACKET_IN_SOURCE_BURST,
+                                           PACKET_IN_COALESCE, DENY_TIMEOUT)
+        self.slice_registry.add_listener(self.__delete_drop_flows)     # Pairs denied so far may be allowed now
         
-        self.scheduler = FlowScheduler(self.switches, self.add_two_level_flow)
-        self.scheduler.start()  
+        self.scheduler = FlowScheduler(self.k, self.switches, self.flow_programmer, self.slice_registry, self.uplink_groups)
+        if start_scheduler:     # Disabled by the benchmarks, which drive the scheduler directly
+            self.scheduler.start()  
+
+        if METRICS_PORT is not None and start_scheduler:
+            hub.spawn(hub.WSGIServer(('127.0.0.1', METRICS_PORT), REGISTRY.wsgi_app).serve_forever)
 
 
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
@@ -32,22 +70,31 @@ class SDNController(app_manager.RyuApp):
         Configuration of the pod switches for outgoing traffic is left to the MAIN_DISPATCHER to enable slicing.
         """
         datapath: Datapath = ev.msg.datapath
-        switch = Switch(datapath.id)
+        switch = Switch.get(datapath.id)
         self.switches[datapath.id] = datapath
+        self.flow_programmer.reset(datapath.id)     # The flow table of the switch is empty
 
         # Install two-levels routing rules
         if switch.is_core:
             # Config core switch routing
             for pod in range(self.k):
-                self.add_two_level_flow(datapath, ip=f"10.{pod}.0.0", mask=0xFFFF0000, port=pod+1)
+                self.add_two_level_flow(datapath, ip=f"10.{pod}.0.0", mask=0xFFFF0000, port=pod+1, static=True)
         else:
             # Config pod switch routing
             if switch.is_edge:  # Config edge switch routing
                 for hostid in range(2, self.k_2 + 2):
-                    self.add_two_level_flow(datapath, ip=f"10.{switch.pod}.{switch.swn}.{hostid}", mask=0xFFFFFFFF, port=hostid-1)
+                    self.add_two_level_flow(datapath, ip=f"10.{switch.pod}.{switch.swn}.{hostid}", mask=0xFFFFFFFF, port=hostid-1, static=True)
             else:   # Config aggregate switch routing
                 for sub in range(self.k_2):
-                    self.add_two_level_flow(datapath, ip=f"10.{switch.pod}.{sub}.0", mask=0xFFFFFF00, port=sub+1)
+                    self.add_two_level_flow(datapath, ip=f"10.{switch.pod}.{sub}.0", mask=0xFFFFFF00, port=sub+1, static=True)
+
+            # Create the uplink group before the entries that point to it
+            if self.uplink_groups is not None:
+                self.uplink_groups.install(datapath)
+
+            # Install uplink routes towards the destinations allowed by the slices
+            if PROACTIVE_ROUTING:
+                self.uplink_compiler.install(datapath)
 
         # Install table-miss flow entry
         match = datapath.ofproto_parser.OFPMatch(eth_type=0x0800)   # Install to IPv4 only 
@@ -62,35 +109,107 @@ class SDNController(app_manager.RyuApp):
         Get ip src and dst, check whether hosts can communicate based on slice policy, install flow if granted by policy.
         Only Pod switches are configured for slicing (not core switches), therefore pkts with wrong destination are dropped at the first stage.
         """
-        msg = ev.msg
-        switch = Switch(msg.datapath.id)
-        ip_pkt = packet.Packet(msg.data).get_protocol(ipv4.ipv4)
-        dst_hostid = int(ip_pkt.dst.split('.')[3])
+        start = perf_counter()
+        self.__handle_packet_in(ev.msg)
+        PACKET_IN.observe(perf_counter() - start)
+
+
+    def __handle_packet_in(self, msg) -> None:
+        """ Admit the PacketIn and install the entry towards its destination, or a drop entry if the pair is denied.
+        PacketIns above the rate of the switch or of the source host are ignored, as well as the ones for a destination
+        just installed on the switch (packets queued before the entry was applied).
+        """
+        datapath = msg.datapath
+        if not self.admission.admit_switch(datapath.id):
+            SWITCH_LIMITED.inc()
+            return
+        addresses = parse_ipv4_addresses(msg.data)
+        if addresses is None:
+            return
+        src, dst = addresses
+        allowed = self.slice_registry.is_allowed(src, dst)
+
+        # Duplicates of a destination just installed do not consume the tokens of the source
+        if allowed and self.admission.coalesce(datapath.id, dst):
+            COALESCED.inc()
+            return
+        if not self.admission.admit_source(src):
+            SOURCE_LIMITED.inc()
+            return
 
         # Check that src is in the same slice of dst
-        if not any( ip_pkt.src in slice and ip_pkt.dst in slice for slice in slices.values() ):
+        if not allowed:
+            PACKET_IN_DENIED.inc()
+            if self.admission.deny(datapath.id, src, dst):     # Stop the next packets of the pair at the switch
+                datapath.send_msg(self.build_drop_flow(datapath, src, dst, self.admission.deny_timeout))
+                FLOW_MODS.inc()
             return
 
-        port = (dst_hostid - 2 + switch.swn) % self.k_2 + self.k_2
-        self.add_two_level_flow(msg.datapath, ip=ip_pkt.dst, mask=0xFFFFFFFF, port=port+1, timeout=30)
+        switch = Switch.get(datapath.id)
+        port = switch.get_uplink_port(dst & 0xFF, self.k)      # Host ID is the last byte of the address
+        group = UPLINK_GROUP if self.uplink_groups is not None else None
+        self.admission.mark_sent(datapath.id, dst)     # Only now, a rejected PacketIn must not hold back the others
+        self.add_two_level_flow(datapath, ip=dst, mask=0xFFFFFFFF, port=port, timeout=30, group=group)
 
 
     @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
     def __port_stats_reply_handler(self, ev) -> None:
         """ Forward port stats event to the scheduler """
+        if self.scheduler.round_start is not None:
+            STATS_REPLY_LAG.observe(time() - self.scheduler.round_start)
         self.scheduler.save_port_stats(ev.msg.datapath.id, ev.msg.body)
 
 
-    def add_two_level_flow(self, datapath, ip: str, mask: int, port: int, timeout: int = 0, priority: int = 1) -> None:
+    @set_ev_cls(ofp_event.EventOFPFlowDescStatsReply, MAIN_DISPATCHER)
+    def __flow_desc_stats_reply_handler(self, ev) -> None:
+        """ Forward flow stats event to the flow programmer and to the scheduler """
+        more = bool(ev.msg.flags & ev.msg.datapath.ofproto.OFPMPF_REPLY_MORE)
+        self.flow_programmer.flow_stats(ev.msg.datapath.id, ev.msg.body)
+        self.scheduler.save_flow_stats(ev.msg.datapath.id, ev.msg.body, more)
+
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def __flow_removed_handler(self, ev) -> None:
+        """ Remove the expired entries from the shadow of the flow table """
+        msg = ev.msg
+        if msg.reason not in (msg.datapath.ofproto.OFPRR_IDLE_TIMEOUT, msg.datapath.ofproto.OFPRR_HARD_TIMEOUT):
+            return      # Deleted by the controller, already removed from the shadow
+        dst = msg.match.get('ipv4_dst_nxm', msg.match.get('ipv4_dst'))
+        if dst is not None:
+            ip, mask = dst if isinstance(dst, tuple) else (dst, 0xFFFFFFFF)
+            self.flow_programmer.flow_removed(msg.datapath.id, ip, mask, msg.priority)
+
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, MAIN_DISPATCHER)
+    def __barrier_reply_handler(self, ev) -> None:
+        """ Forward barrier replies to the flow programmer to measure the FlowMods commit time """
+        self.flow_programmer.barrier_reply(ev.msg.datapath.id, ev.msg.xid)
+
+
+    def add_two_level_flow(self, datapath, ip: typing.Union[str, int], mask: int, port: int, timeout: int = 0, priority: int = 1, group: typing.Optional[int] = None,
+                           static: bool = False) -> None:
         """ Send OFPFlowMod message to set a new entry to the flowtable of the switch identified by datapath.
-        This flowtable configuration works as a routing table. 
+        This flowtable configuration works as a routing table. The entry is always sent, even if the shadow
+        of the flow table has it, since it is called after a table miss.
 
         @param datapath: The 16-bit datapath of the switch to configure
-        @param ip: Dest IP address to be matched
+        @param ip: Dest IP address to be matched, dotted or packed
         @param mask: Address mask to match multiple IPs
         @param port: The output port of the switch (ports numbering starts from 1)
+        @param group: Forward to this group instead of the output port
+        @param static: Two-level route, never evicted from the flow table
         @return: None
         """
+        for flowmod in self.flow_programmer.program(datapath, ip, mask, port, timeout, priority, group, static, force=True):
+            datapath.send_msg(flowmod)
+            FLOW_MODS.inc()
+
+
+    def build_two_level_flow(self, datapath, ip: str, mask: int, port: int, timeout: int = 0, priority: int = 1, group: typing.Optional[int] = None):
+        """ Create the OFPFlowMod message sent by add_two_level_flow, without sending it
+
+        @return: The OFPFlowMod message
+        """
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
@@ -99,8 +218,64 @@ class SDNController(app_manager.RyuApp):
             ipv4_dst_nxm = (ip, mask),  # Destination IP with mask 
         )
         actions = [ 
-            parser.OFPActionOutput(port),    # Forward packet to provided port
+            parser.OFPActionOutput(port) if group is None else parser.OFPActionGroup(group),    # Forward packet to provided port or group
         ]  
         inst = [ parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions) ]   # Just a wrapper for actions list
-        req = parser.OFPFlowMod(datapath, match=match, instructions=inst, idle_timeout=timeout, priority=priority)
-        datapath.send_msg(req)
+        flags = ofproto.OFPFF_SEND_FLOW_REM if timeout > 0 else 0     # Keep the shadow of the flow table in sync
+        return parser.OFPFlowMod(datapath, match=match, instructions=inst, idle_timeout=timeout, priority=priority, flags=flags)
+
+
+    def delete_two_level_flow(self, datapath, ip: str, mask: int, priority: int = 1) -> None:
+        """ Send OFPFlowMod message to remove the entry matching exactly the provided destination from the flowtable
+        of the switch identified by datapath.
+
+        @param datapath: The 16-bit datapath of the switch to configure
+        @param ip: Dest IP address of the entry
+        @param mask: Address mask of the entry
+        @param priority: Priority of the entry
+        @return: None
+        """
+        for flowmod in self.flow_programmer.unprogram(datapath, ip, mask, priority):
+            datapath.send_msg(flowmod)
+
+
+    def build_delete_two_level_flow(self, datapath, ip: str, mask: int, priority: int = 1):
+        """ Create the OFPFlowMod message sent by delete_two_level_flow, without sending it
+
+        @return: The OFPFlowMod message
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        match = parser.OFPMatch (
+            eth_type_nxm = 0x0800,
+            ipv4_dst_nxm = (ip, mask),
+        )
+        return parser.OFPFlowMod(datapath, command=ofproto.OFPFC_DELETE_STRICT, match=match, priority=priority,
+                                 out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY)
+
+
+    def build_drop_flow(self, datapath, src: int, dst: int, timeout: int):
+        """ Create the OFPFlowMod message of a drop entry for the packets from src to dst, above the routes
+        and the paths so that it holds even if another source installed the route towards dst
+
+        @param datapath: The datapath of the switch
+        @param src: Packed source IP address
+        @param dst: Packed destination IP address
+        @param timeout: Hard timeout of the entry, so that it does not outlive the slices
+        @return: The OFPFlowMod message
+        """
+        parser = datapath.ofproto_parser
+        match = parser.OFPMatch(eth_type=0x0800, ipv4_src=src, ipv4_dst=dst)
+        return parser.OFPFlowMod(datapath, cookie=DROP_COOKIE, match=match, instructions=[], hard_timeout=timeout, priority=DROP_PRIORITY)
+
+
+    def __delete_drop_flows(self) -> None:
+        """ Remove the drop entries from all the switches after a slice update """
+        if len(self.admission.denied) > 0:
+            for datapath in self.switches.values():
+                ofproto = datapath.ofproto
+                datapath.send_msg(datapath.ofproto_parser.OFPFlowMod(datapath, cookie=DROP_COOKIE, cookie_mask=0xFFFFFFFFFFFFFFFF,
+                                                                     table_id=ofproto.OFPTT_ALL, command=ofproto.OFPFC_DELETE,
+                                                                     out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY))
+        self.admission.reset()
@@ -0,0 +1,196 @@
+from switch import Switch
+from ryu.controller.controller import Datapath
+from flow_table import FlowTable, TableEntry, ROUTE_PRIORITY, EXACT_MASK
+from slice_registry import ip_to_int, int_to_ip
+from metrics import REGISTRY
+from time import perf_counter
+import collections
+import typing
+
+FLOW_MODS = REGISTRY.counter('sdn_flow_mods_total', 'FlowMods sent to the switches', ('source',)).labels('batch')
+COMMIT_LATENCY = REGISTRY.histogram('sdn_flow_commit_seconds', 'Time from a FlowMods commit to the barrier reply').labels()
+
+
+class FlowBatch():
+
+    def __init__(self, programmer: 'FlowProgrammer') -> None:
+        """ Collect the FlowMods to be sent to multiple datapaths, so that they can be sent together
+
+        @param programmer: The flow programmer that commits the batch
+        """
+        self.programmer: FlowProgrammer = programmer
+        self.flowmods: typing.Dict[int, typing.Tuple[Datapath, list]] = {}   # dpid -> (datapath, FlowMods)
+
+
+    def add(self, datapath: Datapath, **kwargs) -> None:
+        """ Queue a new flow entry, same arguments of SDNController.add_two_level_flow """
+        for flowmod in self.programmer.program(datapath, **kwargs):
+            self.__queue(datapath, flowmod)
+
+
+    def delete(self, datapath: Datapath, **kwargs) -> None:
+        """ Queue the removal of a flow entry, same arguments of SDNController.delete_two_level_flow """
+        for flowmod in self.programmer.unprogram(datapath, **kwargs):
+            self.__queue(datapath, flowmod)
+
+
+    def commit(self) -> None:
+        """ Send the queued FlowMods, one transaction for each datapath """
+        for datapath, flowmods in self.flowmods.values():
+            self.programmer.commit(datapath, flowmods)
+        self.flowmods = {}
+
+
+    def __queue(self, datapath: Datapath, flowmod) -> None:
+        """ Append a FlowMod to the ones of the datapath """
+        self.flowmods.setdefault(datapath.id, (datapath, []))[1].append(flowmod)
+
+
+class FlowProgrammer():
+
+    def __init__(self, build_flow_callback: typing.Callable, build_delete_callback: typing.Callable, use_bundles: bool = False,
+                 table_budget: typing.Optional[int] = None, aggregate: bool = False) -> None:
+        """ Send FlowMods in batches: either as an OpenFlow bundle (atomic) or as a single coalesced write,
+        always followed by a barrier request to measure the time needed by the switch to apply them.
+        The flow table of every switch is shadowed, so that only the FlowMods that change it are sent.
+
+        @param build_flow_callback: Function that creates the FlowMod to add a flow entry
+        @param build_delete_callback: Function that creates the FlowMod to delete a flow entry
+        @param use_bundles: Send the FlowMods of each datapath inside an atomic bundle
+        @param table_budget: Maximum entries of every flow table, see FlowTable
+        @param aggregate: Merge the /32 entries with the same action, see FlowTable
+        """
+        self.build_flow_callback: typing.Callable = build_flow_callback
+        self.build_delete_callback: typing.Callable = build_delete_callback
+        self.use_bundles: bool = use_bundles
+        self.table_budget: typing.Optional[int] = table_budget
+        self.aggregate: bool = aggregate
+        self.tables: typing.Dict[int, FlowTable] = {}      # dpid -> shadow of the flow table
+        self.bundle_id: int = 0
+        self.pending_barriers: typing.Dict[typing.Tuple[int, int], typing.Tuple[float, int]] = {}   # (dpid, xid) -> (commit time, n. of FlowMods)
+        self.commit_latencies: typing.Deque[float] = collections.deque(maxlen=1000)                 # Seconds from commit to barrier reply
+
+
+    def batch(self) -> FlowBatch:
+        """ Return a new empty batch """
+        return FlowBatch(self)
+
+
+    def reset(self, dpid: int) -> None:
+        """ Start a new empty shadow for a switch that (re)connected to the controller """
+        self.tables[dpid] = FlowTable(self.table_budget, self.aggregate)
+
+
+    def program(self, datapath: Datapath, ip: typing.Union[str, int], mask: int, port: int, timeout: int = 0, priority: int = ROUTE_PRIORITY,
+                group: typing.Optional[int] = None, static: bool = False, force: bool = False) -> list:
+        """ Add a flow entry to the shadow of the switch and return the FlowMods needed to apply it, which are
+        none if the switch already has the entry, or more than one if entries are merged, split or evicted
+
+        @param datapath: The datapath of the switch
+        @param ip: Dest IP address to be matched, dotted or packed
+        @param mask: Address mask to match multiple IPs
+        @param port: The output port of the switch
+        @param timeout: Idle timeout of the entry
+        @param priority: Priority of the entry
+        @param group: Forward to this group instead of the output port
+        @param static: Entry never evicted or merged (two-level routes)
+        @param force: Send the entry even if the shadow has it, e.g. after a table miss
+        @return: The FlowMods to send
+        """
+        table = self.tables.get(datapath.id)
+        if table is None:
+            table = self.tables[datapath.id] = FlowTable(self.table_budget, self.aggregate)
+        value = ip if isinstance(ip, int) else ip_to_int(ip)
+        return self.__build(datapath, *table.add(value, mask, priority, (port, group), timeout, static, force))
+
+
+    def unprogram(self, datapath: Datapath, ip: str, mask: int, priority: int = ROUTE_PRIORITY) -> list:
+        """ Remove a flow entry from the shadow of the switch and return the FlowMods needed to apply it """
+        table = self.tables.get(datapath.id)
+        if table is None:
+            return []
+        return self.__build(datapath, *table.remove(ip_to_int(ip), mask, priority))
+
+
+    def flow_removed(self, dpid: int, ip: str, mask: typing.Union[str, int], priority: int) -> None:
+        """ Gets called by the Ryu controller when an entry expires on a switch """
+        table = self.tables.get(dpid)
+        if table is not None:
+            table.expired(ip_to_int(ip), ip_to_int(mask) if isinstance(mask, str) else mask, priority)
+
+
+    def flow_stats(self, dpid: int, stats: list) -> None:
+        """ Gets called by the Ryu controller with the flow descriptions of a switch: refresh the recency
+        of the entries from their byte counters, so that the busiest entries are the last ones evicted
+
+        @param dpid: The datapath id of the switch
+        @param stats: List of OFPFlowDesc
+        """
+        table = self.tables.get(dpid)
+        if table is None or table.budget is None:
+            return
+        byte_counts = {}
+        for stat in stats:
+            dst = stat.match.get('ipv4_dst_nxm', stat.match.get('ipv4_dst'))
+            if dst is None:
+                continue    # Table-miss entry
+            ip, mask = dst if isinstance(dst, tuple) else (dst, EXACT_MASK)
+            mask = ip_to_int(mask) if isinstance(mask, str) else mask
+            byte_counts[(ip_to_int(ip) & mask, mask, stat.priority)] = dict(stat.stats.fields).get('byte_count', 0)
+        table.refresh(byte_counts)
+
+
+    def __build(self, datapath: Datapath, added: typing.List[TableEntry], deleted: typing.List[TableEntry]) -> list:
+        """ Create the FlowMods of the changes of a shadow table, the new entries first (make before break) """
+        flowmods = [ self.build_flow_callback(datapath, int_to_ip(entry.value), entry.mask, entry.action[0], entry.timeout,
+                                              entry.priority, entry.action[1]) for entry in added ]
+        flowmods += [ self.build_delete_callback(datapath, int_to_ip(entry.value), entry.mask, entry.priority) for entry in deleted ]
+        return flowmods
+
+
+    def commit(self, datapath: Datapath, flowmods: list) -> None:
+        """ Send a list of FlowMods to a datapath followed by a barrier request
+
+        @param datapath: The datapath of the switch to configure
+        @param flowmods: The FlowMods to send
+        """
+        if len(flowmods) == 0:
+            return
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        if self.use_bundles:
+            self.bundle_id = (self.bundle_id + 1) & 0xFFFFFFFF
+            flags = ofproto.OFPBF_ATOMIC | ofproto.OFPBF_ORDERED
+            msgs = [ parser.OFPBundleCtrlMsg(datapath, self.bundle_id, ofproto.OFPBCT_OPEN_REQUEST, flags, []) ]
+            msgs += [ parser.OFPBundleAddMsg(datapath, self.bundle_id, flags, flowmod, []) for flowmod in flowmods ]
+            msgs.append(parser.OFPBundleCtrlMsg(datapath, self.bundle_id, ofproto.OFPBCT_COMMIT_REQUEST, flags, []))
+        else:
+            msgs = list(flowmods)
+
+        barrier = parser.OFPBarrierRequest(datapath)
+        msgs.append(barrier)
+
+        # Serialize all the messages and send them with a single write
+        for msg in msgs:
+            datapath.set_xid(msg)
+            msg.serialize()
+        self.pending_barriers[(datapath.id, barrier.xid)] = (perf_counter(), len(flowmods))
+        datapath.send(b''.join(msg.buf for msg in msgs))
+        FLOW_MODS.inc(len(flowmods))
+
+
+    def barrier_reply(self, dpid: int, xid: int) -> None:
+        """ Gets called by the Ryu controller. Compute the time needed to apply a committed batch
+
+        @param dpid: The datapath id of the switch which sent the reply
+        @param xid: The transaction id of the barrier request
+        """
+        pending = self.pending_barriers.pop((dpid, xid), None)
+        if pending is None:
+            return      # Not requested by the flow programmer
+        commit_time, n_flowmods = pending
+        latency = perf_counter() - commit_time
+        self.commit_latencies.append(latency)
+        COMMIT_LATENCY.observe(latency)
+        print(f'Applied {n_flowmods} FlowMods on {Switch.get(dpid).name} in {latency * 1000:.2f} ms')
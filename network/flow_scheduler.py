@@ -1,20 +1,45 @@
-from threading import Thread
-from time import sleep, time
+from threading import Thread, Event
+from time import sleep, time, perf_counter
 from switch import Switch
-from globals import FAT_TREE_K, slices
+from globals import FLOW_RATE_THRESHOLD, FLOW_DETECTION, SERVICES_DIRECTORY, SCHEDULER_TRACE, SCHEDULER_WORKERS
+from globals import SCHEDULER_INTERVAL, SCHEDULER_MIN_INTERVAL, SCHEDULER_MAX_INTERVAL, SCHEDULER_OPTIMIZE_COOLDOWN
+from slice_registry import SliceRegistry
+from flow_programmer import FlowProgrammer
+from port_stats_store import PortStatsStore, TX, RX, DTX, DRX
+from path_engine import PathEngine
+from placement import PlacementEngine
+from flow_stats import FlowStatsCollector
+from flow_search import search_port_flows, ShardedFlowSearch
+from flow_table import PATH_PRIORITY
+from uplink_groups import UplinkGroups
+from congestion_index import CongestionIndex, DownLink, CONGESTION_BEGIN
+from scheduler_trace import TraceWriter
+from metrics import REGISTRY
+from services.service_directory import ServiceDirectory
 from ryu.ofproto.ofproto_v1_5_parser import OFPPortStats
 from ryu.controller.controller import Datapath
+import numpy as np
+import collections
 import typing
-import pickle
+
+CYCLE_DURATION = REGISTRY.histogram('sdn_scheduler_cycle_seconds', 'Duration of a scheduler cycle, excluding the polling interval').labels()
+PHASE_DURATION = REGISTRY.histogram('sdn_scheduler_phase_seconds', 'Duration of the phases of a scheduler cycle', ('phase',))
+STATS_PHASE, DETECT_PHASE, OPTIMIZE_PHASE = ( PHASE_DURATION.labels(phase) for phase in ('stats', 'detect', 'optimize') )
+REACTION_LATENCY = REGISTRY.histogram('sdn_scheduler_reaction_seconds', 'Time from the detection of a congestion to the optimization',
+                                      buckets=( 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300 )).labels()
+LINK_RATE = REGISTRY.gauge('sdn_link_rate_bytes_per_second', 'Byte rate of the core switch links, from the port stats deltas',
+                           ('switch', 'port', 'direction'))
 
 
 class Flow():
 
-    def __init__(self, switch_id: int, in_pod: int, out_pod: int, ttl: int = 3):
-        self.switch = Switch(switch_id)
+    def __init__(self, switch_id: int, in_pod: int, out_pod: int, ttl: int = 3, dst_ip: typing.Optional[str] = None, rate: float = 0):
+        self.switch = Switch.get(switch_id)
         self.in_pod = in_pod
         self.out_pod = out_pod
         self.ttl = ttl  # Counter to be decremented at every scheduler loop cycle
+        self.dst_ip = dst_ip    # Destination host, known only if detected from the flow stats
+        self.rate = rate        # Byte rate (bytes/s), known only if detected from the flow stats
     
 
     def update_ttl(self):
@@ -22,188 +47,296 @@ class Flow():
         self.ttl -= 1
 
 
-class DownLink():
+class AdaptiveInterval():
+
+    def __init__(self, initial: float, minimum: float, maximum: float, backoff: float = 1.5, spike: float = 2.0):
+        """ Polling interval that shortens when traffic spikes and backs off when the network is idle
+
+        @param initial: Interval used with steady traffic
+        @param minimum: Interval used right after a traffic spike
+        @param maximum: Upper bound of the interval while the network is idle
+        @param backoff: Multiplicative factor used to increase the interval
+        @param spike: Rate increase factor considered as a spike
+        """
+        self.value: float = initial
+        self.initial: float = initial
+        self.minimum: float = minimum
+        self.maximum: float = maximum
+        self.backoff: float = backoff
+        self.spike: float = spike
+        self.last_rate: float = 0
+
+
+    def update(self, rate: float) -> float:
+        """ Compute the next polling interval
 
-    def __init__(self, switch: Switch, dst_pod: int):
-        self.switch: Switch = switch
-        self.dst_pod: int = dst_pod
+        @param rate: The highest byte rate (bytes/s) observed on a core switch port in the last round
+        @return: The new interval in seconds
+        """
+        if rate < FLOW_RATE_THRESHOLD:
+            self.value = min(self.value * self.backoff, self.maximum)    # Idle network
+        elif rate > self.last_rate * self.spike:
+            self.value = self.minimum                                    # Traffic spike
+        else:
+            self.value = min(self.value * self.backoff, max(self.initial, self.minimum))
+        self.last_rate = rate
+        return self.value
 
 
 class FlowScheduler(Thread):
 
-    def __init__(self, datapaths: typing.Dict[int, Datapath], add_flow_callback: typing.Callable) -> None:
+    def __init__(self, k: int, datapaths: typing.Dict[int, Datapath], flow_programmer: FlowProgrammer, slice_registry: SliceRegistry,
+                 uplink_groups: typing.Optional[UplinkGroups] = None) -> None:
         super().__init__()
+        self.k: int = k
         self.datapaths: typing.Dict[int, Datapath] = datapaths
-        self.add_flow_callback: typing.Callable = add_flow_callback
+        self.flow_programmer: FlowProgrammer = flow_programmer
+        self.slice_registry: SliceRegistry = slice_registry
+        self.uplink_groups: typing.Optional[UplinkGroups] = uplink_groups   # Weighted by the scheduler when ECMP_GROUPS is enabled
+        # The uplink entries forward to the group, so their counters cannot be attributed to a core switch
+        self.flow_detection: str = 'ports' if uplink_groups is not None else FLOW_DETECTION
+        if self.flow_detection != FLOW_DETECTION:
+            print(f"Flow detection '{FLOW_DETECTION}' is not supported with the uplink groups, using the port stats")
         self.switches: typing.Dict[int, Switch] = {}
-        self.flows: typing.List[Flow] = []
-        self.congestions: typing.List[DownLink] = []
+        self.port_stats = PortStatsStore(k)
+        self.core_rows = np.zeros(0, dtype=bool)     # Rows of the port stats matrix that belong to core switches
+        self.service_directory = ServiceDirectory(SERVICES_DIRECTORY, writable=True)
+        self.path_engine = PathEngine()
+        self.placement = PlacementEngine(k, self.path_engine, self.slice_registry)
+        self.flow_stats = FlowStatsCollector(k)
+        self.flow_search: typing.Callable = search_port_flows
+        if SCHEDULER_WORKERS > 0 and self.flow_detection == 'ports':
+            self.flow_search = ShardedFlowSearch(k, SCHEDULER_WORKERS).search
+        self.paths: typing.Dict[str, Switch] = {}    # Service IP -> core switch of the path created by the scheduler
+        self.flows: typing.Dict[tuple, Flow] = {}    # (core dpid, in pod, out pod, dst IP) -> running flow
+        self.congestion_index = CongestionIndex()
+        self.congestion_index.add_listener(self.__congestion_event)
+        self.congestions: typing.Dict[typing.Tuple[int, int], DownLink] = self.congestion_index.congestions
+
+        self.interval = AdaptiveInterval(SCHEDULER_INTERVAL, SCHEDULER_MIN_INTERVAL, SCHEDULER_MAX_INTERVAL)
+        self.pending_replies: typing.Set[typing.Tuple[int, str]] = set()   # (dpid, 'port' | 'flow') stats replies not received yet
+        self.round_completed = Event()                  # Set when all the stats replies of the current round arrived
+        self.round_start: typing.Optional[float] = None  # Time of the current stats request
+        self.round_duration: float = SCHEDULER_INTERVAL  # Time elapsed between the last two stats requests
+        self.congestion_start: typing.Optional[float] = None
+        self.last_optimization: float = 0
+        self.reaction_latencies: typing.Deque[float] = collections.deque(maxlen=1000)   # Seconds from congestion to optimization
+
+        self.trace: typing.Optional[TraceWriter] = None    # Record of the decisions of every cycle
+        if SCHEDULER_TRACE is not None:
+            self.trace = TraceWriter(SCHEDULER_TRACE, { 'k': k, 'slices': self.slice_registry.slices, 'flow_detection': self.flow_detection,
+                                                        'flow_rate_threshold': FLOW_RATE_THRESHOLD })
 
 
     def run(self):
         """ Execute as a separate thread """
         self.running = True 
-        self.__main_loop(10)
+        self.__main_loop()
 
     
-    def __main_loop(self, sleeptime: int = 5) -> None:
+    def __main_loop(self) -> None:
         """ Main scheduler execution loop, runs as a thread. 
-
-        @param sleeptime: the time between the port stats requests 
+        Detection starts as soon as all the core switches replied to the port stats request of the round,
+        then the scheduler waits for the adaptive polling interval before starting a new round.
         """
-        cont = 1
         while self.running:
+            start = perf_counter()
+            self.__send_port_stats_req()
+            self.round_completed.wait(SCHEDULER_MAX_INTERVAL)   # Do not wait forever for a lost reply
+            self.port_stats.commit_round()
+            STATS_PHASE.observe(perf_counter() - start)
+            self.cycle()
+            self.print_switches_info()
+            CYCLE_DURATION.observe(perf_counter() - start)
+            sleep(self.interval.update(self.__get_peak_rate()))
 
-            self.__detect_flows()
-            self.__detect_congestions()
 
-            if (cont % 4 == 0):
-                self.__optimize_network()
+    def cycle(self, now: typing.Optional[float] = None) -> None:
+        """ Analyze the stats of the last polling round: detect flows and congestions, then optimize the network.
+        Also called by the trace replay, with the time of the recorded cycle.
 
-            cont += 1
-            self.print_switches_info()
-            self.__send_port_stats_req()
-            sleep(sleeptime)   
+        @param now: Time of the cycle, the current time by default
+        """
+        now = time() if now is None else now
+        if self.trace is not None:
+            stats = self.port_stats.get(self.core_rows)
+            core_dpids = [ self.port_stats.dpids[row] for row in np.flatnonzero(self.core_rows) ]
+            self.trace.begin_cycle(now, self.round_duration, { dpid: stats[n][:, [TX, RX]].tolist() for n, dpid in enumerate(core_dpids) })
+
+        start = perf_counter()
+        self.__detect_flows()
+        self.__export_link_rates()
+        if self.uplink_groups is not None:
+            self.__balance_uplinks()
+        DETECT_PHASE.observe(perf_counter() - start)
+
+        if len(self.congestions) > 0 and now - self.last_optimization >= SCHEDULER_OPTIMIZE_COOLDOWN:
+            start = perf_counter()
+            self.__optimize_network(now)
+            OPTIMIZE_PHASE.observe(perf_counter() - start)
+            self.last_optimization = now
+            self.reaction_latencies.append(self.last_optimization - self.congestion_start)
+            REACTION_LATENCY.observe(self.reaction_latencies[-1])
+            print(f'Reacted to congestion in {self.reaction_latencies[-1]:.2f} s')
+
+        if self.trace is not None:
+            self.trace.end_cycle()
+
+
+    def __export_link_rates(self) -> None:
+        """ Publish the byte rates of the core switch links of the last round as metrics """
+        stats = self.port_stats.get(self.core_rows)
+        for n, row in enumerate(np.flatnonzero(self.core_rows)):
+            name = self.switches[self.port_stats.dpids[row]].name
+            for port in range(self.k):
+                LINK_RATE.labels(name, port + 1, 'tx').set(stats[n, port, DTX] / self.round_duration)
+                LINK_RATE.labels(name, port + 1, 'rx').set(stats[n, port, DRX] / self.round_duration)
+
+
+    def __balance_uplinks(self) -> None:
+        """ Update the weights of the uplink groups of the pod switches from the uplink rates of the last round """
+        pod_rows = np.flatnonzero(~self.core_rows)
+        dtx = self.port_stats.get(pod_rows)[:, self.k // 2:, DTX]     # (pod switch, uplink)
+        for n, row in enumerate(pod_rows):
+            dpid = self.port_stats.dpids[row]
+            if self.uplink_groups.update(dpid, dtx[n] / self.round_duration):
+                self.__trace('groups', [ self.switches[dpid].name, self.uplink_groups.weights[dpid].tolist() ])
+
+
+    def __trace(self, kind: str, entry: typing.Any) -> None:
+        """ Record an event of the current cycle, if tracing is enabled """
+        if self.trace is not None:
+            self.trace.add(kind, entry)
 
 
     def __detect_flows(self) -> None:
-        """ Update flows TTL and search for new flows on core switches """ 
-        for flow in self.flows:
+        """ Update downlinks utilization, search for flows on core switches, then update the flows TTL.
+        Only the flows that appear or expire update the congestion index.
+        """
+        detected = {}
+        for switch_id, in_pod, out_pod, dst_ip, rate in self.__search_flows():
+            detected[(switch_id, in_pod, out_pod, dst_ip)] = rate
+
+        for key, rate in detected.items():
+            flow = self.flows.get(key)
+            if flow is None:
+                # Discovered flow
+                flow = Flow(key[0], key[1], key[2], 1, key[3], rate)
+                self.flows[key] = flow
+                self.congestion_index.add(key[0], flow.out_pod)
+                self.__trace('flows', [ flow.switch.name, flow.in_pod, flow.out_pod, flow.dst_ip, rate ])
+                print(f"Flow on switch {flow.switch.name} from pod {flow.in_pod} to {flow.dst_ip or f'pod {flow.out_pod}'}")
+            else:
+                flow.ttl = 1
+                flow.rate = rate
+
+        for key, flow in list(self.flows.items()):
+            if key in detected:
+                continue
             flow.update_ttl()
-        self.flows = [ flow for flow in self.flows if flow.ttl > 0 ]
-
-        for switch in self.switches.values():
-            if not switch.is_core:
-                continue    # Not interested in flows on pod switches
-
-            for out_port in range(1, FAT_TREE_K + 1):
-                tx = switch.port_stats[out_port].dtx_bytes
-                if tx < 1000:
-                    continue    # Not enough data transmitted from this port
-                for in_port in range(1, FAT_TREE_K + 1):
-                    rx = switch.port_stats[in_port].drx_bytes
-                    if in_port == out_port or rx < 1000 or tx < 1000:
-                        continue
-                    # Discovered flow
-                    flow = Flow(switch.dpid64, in_port-1, out_port-1, 1)
-                    self.flows.append(flow)
-                    print(f"Flow on switch {flow.switch.name} from pod {flow.in_pod} to pod {flow.out_pod}")
-                    tx = tx - rx
-
-
-    def __detect_congestions(self) -> None:
-        """ Discover downlinks with more than one running flows """
-        # Reset downlinks stats on switch objects
-        for sw in self.switches.values():
-            sw.reset_downlink_flows()
-
-        # Update downlink flows counters 
-        for flow in self.flows:
-            self.switches[flow.switch.dpid64].port_stats[flow.out_pod+1].downlink_flows += 1
-
-        # Find downlinks with more than one active flows
-        self.congestions = []
-        for sw in self.switches.values():
-            for port in range(1, FAT_TREE_K + 1):
-                if sw.port_stats[port].downlink_flows > 1:
-                    self.congestions.append(DownLink(Switch(sw.dpid64), port - 1))
-                    print(f'Discovered congested downlink on {sw.name} to pod {port - 1}')
+            if flow.ttl <= 0:
+                del self.flows[key]
+                self.congestion_index.remove(key[0], flow.out_pod)
+                self.__trace('expired', [ flow.switch.name, flow.in_pod, flow.out_pod, flow.dst_ip ])
 
-    
-    def __optimize_network(self) -> None:
-        """ Find new solutions for running services to eliminate congestions """
-        # Load services
-        services = {}
-        with open('./services/services.obj', 'rb') as file:
-            services = pickle.load(file)
 
-        # Search for services related to discovered congestion
-        for downlink in self.congestions:
-            for srv, srv_ip in services.items():
-                srv_pod = int(srv_ip.split('.')[1])
-                if srv_pod == downlink.dst_pod:
+    def __search_flows(self) -> typing.List[typing.Tuple[int, int, int, typing.Optional[str], float]]:
+        """ Update downlinks utilization and return the flows running in the last round
 
-                    if not self.__optimize_paths(srv_ip):
-                        self.__optimize_services(srv, services)
-                    break  
+        @return: List of (core dpid, in pod, out pod, dst IP or None, byte rate or 0)
+        """
+        threshold = FLOW_RATE_THRESHOLD * self.round_duration   # Minimum bytes transmitted in the round
 
+        # Core switches only, not interested in flows on pod switches
+        core_dpids = [ self.port_stats.dpids[row] for row in np.flatnonzero(self.core_rows) ]
+        stats = self.port_stats.get(self.core_rows)
+        dtx = stats[:, :, DTX]  # (core, out_port)
+        drx = stats[:, :, DRX]  # (core, in_port)
+        self.path_engine.update([ Switch.get(dpid) for dpid in core_dpids ], dtx / self.round_duration)
 
-    def __optimize_paths(self, service_ip: str) -> bool:
-        """ Schedule a new non-congested path to the service 
-        
-        @param service_ip: The destination service IP
-        @return True if an available path was found and applied, False otherwise 
+        if self.flow_detection == 'flows':
+            return [ (core.dpid64, in_pod, out_pod, dst_ip, rate)
+                     for core, in_pod, out_pod, dst_ip, rate in self.flow_stats.get_flows(self.round_duration)
+                     if rate >= FLOW_RATE_THRESHOLD and in_pod != out_pod ]
+
+        return [ (core_dpids[core], int(in_port), int(out_port), None, 0) for core, out_port, in_port in self.flow_search(dtx, drx, threshold) ]
+
+
+    def __congestion_event(self, event: str, downlink: DownLink) -> None:
+        """ Gets called by the congestion index when a downlink becomes congested or is no longer congested
+
+        @param event: CONGESTION_BEGIN || CONGESTION_END
+        @param downlink: The downlink
         """
-        pod = int(service_ip.split('.')[1])
-        available_core_sw = self.__search_available_core_sw(pod)
-        if available_core_sw != None:
-            self.__create_path(service_ip, available_core_sw) 
-            return True
-        return False
+        self.__trace('congestions', [ event, downlink.switch.name, downlink.dst_pod ])
+        if event == CONGESTION_BEGIN:
+            print(f'Discovered congested downlink on {downlink.switch.name} to pod {downlink.dst_pod}')
+            if self.congestion_start is None:
+                # Congestion appeared in this round
+                self.congestion_start = (self.round_start or time()) - self.round_duration
+        else:
+            print(f'Congestion ended on downlink {downlink.switch.name} to pod {downlink.dst_pod}')
+            if len(self.congestions) == 0:
+                self.congestion_start = None
 
+    
+    def __optimize_network(self, now: float) -> None:
+        """ Find new solutions for running services to eliminate congestions
 
-    def __optimize_services(self, service_id: str, services: dict) -> bool:
-        """ Migrate service to a pod with an available downlink and server 
+        @param now: Time of the scheduler cycle
+        """
+        # Load services
+        version, services, pending = self.service_directory.read_pending()
+        self.placement.sync(version, services, pending)
+        self.__trace('decisions', { 'action': 'optimize', 'version': version, 'services': services, 'pending': pending })
+
+        # Estimate the traffic of every service placed in a pod with a congested downlink
+        demands = []
+        for pod in { downlink.dst_pod for downlink in self.congestions.values() }:
+            pod_services = [ srv for srv, srv_ip in services.items() if int(srv_ip.split('.')[1]) == pod and srv not in pending ]
+            for srv in pod_services:
+                rate = sum(flow.rate for flow in self.flows.values() if flow.dst_ip == services[srv])
+                if rate == 0:   # Rate not measured by the flow stats, split the pod traffic among its services
+                    rate = self.path_engine.get_pod_rate(pod) / len(pod_services)
+                demands.append((srv, pod, rate, self.paths.get(services[srv])))
+
+        # Place all the paths at once, migrate the services that cannot be rerouted
+        paths = self.path_engine.assign(demands)
+        for srv, _, rate, _ in demands:
+            if paths[srv] is not None:
+                print(f'Found core switch with the least utilized downlink: {paths[srv].name}')
+                self.__trace('decisions', { 'action': 'reroute', 'service': srv, 'rate': rate, 'core': paths[srv].name })
+                self.__create_path(services[srv], paths[srv])
+            elif not self.__optimize_services(srv, services, rate, now):
+                self.__trace('decisions', { 'action': 'keep', 'service': srv, 'rate': rate })
+
+
+    def __optimize_services(self, service_id: str, services: dict, rate: float, now: float) -> bool:
+        """ Migrate service to the host chosen by the placement engine 
         
         @param service_id: The ID of the service to migrate
         @param services: The dictionary with the running services
+        @param rate: Estimated byte rate of the service traffic
+        @param now: Time of the scheduler cycle
         @return True if the service is successfully migrated and paths are updated, False otherwise
         """
-        for pod in range(0, FAT_TREE_K):
-            
-            core_switch = self.__search_available_core_sw(pod)
-            if core_switch == None:
-                continue
-
-            available_host = self.__search_available_host(pod, services)
-            if available_host == None:
-                continue
-            
-            # Update services
-            print(f'Moved service {service_id} to host {available_host}')
-            old_ip = services[service_id] 
-            services[service_id] = available_host
-            with open('./services/services.obj', 'wb') as file:
-                pickle.dump(services, file)
-
-            self.__update_slice(old_ip, available_host)
-            self.__create_path(available_host, core_switch)
-            return True 
-
-        return False
+        placement = self.placement.choose(service_id, services[service_id], rate, now)
+        if placement is None:
+            return False
+        available_host, core_switch = placement
+        print(f'Found available host: {available_host}')
 
+        # Make before break: slices and path to the new host are ready before the service is moved.
+        # The simulation completes the migration once the new instance answers, then drains the old one
+        old_ip = services[service_id] 
+        self.__update_slice(old_ip, available_host)
+        self.__create_path(available_host, core_switch)
 
-    def __search_available_core_sw(self, pod: int) -> typing.Optional[Switch]:
-        """ Return a core switch whose downlink to the specified pod is not congested 
-        
-        @param pod: Identifies the connection that must be available from the switch
-        @param congested_downlinks: The list of currently congested downlinks
-        @return Available core switch || None
-        """
-        available_core_sw = { sw.dpid64: True for sw in self.switches.values() if sw.is_core }
-        for flow in self.flows:
-            if pod == flow.out_pod:
-                available_core_sw[flow.switch.dpid64] = False
-        for dpid, is_available in available_core_sw.items():
-            if is_available:
-                sw = Switch(dpid)
-                print(f'Found available core switch: {sw.name}')
-                return sw
-
-
-    def __search_available_host(self, pod: int, services: dict) -> typing.Optional[str]:
-        """ Return host IP on requested pod with no running services 
-        
-        @param pod: Pod where to search for available host
-        @param services: Dict of currently running services
-        @return available host IP || None 
-        """
-        for s in range(0, int(FAT_TREE_K / 2)):
-            for h in range(2, int(FAT_TREE_K / 2) + 2):
-                host = f'10.{pod}.{s}.{h}'
-                if host not in services.values():
-                    print(f'Found available host: {host}')
-                    return host
+        version = self.service_directory.request_migration(service_id, available_host)
+        self.__trace('decisions', { 'action': 'migrate', 'service': service_id, 'rate': rate, 'host': available_host, 'core': core_switch.name })
+        self.placement.move(version, None, available_host)     # The old host is released after the drain
+        print(f'Requested migration of service {service_id} to host {available_host}')
+        return True 
 
 
     def __update_slice(self, old_srv: str, new_srv: str) -> None:
@@ -214,7 +347,7 @@ class FlowScheduler(Thread):
         """
         # Check if new srv is already in the right slice
         new_slice, old_slice = -1, -1
-        for slice_id, srvs in slices.items():
+        for slice_id, srvs in self.slice_registry.slices.items():
             if old_srv in srvs:
                 if new_srv in srvs:
                     print('Slices are already correctly setup')
@@ -223,13 +356,10 @@ class FlowScheduler(Thread):
             if new_srv in srvs:
                 old_slice = slice_id
 
-        # Add new srv to the slice 
-        slices[new_slice].append(new_srv)
+        # Add new srv to the slice and remove it from its old slice, the listeners are notified once
+        self.slice_registry.move_host(old_slice if old_slice != -1 else None, new_slice, new_srv)
         print(f'Added host {new_srv} to slice {new_slice}')
-
-        # Remove new srv from old slice
-        if old_slice != -1:
-            slices[old_slice].remove(new_srv)
+        self.__trace('slices', { 'host': new_srv, 'slice': new_slice, 'previous': old_slice })
         
 
     def __create_path(self, dst_ip: str, via_switch: Switch) -> None:
@@ -239,36 +369,82 @@ class FlowScheduler(Thread):
         @param via_switch: Core switch to be used in the path
         """
         print(f'Create path to {dst_ip} via {via_switch.name}')
+        self.paths[dst_ip] = via_switch
         
+        batch = self.flow_programmer.batch()
         for dpid, datapath in self.datapaths.items():
-            sw = Switch(dpid)
+            sw = Switch.get(dpid)
             if sw.is_core or sw.pod == int(dst_ip.split('.')[1]): 
                 continue    # Do not update core switches and switches in the same pod of the dst host
             
             port = -1
             if sw.is_edge:      # Edge
-                port = int(FAT_TREE_K / 2) + via_switch.j
+                port = int(self.k / 2) + via_switch.j
             if not sw.is_edge:  # Aggregate
-                port = int(FAT_TREE_K / 2) + via_switch.i
+                port = int(self.k / 2) + via_switch.i
 
-            self.add_flow_callback(
+            batch.add(
                 datapath=datapath, 
                 ip=dst_ip, 
                 mask=0xFFFFFFFF, 
                 port=port, 
                 timeout=30,
-                priority=int(time()) & 0xFFFF
+                priority=PATH_PRIORITY    # Replaces the previous path to the destination
             )
+            self.__trace('flowmods', [ sw.name, dst_ip, port ])
+        batch.commit()
                             
 
+    def __get_peak_rate(self) -> float:
+        """ Return the highest byte rate (bytes/s) transmitted by a core switch port in the last round """
+        dtx = self.port_stats.get(self.core_rows)[:, :, DTX]
+        peak = dtx.max() if dtx.size > 0 else 0
+        return peak / self.round_duration
+
+
     def __send_port_stats_req(self) -> None:
-        """ Send a Port Stats Request to core switches in the network """
-        for dpid, datapath in self.datapaths.items():
-            if Switch(dpid).is_core:
-                ofp = datapath.ofproto
-                ofp_parser = datapath.ofproto_parser
+        """ Send a Port Stats Request to core switches (and pod switches, see __polls_ports) and start a new polling round """
+        now = time()
+        if self.round_start is not None:
+            self.round_duration = now - self.round_start
+        self.round_start = now
+
+        datapaths = list(self.datapaths.items())
+        self.round_completed.clear()
+        self.pending_replies = { (dpid, 'port') for dpid, _ in datapaths if self.__polls_ports(Switch.get(dpid)) }
+        if self.flow_detection == 'flows':
+            self.pending_replies |= { (dpid, 'flow') for dpid, _ in datapaths if self.__is_aggregation(Switch.get(dpid)) }
+        if len(self.pending_replies) == 0:
+            self.round_completed.set()
+
+        for dpid, datapath in datapaths:
+            switch = Switch.get(dpid)
+            ofp = datapath.ofproto
+            ofp_parser = datapath.ofproto_parser
+            if self.__polls_ports(switch):
                 req = ofp_parser.OFPPortStatsRequest(datapath, 0, ofp.OFPP_ANY)
                 datapath.send_msg(req)
+            if self.__polls_flows(switch):
+                req = ofp_parser.OFPFlowDescStatsRequest(datapath, 0, ofp.OFPTT_ALL, ofp.OFPP_ANY, ofp.OFPG_ANY)
+                datapath.send_msg(req)
+
+
+    def __polls_ports(self, switch: Switch) -> bool:
+        """ Core switches for the flow detection, pod switches too when their uplink groups are weighted """
+        return switch.is_core or self.uplink_groups is not None
+
+
+    def __polls_flows(self, switch: Switch) -> bool:
+        """ Aggregation switches for the flow detection, since they hold the /32 uplink entries that select the
+        core switch; pod switches too when the flow tables have a budget, to refresh the recency of their entries
+        """
+        if self.flow_detection == 'flows' and self.__is_aggregation(switch):
+            return True
+        return self.flow_programmer.table_budget is not None and not switch.is_core
+
+
+    def __is_aggregation(self, switch: Switch) -> bool:
+        return not switch.is_core and not switch.is_edge
 
 
     def save_port_stats(self, dpid: int, stats: typing.List[OFPPortStats]) -> None:
@@ -278,11 +454,39 @@ class FlowScheduler(Thread):
         @param stats: List of openflow port stats objects that contain port statistics
         """
         if not dpid in self.switches.keys():
-            self.switches[dpid] = Switch(dpid)
+            self.switches[dpid] = Switch.get(dpid)
+            self.port_stats.get_row(dpid)
+            self.core_rows = np.array([ self.switches[d].is_core for d in self.port_stats.dpids ], dtype=bool)
+
+        stats = [ stat for stat in stats if stat.port_no < self.k + 1 ]
+        self.port_stats.update(
+            dpid,
+            [ stat.port_no for stat in stats ],
+            [ stat.tx_bytes for stat in stats ],
+            [ stat.rx_bytes for stat in stats ],
+        )
+
+        self.__reply_received(dpid, 'port')
+
+
+    def save_flow_stats(self, dpid: int, stats: list, more: bool = False) -> None:
+        """ Gets called by the Ryu controller. Save the retrieved flow descriptions of an aggregation switch
+
+        @param dpid: The datapath id of the switch which sent the stats
+        @param stats: List of openflow flow descriptions
+        @param more: If other parts of the reply will follow
+        """
+        if self.flow_detection != 'flows' or not self.__is_aggregation(Switch.get(dpid)):
+            return      # Requested only for the recency of the flow table entries
+        if self.flow_stats.save(dpid, stats, more):
+            self.__reply_received(dpid, 'flow')
+
 
-        for stat in stats:
-            if stat.port_no < FAT_TREE_K + 1:
-                self.switches[dpid].port_stats[stat.port_no].update_stats(stat.tx_bytes, stat.rx_bytes)
+    def __reply_received(self, dpid: int, kind: str) -> None:
+        """ Wake up the scheduler when the last reply of the round arrives """
+        self.pending_replies.discard((dpid, kind))
+        if len(self.pending_replies) == 0:
+            self.round_completed.set()
 
 
     def print_switches_info(self):
@@ -290,9 +494,10 @@ class FlowScheduler(Thread):
         if len(self.switches.values()) == 0:
             return
         print('\n=============== Core Switch Port Statistics ===============')
-        for switch in self.switches.values():
-            if switch.is_core:
-                print(f'{switch.name} :')
-                for i in range(1, FAT_TREE_K + 1):
-                    print(f'\t Port {i}: [ TX: {switch.port_stats[i].dtx_bytes} \tRX: {switch.port_stats[i].drx_bytes} ]')
+        stats = self.port_stats.get()
+        for row, dpid in enumerate(self.port_stats.dpids):
+            if self.core_rows[row]:
+                print(f'{self.switches[dpid].name} :')
+                for i in range(self.k):
+                    print(f'\t Port {i + 1}: [ TX: {stats[row, i, DTX]} \tRX: {stats[row, i, DRX]} ]')
         print('=============== =========================== ===============\n')
@@ -0,0 +1,84 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+import atexit
+import typing
+
+# Stats snapshot shared with the worker processes, set by _attach
+_snapshot: typing.Optional[np.ndarray] = None
+
+
+def search_port_flows(dtx: np.ndarray, drx: np.ndarray, threshold: float) -> np.ndarray:
+    """ Pair every out_port with the in_ports that received enough data: each pair is a flow as long as
+    the data transmitted from out_port not yet assigned to the previous in_ports is above the threshold
+
+    @param dtx: Matrix (core, port) of the bytes transmitted in the round
+    @param drx: Matrix (core, port) of the bytes received in the round
+    @param threshold: Minimum bytes of a flow in the round
+    @return: Array of (core row, out_port index, in_port index)
+    """
+    n_ports = dtx.shape[1]
+    valid = (drx[:, None, :] >= threshold) & ~np.eye(n_ports, dtype=bool)[None, :, :]    # (core, out_port, in_port)
+    rx = np.where(valid, drx[:, None, :], 0)
+    assigned = np.cumsum(rx, axis=2) - rx
+    is_flow = valid & (dtx[:, :, None] - assigned >= threshold)
+    return np.argwhere(is_flow)
+
+
+def _attach(buffer, shape: tuple) -> None:
+    """ Initializer of the worker processes: map the shared stats snapshot """
+    global _snapshot
+    _snapshot = np.frombuffer(buffer, dtype=np.int64).reshape(shape)
+
+
+def _search_shard(start: int, end: int, threshold: float) -> np.ndarray:
+    """ Search the flows of the core switches in rows [start, end) of the shared snapshot """
+    flows = search_port_flows(_snapshot[start:end, :, 0], _snapshot[start:end, :, 1], threshold)
+    flows[:, 0] += start
+    return flows.astype(np.int32)
+
+
+class ShardedFlowSearch():
+
+    def __init__(self, k: int, workers: int, min_rows: int = 64) -> None:
+        """ Split the flow search of the core switches in groups of rows analyzed by a pool of processes,
+        so that large fabrics do not hold the GIL shared with the Ryu event loop. The (dtx, drx) counters
+        of the round are copied once to a shared memory snapshot, the workers return only the flows found.
+
+        @param k: The fat-tree parameter, to size the snapshot for all the core switches
+        @param workers: Number of worker processes
+        @param min_rows: Minimum core switches of a shard, smaller fabrics are analyzed in the calling thread
+        """
+        self.workers: int = workers
+        self.min_rows: int = min_rows
+        self.shape: tuple = ((k // 2) ** 2, k, 2)
+        context = multiprocessing.get_context('spawn')     # Forking the Ryu process would copy its event loop
+        self.buffer = context.RawArray('q', int(np.prod(self.shape)))
+        self.snapshot = np.frombuffer(self.buffer, dtype=np.int64).reshape(self.shape)
+        self.pool = ProcessPoolExecutor(workers, mp_context=context, initializer=_attach,
+                                        initargs=(self.buffer, self.shape))
+        atexit.register(self.close)
+
+
+    def search(self, dtx: np.ndarray, drx: np.ndarray, threshold: float) -> np.ndarray:
+        """ Same result of search_port_flows, computed by the worker processes
+
+        @param dtx: Matrix (core, port) of the bytes transmitted in the round
+        @param drx: Matrix (core, port) of the bytes received in the round
+        @param threshold: Minimum bytes of a flow in the round
+        @return: Array of (core row, out_port index, in_port index)
+        """
+        n_rows = dtx.shape[0]
+        shards = min(self.workers, n_rows // self.min_rows)
+        if shards <= 1 or n_rows > self.shape[0]:
+            return search_port_flows(dtx, drx, threshold)
+
+        self.snapshot[:n_rows, :, 0] = dtx
+        self.snapshot[:n_rows, :, 1] = drx
+        bounds = np.linspace(0, n_rows, shards + 1, dtype=int)
+        futures = [ self.pool.submit(_search_shard, int(start), int(end), threshold) for start, end in zip(bounds[:-1], bounds[1:]) ]
+        return np.concatenate([ future.result() for future in futures ])
+
+
+    def close(self) -> None:
+        self.pool.shutdown(cancel_futures=True)
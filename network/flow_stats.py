@@ -0,0 +1,80 @@
+from switch import Switch
+import typing
+
+# Exact-match mask of the /32 flow entries, as returned by the flow stats parser
+EXACT_MASKS = ( '255.255.255.255', 0xFFFFFFFF )
+
+
+class FlowStatsCollector():
+
+    def __init__(self, k: int) -> None:
+        """ Estimate the rate of each (destination IP, core switch) flow from the byte counters of the /32 uplink
+        entries of the aggregation switches: the core switch is identified by the aggregation switch and its
+        output port, the source pod by the aggregation switch pod.
+
+        @param k: The fat-tree parameter
+        """
+        self.k: int = k
+        self.k_2: int = k // 2
+        self.byte_counts: typing.Dict[typing.Tuple[int, str, int, int], int] = {}    # (dpid, dst IP, port, priority) -> bytes
+        self.deltas: typing.Dict[typing.Tuple[int, str, int, int], int] = {}         # Bytes matched in the last round
+        self.parts: typing.Dict[int, list] = {}                                      # Replies split in multiple messages
+
+
+    def save(self, dpid: int, stats: list, more: bool = False) -> bool:
+        """ Save the flow descriptions sent by an aggregation switch
+
+        @param dpid: The datapath id of the switch
+        @param stats: List of OFPFlowDesc
+        @param more: If other parts of the reply will follow
+        @return: True if the reply of the switch is complete
+        """
+        self.parts.setdefault(dpid, []).extend(stats)
+        if more:
+            return False
+
+        # Forget the entries of the switch, so that the expired ones are removed
+        previous_counts = {}
+        for key in [ key for key in self.byte_counts if key[0] == dpid ]:
+            previous_counts[key] = self.byte_counts.pop(key)
+            self.deltas.pop(key, None)
+
+        for stat in self.parts.pop(dpid):
+            entry = self.__parse(dpid, stat)
+            if entry is None:
+                continue
+            key, byte_count = entry
+            previous = previous_counts.get(key, 0)
+            self.deltas[key] = byte_count - previous if byte_count >= previous else byte_count
+            self.byte_counts[key] = byte_count
+        return True
+
+
+    def get_flows(self, round_duration: float) -> typing.List[typing.Tuple[Switch, int, int, str, float]]:
+        """ Return the flows seen in the last round
+
+        @param round_duration: Duration of the round in seconds, to compute the rates
+        @return: List of (core switch, source pod, destination pod, destination IP, byte rate)
+        """
+        flows = []
+        for (dpid, dst_ip, port, _), delta in self.deltas.items():
+            aggr = Switch.get(dpid)
+            core = Switch.get(int(Switch.make_dpid(True, aggr.swn - self.k_2 + 1, port - self.k_2, self.k), 16))
+            flows.append((core, aggr.pod, int(dst_ip.split('.')[1]), dst_ip, delta / round_duration))
+        return flows
+
+
+    def __parse(self, dpid: int, stat) -> typing.Optional[typing.Tuple[typing.Tuple[int, str, int, int], int]]:
+        """ Return the key and the byte counter of a /32 uplink entry, None for the other entries """
+        dst = stat.match.get('ipv4_dst_nxm', stat.match.get('ipv4_dst'))
+        if dst is None:
+            return None     # Table-miss entry
+        if isinstance(dst, tuple):
+            dst, mask = dst
+            if mask not in EXACT_MASKS:
+                return None     # Two-level prefix routes
+        ports = [ action.port for inst in stat.instructions for action in getattr(inst, 'actions', [])
+                  if hasattr(action, 'port') ]
+        if len(ports) == 0 or not self.k_2 < ports[0] <= 2 * self.k_2:
+            return None     # Not an uplink entry
+        return (dpid, dst, ports[0], stat.priority), dict(stat.stats.fields).get('byte_count', 0)
@@ -0,0 +1,215 @@
+from metrics import REGISTRY
+import collections
+import typing
+
+# Priorities of the entries: two-level routes and uplinks, paths created by the scheduler, drops of the denied pairs
+ROUTE_PRIORITY = 1
+PATH_PRIORITY = 2
+DROP_PRIORITY = 3
+
+EXACT_MASK = 0xFFFFFFFF
+
+EVICTIONS = REGISTRY.counter('sdn_flow_evictions_total', 'Flow entries evicted to respect the flow table budget').labels()
+
+
+class TableEntry():
+
+    __slots__ = ('value', 'mask', 'priority', 'action', 'timeout', 'static', 'members', 'byte_count')
+
+    def __init__(self, value: int, mask: int, priority: int, action: tuple, timeout: int, static: bool, members: typing.FrozenSet[int]) -> None:
+        """ Flow entry of the shadow table
+
+        @param value: Destination address (already masked)
+        @param mask: Destination mask, not necessarily contiguous
+        @param priority: Priority of the entry
+        @param action: (output port, group) of the entry
+        @param timeout: Idle timeout of the entry
+        @param static: Never evicted or merged (two-level routes)
+        @param members: The /32 destinations merged in the entry
+        """
+        self.value: int = value
+        self.mask: int = mask
+        self.priority: int = priority
+        self.action: tuple = action
+        self.timeout: int = timeout
+        self.static: bool = static
+        self.members: typing.FrozenSet[int] = members
+        self.byte_count: int = 0        # Byte counter of the switch at the last refresh
+
+
+    @property
+    def key(self) -> typing.Tuple[int, int, int]:
+        return (self.value, self.mask, self.priority)
+
+
+    def same_rule(self, other: 'TableEntry') -> bool:
+        return self.action == other.action and self.timeout == other.timeout and self.static == other.static
+
+
+class FlowTable():
+
+    def __init__(self, budget: typing.Optional[int] = None, aggregate: bool = False) -> None:
+        """ Shadow of the flow table of a switch, used to send only the FlowMods that change the table.
+        With aggregation, /32 entries with the same action are merged as long as they differ in a single
+        bit of the destination: the merged entry matches exactly the same destinations, so the slices are
+        still enforced, with a (non-contiguous) mask that suits the suffix-based two-level routing.
+        With a budget, the least recently used entries are evicted and their destinations go back to PacketIn:
+        an entry is used when the controller sends it again and when its byte counter on the switch grows (see refresh),
+        since the packets matched by an installed entry never reach the controller.
+
+        @param budget: Maximum number of entries installed by the controller, None for no limit
+        @param aggregate: Merge the /32 entries with the same action
+        """
+        self.budget: typing.Optional[int] = budget
+        self.aggregate: bool = aggregate
+        self.entries: typing.OrderedDict[tuple, TableEntry] = collections.OrderedDict()   # Least recently used first
+        self.members: typing.Dict[typing.Tuple[int, int], tuple] = {}     # (/32 destination, priority) -> key of its entry
+        self.before: typing.Dict[tuple, typing.Optional[TableEntry]] = {}  # Entries changed by the current operation
+        self.resend: typing.Set[tuple] = set()
+
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+    def add(self, value: int, mask: int, priority: int, action: tuple, timeout: int = 0, static: bool = False,
+            force: bool = False) -> typing.Tuple[typing.List[TableEntry], typing.List[TableEntry]]:
+        """ Add an entry, replacing the one with the same match and priority
+
+        @param value: Destination address
+        @param mask: Destination mask
+        @param priority: Priority of the entry
+        @param action: (output port, group) of the entry
+        @param timeout: Idle timeout of the entry
+        @param static: Never evicted or merged
+        @param force: Send the entry covering the destination even if the shadow has it (e.g. after a table miss)
+        @return: The entries to install and the entries to delete on the switch
+        """
+        entry = TableEntry(value & mask, mask, priority, action, timeout, static, frozenset([ value ]) if mask == EXACT_MASK else frozenset())
+        current_key = self.members.get((value, priority)) if mask == EXACT_MASK else entry.key
+        current = self.entries.get(current_key)
+
+        if current is not None and current.same_rule(entry):
+            if not current.static:
+                self.entries.move_to_end(current_key)
+            if force:
+                self.resend.add(current_key)
+            return self.__commit()
+
+        if current is not None:
+            self.__split(current_key, value if mask == EXACT_MASK else None)
+        key = self.__insert(entry)
+        self.__evict(key)
+        return self.__commit()
+
+
+    def remove(self, value: int, mask: int, priority: int) -> typing.Tuple[typing.List[TableEntry], typing.List[TableEntry]]:
+        """ Remove an entry, or a destination from the merged entry containing it
+
+        @return: The entries to install and the entries to delete on the switch
+        """
+        key = self.members.get((value, priority)) if mask == EXACT_MASK else (value & mask, mask, priority)
+        if key in self.entries:
+            self.__split(key, value if mask == EXACT_MASK else None)
+            self.__evict(None)      # The other destinations of a merged entry may need more entries
+        return self.__commit()
+
+
+    def expired(self, value: int, mask: int, priority: int) -> None:
+        """ Forget an entry removed by the switch (idle timeout) """
+        key = (value & mask, mask, priority)
+        if key in self.entries:
+            self.__drop(key)
+        self.before = {}
+
+
+    def destinations(self, priority: int) -> typing.Dict[int, TableEntry]:
+        """ Return the entry of every /32 destination with the provided priority, merged entries included """
+        return { member: self.entries[key] for (member, member_priority), key in self.members.items() if member_priority == priority }
+
+
+    def refresh(self, byte_counts: typing.Dict[tuple, int]) -> None:
+        """ Mark as recently used the entries that matched packets since the last refresh, the busiest last
+
+        @param byte_counts: (value, mask, priority) -> byte counter of the entry on the switch
+        """
+        active = []
+        for key, byte_count in byte_counts.items():
+            entry = self.entries.get(key)
+            if entry is None or entry.static or byte_count == entry.byte_count:
+                continue
+            active.append((byte_count - entry.byte_count if byte_count > entry.byte_count else byte_count, key))
+            entry.byte_count = byte_count
+        for _, key in sorted(active):
+            self.entries.move_to_end(key)
+
+
+    def __insert(self, entry: TableEntry) -> tuple:
+        """ Add an entry, merging it with the entries that differ in one bit of the destination """
+        while self.aggregate and not entry.static and len(entry.members) > 0:
+            for bit in range(32):
+                flag = 1 << bit
+                if not entry.mask & flag:
+                    continue
+                buddy = self.entries.get((entry.value ^ flag, entry.mask, entry.priority))
+                if buddy is not None and buddy.same_rule(entry):
+                    break
+            else:
+                break
+            self.__drop(buddy.key)
+            entry = TableEntry(entry.value & ~flag, entry.mask & ~flag, entry.priority, entry.action, entry.timeout,
+                               False, entry.members | buddy.members)
+
+        self.__save(entry.key)
+        self.entries[entry.key] = entry
+        self.entries.move_to_end(entry.key)
+        for member in entry.members:
+            self.members[(member, entry.priority)] = entry.key
+        return entry.key
+
+
+    def __split(self, key: tuple, removed: typing.Optional[int]) -> None:
+        """ Remove an entry and insert again its destinations except the removed one """
+        entry = self.__drop(key)
+        for member in entry.members:
+            if member != removed:
+                self.__insert(TableEntry(member, EXACT_MASK, entry.priority, entry.action, entry.timeout, False, frozenset([ member ])))
+
+
+    def __drop(self, key: tuple) -> TableEntry:
+        self.__save(key)
+        entry = self.entries.pop(key)
+        for member in entry.members:
+            self.members.pop((member, entry.priority), None)
+        return entry
+
+
+    def __evict(self, protected: typing.Optional[tuple]) -> None:
+        """ Remove the least recently used entries above the budget, except the protected one """
+        while self.budget is not None and len(self.entries) > self.budget:
+            key = next(( key for key, entry in self.entries.items() if not entry.static and key != protected ), None)
+            if key is None:
+                return
+            self.__drop(key)
+            EVICTIONS.inc()
+
+
+    def __save(self, key: tuple) -> None:
+        """ Remember the entry before the first change of the current operation """
+        if key not in self.before:
+            self.before[key] = self.entries.get(key)
+
+
+    def __commit(self) -> typing.Tuple[typing.List[TableEntry], typing.List[TableEntry]]:
+        """ Compare the changed entries with their state before the operation """
+        added, deleted = [], []
+        for key, old in self.before.items():
+            new = self.entries.get(key)
+            if new is None:
+                if old is not None:
+                    deleted.append(old)
+            elif old is None or not new.same_rule(old) or key in self.resend:
+                added.append(new)
+        added += [ self.entries[key] for key in self.resend if key not in self.before ]
+        self.before, self.resend = {}, set()
+        return added, deleted
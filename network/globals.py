@@ -1,4 +1,84 @@
-FAT_TREE_K = 4
+import os
+
+# Fat-tree parameter (number of pods and ports of the switches), can be set at runtime with the
+# FAT_TREE_K environment variable of both the controller and the simulation
+FAT_TREE_K = int(os.environ.get('FAT_TREE_K', 4))
+
+# Install the uplink routes of the pod switches when they connect, instead of on PacketIn
+PROACTIVE_ROUTING = False
+
+# Send the FlowMods of a path update as an atomic OpenFlow bundle (requires switch support, e.g. OVS)
+FLOW_BUNDLES = False
+
+# Forward the uplink traffic of the pod switches through a select group over all the uplinks, weighted from
+# the port stats, instead of pinning every destination to a single uplink (requires OpenFlow 1.5 groups, e.g. OVS)
+ECMP_GROUPS = False
+
+# Maximum flow entries installed by the controller on every switch (two-level routes included), the least recently
+# used entries are evicted and go back to PacketIn; None for no limit
+FLOW_TABLE_BUDGET = None
+
+# Merge the /32 entries of a switch with the same action into masked entries matching exactly the same destinations
+# (not with FLOW_DETECTION = 'flows', which needs the counters of the /32 entries)
+FLOW_TABLE_AGGREGATION = False
+
+# PacketIn admission: token buckets (PacketIns per second and burst) of every switch and of every source host,
+# None for no limit; time (seconds) the PacketIns for a destination just installed on a switch are ignored;
+# hard timeout (seconds) of the drop entries installed for the pairs denied by the slices, 0 installs none
+PACKET_IN_SWITCH_RATE = 1000
+PACKET_IN_SWITCH_BURST = 500
+PACKET_IN_SOURCE_RATE = 100
+PACKET_IN_SOURCE_BURST = 100
+PACKET_IN_COALESCE = 1
+DENY_TIMEOUT = 10
+
+# Flow scheduler polling intervals (seconds): the interval drops to the minimum when the traffic spikes,
+# returns to the default one with steady traffic and backs off up to the maximum when the network is idle
+SCHEDULER_INTERVAL = 10
+SCHEDULER_MIN_INTERVAL = 2
+SCHEDULER_MAX_INTERVAL = 30
+
+# Minimum time (seconds) between two network optimizations, to let the stats reflect the new paths
+SCHEDULER_OPTIMIZE_COOLDOWN = 20
+
+# Worker processes that search the flows of groups of core switches in parallel (FLOW_DETECTION = 'ports'),
+# for large fabrics; 0 searches them in the scheduler thread
+SCHEDULER_WORKERS = 0
+
+# Minimum byte rate (bytes/s) on a core switch port to consider a flow
+FLOW_RATE_THRESHOLD = 100
+
+# Flow detection backend: 'ports' pairs the in/out port deltas of the core switches,
+# 'flows' reads the byte counters of the /32 uplink entries of the aggregation switches
+FLOW_DETECTION = 'ports'
+
+# Maximum number of Docker hosts and containers created at the same time by the simulation
+BRINGUP_WORKERS = 8
+
+# Create only the hosts used by the slices, services and clients at startup, the others when a service is moved there
+DEFER_UNUSED_HOSTS = False
+
+# Service migration: maximum time (seconds) to wait for the new container to accept connections, time the old
+# container keeps serving the clients that did not switch yet, standby containers kept ready in every pod
+MIGRATION_READY_TIMEOUT = 30
+MIGRATION_DRAIN = 5
+STANDBY_PER_POD = 0
+
+# Path of the JSONL trace of the scheduler cycles (stats, flows, congestions, decisions, FlowMods), None disables it
+SCHEDULER_TRACE = None
+
+# Port of the local HTTP endpoint exposing the controller metrics in the Prometheus format, None disables it
+METRICS_PORT = 9200
+
+# Size (bytes) of the response of the services, 0 for the default response
+SERVICE_PAYLOAD = 0
+
+# Options of the clients in load generator mode (see services/client.py), e.g. '--threads 8 --rate 200'.
+# None runs the clients with one request per second
+CLIENT_LOAD = None
+
+# Shared memory file with the running services, mounted in the containers as /home/services.dir
+SERVICES_DIRECTORY = './services/services.dir'
 
 slices = {
     0: ['10.0.0.2', '10.1.0.2',],
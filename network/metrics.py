@@ -0,0 +1,129 @@
+from bisect import bisect_left
+import typing
+
+# Default buckets (seconds) of the latency histograms
+LATENCY_BUCKETS = ( 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10 )
+
+
+class Counter():
+
+    def __init__(self) -> None:
+        self.value: float = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self, name: str, labels: str) -> typing.Iterator[str]:
+        yield f'{name}{{{labels}}} {self.value}' if labels else f'{name} {self.value}'
+
+
+class Gauge(Counter):
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram():
+
+    def __init__(self, buckets: typing.Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets: typing.Sequence[float] = buckets
+        self.counts: typing.List[int] = [0] * (len(buckets) + 1)     # Last one is the +Inf bucket
+        self.sum: float = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str) -> typing.Iterator[str]:
+        prefix = labels + ',' if labels else ''
+        total = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {total}'
+        suffix = f'{{{labels}}}' if labels else ''
+        yield f'{name}_sum{suffix} {self.sum}'
+        yield f'{name}_count{suffix} {total}'
+
+
+class Metric():
+
+    def __init__(self, name: str, kind: str, help: str, labels: typing.Sequence[str], factory: typing.Callable) -> None:
+        """ Family of samples of a metric, one for every combination of the label values
+
+        @param name: Name of the metric
+        @param kind: 'counter' | 'gauge' | 'histogram'
+        @param help: Description of the metric
+        @param labels: Names of the labels
+        @param factory: Creates the value of a new combination of labels
+        """
+        self.name: str = name
+        self.kind: str = kind
+        self.help: str = help
+        self.label_names: typing.Sequence[str] = labels
+        self.factory: typing.Callable = factory
+        self.children: typing.Dict[tuple, typing.Any] = {}
+        if len(labels) == 0:
+            self.children[()] = factory()
+
+
+    def labels(self, *values) -> typing.Any:
+        """ Return the value (Counter, Gauge or Histogram) of a combination of labels, to be kept by the caller
+        on hot paths. Metrics without labels are returned by labels() without arguments.
+        """
+        child = self.children.get(values)
+        if child is None:
+            child = self.children.setdefault(values, self.factory())
+        return child
+
+
+    def render(self) -> typing.Iterator[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        for values, child in list(self.children.items()):
+            labels = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, values))
+            yield from child.samples(self.name, labels)
+
+
+class Registry():
+
+    def __init__(self) -> None:
+        """ In-process metrics registry rendered in the Prometheus text format. Updating a metric is a
+        plain attribute increment, so metrics can stay enabled on the PacketIn path.
+        """
+        self.metrics: typing.Dict[str, Metric] = {}
+
+
+    def counter(self, name: str, help: str, labels: typing.Sequence[str] = ()) -> Metric:
+        return self.__register(name, 'counter', help, labels, Counter)
+
+
+    def gauge(self, name: str, help: str, labels: typing.Sequence[str] = ()) -> Metric:
+        return self.__register(name, 'gauge', help, labels, Gauge)
+
+
+    def histogram(self, name: str, help: str, labels: typing.Sequence[str] = (), buckets: typing.Sequence[float] = LATENCY_BUCKETS) -> Metric:
+        return self.__register(name, 'histogram', help, labels, lambda: Histogram(buckets))
+
+
+    def render(self) -> str:
+        """ Return all the metrics in the Prometheus text exposition format """
+        return '\n'.join(line for metric in list(self.metrics.values()) for line in metric.render()) + '\n'
+
+
+    def wsgi_app(self, environ: dict, start_response: typing.Callable) -> typing.List[bytes]:
+        """ WSGI application serving the metrics on any path """
+        body = self.render().encode()
+        start_response('200 OK', [ ('Content-Type', 'text/plain; version=0.0.4'), ('Content-Length', str(len(body))) ])
+        return [ body ]
+
+
+    def __register(self, name: str, kind: str, help: str, labels: typing.Sequence[str], factory: typing.Callable) -> Metric:
+        """ Return the metric with the provided name, creating it the first time """
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics.setdefault(name, Metric(name, kind, help, tuple(labels), factory))
+        return metric
+
+
+# Registry shared by the controller modules
+REGISTRY = Registry()
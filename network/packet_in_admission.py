@@ -0,0 +1,125 @@
+from time import monotonic
+import typing
+
+# Number of tracked pairs or sources above which the expired ones are pruned
+PRUNE_SIZE = 4096
+
+
+class TokenBucket():
+
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        """ Token bucket refilled at rate tokens per second, holding at most burst tokens """
+        self.rate: float = rate
+        self.burst: float = burst
+        self.tokens: float = burst
+        self.last: float = now
+
+
+    def take(self, now: float) -> bool:
+        """ Consume a token, return False if the bucket is empty """
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+    def idle(self, now: float) -> bool:
+        """ Return True if the bucket is full again, so that it can be forgotten """
+        return self.tokens + (now - self.last) * self.rate >= self.burst
+
+
+class PacketInAdmission():
+
+    def __init__(self, switch_rate: typing.Optional[float] = None, switch_burst: float = 0,
+                 source_rate: typing.Optional[float] = None, source_burst: float = 0,
+                 coalesce: float = 0, deny_timeout: float = 0, clock: typing.Callable[[], float] = monotonic) -> None:
+        """ Decide which PacketIns the controller handles, so that its CPU stays bounded when hosts misbehave:
+        token buckets limit the PacketIns of every switch and of every source host, PacketIns for a destination
+        just installed on a switch are coalesced, and the pairs denied by the slices get a drop entry once.
+
+        @param switch_rate: PacketIns per second handled for every switch, None for no limit
+        @param switch_burst: PacketIns handled at once for every switch
+        @param source_rate: PacketIns per second handled for every source host, None for no limit
+        @param source_burst: PacketIns handled at once for every source host
+        @param coalesce: Time (seconds) the PacketIns for a destination just installed on a switch are ignored
+        @param deny_timeout: Hard timeout (seconds) of the drop entries of the denied pairs, 0 installs none
+        @param clock: Source of the current time in seconds
+        """
+        self.switch_rate: typing.Optional[float] = switch_rate
+        self.switch_burst: float = switch_burst
+        self.source_rate: typing.Optional[float] = source_rate
+        self.source_burst: float = source_burst
+        self.coalesce_window: float = coalesce
+        self.deny_timeout: float = deny_timeout
+        self.clock: typing.Callable[[], float] = clock
+        self.switches: typing.Dict[int, TokenBucket] = {}                 # dpid -> bucket
+        self.sources: typing.Dict[int, TokenBucket] = {}                  # Packed source address -> bucket
+        self.installed: typing.Dict[typing.Tuple[int, int], float] = {}   # (dpid, dst) -> time the entry was sent
+        self.denied: typing.Dict[typing.Tuple[int, int, int], float] = {} # (dpid, src, dst) -> expiration of the drop entry
+
+
+    def admit_switch(self, dpid: int) -> bool:
+        """ Return False if the switch exceeded its PacketIn rate """
+        if self.switch_rate is None:
+            return True
+        now = self.clock()
+        bucket = self.switches.get(dpid)
+        if bucket is None:
+            bucket = self.switches[dpid] = TokenBucket(self.switch_rate, self.switch_burst, now)
+        return bucket.take(now)
+
+
+    def admit_source(self, src: int) -> bool:
+        """ Return False if the source host exceeded its PacketIn rate """
+        if self.source_rate is None:
+            return True
+        now = self.clock()
+        bucket = self.sources.get(src)
+        if bucket is None:
+            if len(self.sources) >= PRUNE_SIZE:
+                self.sources = { key: bucket for key, bucket in self.sources.items() if not bucket.idle(now) }
+            bucket = self.sources[src] = TokenBucket(self.source_rate, self.source_burst, now)
+        return bucket.take(now)
+
+
+    def coalesce(self, dpid: int, dst: int) -> bool:
+        """ Return True if the entry for the destination was just sent to the switch, so that the PacketIns
+        of the packets queued before the entry was applied do not send it again (see mark_sent)
+        """
+        sent = self.installed.get((dpid, dst))
+        return sent is not None and self.clock() - sent < self.coalesce_window
+
+
+    def mark_sent(self, dpid: int, dst: int) -> None:
+        """ Remember that the entry for the destination is being sent to the switch """
+        now = self.clock()
+        if len(self.installed) >= PRUNE_SIZE:
+            self.installed = { key: sent for key, sent in self.installed.items() if now - sent < self.coalesce_window }
+        self.installed[(dpid, dst)] = now
+
+
+    def deny(self, dpid: int, src: int, dst: int) -> bool:
+        """ Return True if a drop entry for the denied pair has to be sent to the switch, i.e. it was not sent yet
+        or it expired. Otherwise the PacketIn comes from a packet queued before the entry was applied.
+        """
+        if self.deny_timeout <= 0:
+            return False
+        now = self.clock()
+        key = (dpid, src, dst)
+        expiration = self.denied.get(key)
+        if expiration is not None and now < expiration:
+            return False
+        if len(self.denied) >= PRUNE_SIZE:
+            self.denied = { key: expiration for key, expiration in self.denied.items() if now < expiration }
+        self.denied[key] = now + self.deny_timeout
+        return True
+
+
+    def reset(self) -> None:
+        """ Forget the sent entries, after the slices changed and the drop entries were removed """
+        self.installed = {}
+        self.denied = {}
@@ -0,0 +1,28 @@
+from ryu.lib.packet import packet, ipv4
+from slice_registry import ip_to_int
+import struct
+import typing
+
+ETH_TYPE_IPV4 = 0x0800
+ETH_TYPE_VLAN = ( 0x8100, 0x88A8 )
+
+# Untagged Ethernet header followed by the IPv4 header: EtherType, version and IHL, source and destination address
+ETH_IPV4 = struct.Struct('!12xHB11xII')
+
+
+def parse_ipv4_addresses(data: bytes) -> typing.Optional[typing.Tuple[int, int]]:
+    """ Return the packed source and destination addresses of an IPv4 packet. Untagged frames are read at fixed
+    offsets without copying or decoding the packet, VLAN tagged and truncated frames go through the Ryu packet library.
+
+    @param data: The Ethernet frame, e.g. the data of a PacketIn
+    @return: (source, destination) packed addresses, None if the frame is not IPv4
+    """
+    if len(data) >= ETH_IPV4.size:
+        eth_type, version, src, dst = ETH_IPV4.unpack_from(data)
+        if eth_type == ETH_TYPE_IPV4 and version >> 4 == 4:
+            return src, dst
+        if eth_type not in ETH_TYPE_VLAN:
+            return None
+
+    ip_pkt = packet.Packet(data).get_protocol(ipv4.ipv4)
+    return None if ip_pkt is None else (ip_to_int(ip_pkt.src), ip_to_int(ip_pkt.dst))
@@ -0,0 +1,88 @@
+from switch import Switch
+from globals import FLOW_RATE_THRESHOLD
+import numpy as np
+import typing
+
+
+class PathEngine():
+
+    def __init__(self, smoothing: float = 0.5) -> None:
+        """ Keep the utilization of the core switch downlinks and choose the core switch of the paths
+        to minimize the most utilized downlink towards each pod.
+
+        @param smoothing: Weight of the last polling round in the moving average of the utilization
+        """
+        self.smoothing: float = smoothing
+        self.cores: typing.List[Switch] = []
+        self.load = np.zeros((0, 0))    # (core, pod) -> byte rate on the downlink from the core switch to the pod
+
+
+    def update(self, cores: typing.List[Switch], rates: np.ndarray) -> None:
+        """ Update the downlink utilization with the stats of the last polling round
+
+        @param cores: The core switches, in the same order of the rows of rates
+        @param rates: Matrix (core, pod) of the byte rates (bytes/s) transmitted by the core switch ports
+        """
+        if cores != self.cores or rates.shape != self.load.shape:
+            self.cores = list(cores)
+            self.load = rates.astype(float)
+        else:
+            self.load = self.smoothing * rates + (1 - self.smoothing) * self.load
+
+
+    def get_pod_rate(self, pod: int) -> float:
+        """ Return the total byte rate entering a pod from the core switches """
+        return float(self.load[:, pod].sum()) if len(self.cores) > 0 else 0
+
+
+    def get_idle_core(self, pod: int) -> typing.Optional[Switch]:
+        """ Return the core switch with the least utilized downlink to the pod, if it carries no flow
+
+        @param pod: Destination pod of the downlink
+        @return: Core switch || None
+        """
+        if len(self.cores) == 0:
+            return None
+        core = int(np.argmin(self.load[:, pod]))
+        if self.load[core, pod] < FLOW_RATE_THRESHOLD:
+            return self.cores[core]
+        return None
+
+
+    def assign(self, demands: typing.List[typing.Tuple[str, int, float, typing.Optional[Switch]]]) -> typing.Dict[str, typing.Optional[Switch]]:
+        """ Choose the core switch of a set of paths at once with a greedy bin-packing: the traffic of the
+        paths is first removed from the downlinks, then paths are placed from the largest to the smallest,
+        each on the core switch whose downlink to the destination pod is the least utilized.
+        A path is placed only if it lowers the utilization of the most utilized downlink to its pod.
+
+        @param demands: List of (id, destination pod, byte rate, current core switch or None if unknown)
+        @return: Dict of id -> core switch to use, or None if no core switch improves the utilization
+        """
+        if len(self.cores) == 0:
+            return { key: None for key, _, _, _ in demands }
+
+        load = self.load.copy()
+        peak = load.max(axis=0)
+        removed: typing.Dict[str, np.ndarray] = {}
+
+        # Remove the traffic of the paths to be placed from their current downlinks
+        for key, pod, rate, current in demands:
+            traffic = np.zeros(len(self.cores))
+            if current in self.cores:
+                core = self.cores.index(current)
+                traffic[core] = min(rate, load[core, pod])
+            elif load[:, pod].sum() > 0:
+                traffic = load[:, pod] * min(1, rate / load[:, pod].sum())   # Path unknown, spread by two-level routing
+            load[:, pod] -= traffic
+            removed[key] = traffic
+
+        paths = {}
+        for key, pod, rate, _ in sorted(demands, key=lambda demand: -demand[2]):
+            core = int(np.argmin(load[:, pod]))
+            if load[core, pod] + rate < peak[pod]:
+                load[core, pod] += rate
+                paths[key] = self.cores[core]
+            else:
+                load[:, pod] += removed[key]    # The path is not changed
+                paths[key] = None
+        return paths
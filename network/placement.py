@@ -0,0 +1,116 @@
+from switch import Switch
+from path_engine import PathEngine
+from slice_registry import SliceRegistry, ip_to_int, int_to_ip
+import bisect
+import typing
+
+
+class PlacementEngine():
+
+    def __init__(self, k: int, path_engine: PathEngine, slice_registry: SliceRegistry,
+                 cooldown: float = 120, migration_cost: float = 0.2, headroom_weight: float = 0.1) -> None:
+        """ Choose the host where to migrate a service by scoring the candidate pods on the expected utilization
+        of the path from the clients, the cost of the migration and the free hosts left in the pod.
+
+        @param k: The fat-tree parameter
+        @param path_engine: Provides the utilization of the core switch downlinks
+        @param slice_registry: Provides the clients of the services (hosts in the same slice)
+        @param cooldown: Time (seconds) during which moving again a service is penalized
+        @param migration_cost: Cost of moving a container, relative to the utilization of a congested downlink
+        @param headroom_weight: Weight of the fraction of used hosts in the candidate pod
+        """
+        self.k: int = k
+        self.path_engine: PathEngine = path_engine
+        self.slice_registry: SliceRegistry = slice_registry
+        self.cooldown: float = cooldown
+        self.migration_cost: float = migration_cost
+        self.headroom_weight: float = headroom_weight
+        self.hosts_per_pod: int = (k // 2) ** 2
+        self.free_hosts: typing.Dict[int, typing.List[int]] = {}    # Pod -> packed addresses of the hosts without services, sorted
+        self.version: int = -1                                      # Version of the services used for the index
+        self.last_migration: typing.Dict[str, float] = {}           # Service ID -> time of the last migration
+
+
+    def sync(self, version: int, services: typing.Dict[str, str], pending: typing.Optional[typing.Dict[str, str]] = None) -> None:
+        """ Rebuild the free hosts index if the services changed
+
+        @param version: Version of the service directory
+        @param services: The running services
+        @param pending: Target hosts of the pending migrations, not available either
+        """
+        if version == self.version:
+            return
+        used = { ip_to_int(ip) for ip in services.values() } | { ip_to_int(ip) for ip in (pending or {}).values() }
+        self.free_hosts = {
+            pod: sorted({ ip_to_int(f'10.{pod}.{s}.{h}') for s in range(self.k // 2) for h in range(2, self.k // 2 + 2) } - used)
+            for pod in range(self.k)
+        }
+        self.version = version
+
+
+    def move(self, version: int, old_ip: typing.Optional[str], new_ip: str) -> None:
+        """ Update the free hosts index after a migration
+
+        @param version: Version of the service directory after the migration
+        @param old_ip: Host released by the service, None if it is still in use
+        @param new_ip: Host now running the service
+        """
+        if old_ip is not None:
+            free, host = self.free_hosts[int(old_ip.split('.')[1])], ip_to_int(old_ip)
+            index = bisect.bisect_left(free, host)
+            if index == len(free) or free[index] != host:
+                free.insert(index, host)
+        free, host = self.free_hosts[int(new_ip.split('.')[1])], ip_to_int(new_ip)
+        index = bisect.bisect_left(free, host)
+        if index < len(free) and free[index] == host:
+            del free[index]
+        self.version = version
+
+
+    def choose(self, service_id: str, service_ip: str, rate: float, now: float) -> typing.Optional[typing.Tuple[str, Switch]]:
+        """ Return the best host for the service and the core switch of the path to it, if moving the service
+        costs less than keeping it in its current pod.
+
+        @param service_id: The ID of the service
+        @param service_ip: The host currently running the service
+        @param rate: Estimated byte rate (bytes/s) of the service traffic
+        @param now: Time of the scheduler cycle
+        @return: (host IP, core switch) || None
+        """
+        src_pod = int(service_ip.split('.')[1])
+        clients = [ host for slice_id in self.slice_registry.get_slices(service_ip)
+                    for host in self.slice_registry.slices[slice_id] if host != service_ip ]
+        reference = max(self.path_engine.load[:, src_pod].max(), rate, 1) if len(self.path_engine.cores) > 0 else 1
+
+        # Cost of keeping the service where it is: its clients cross the congested downlinks
+        best_cost = self.__get_remote_clients(clients, src_pod)
+        best = None
+
+        penalty = self.migration_cost
+        if now - self.last_migration.get(service_id, 0) < self.cooldown:
+            penalty *= 10   # Avoid moving back and forth the same service
+
+        for pod in range(self.k):
+            if pod == src_pod or len(self.free_hosts.get(pod, ())) == 0:
+                continue
+            core = self.path_engine.get_idle_core(pod)
+            if core is None:
+                continue    # All the downlinks to the pod are already in use
+
+            core_index = self.path_engine.cores.index(core)
+            utilization = (self.path_engine.load[core_index, pod] + rate) / reference
+            used = 1 - (len(self.free_hosts[pod]) - 1) / self.hosts_per_pod
+            cost = utilization * self.__get_remote_clients(clients, pod) + penalty + self.headroom_weight * used
+            if cost < best_cost:
+                best_cost, best = cost, (int_to_ip(self.free_hosts[pod][0]), core)     # Lowest address, as the standby containers
+
+        if best is not None:
+            self.last_migration[service_id] = now
+        return best
+
+
+    def __get_remote_clients(self, clients: typing.List[str], pod: int) -> float:
+        """ Return the fraction of clients outside the pod, whose traffic crosses a core switch """
+        if len(clients) == 0:
+            return 1
+        return sum(1 for host in clients if int(host.split('.')[1]) != pod) / len(clients)
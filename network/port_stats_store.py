@@ -0,0 +1,91 @@
+import numpy as np
+import typing
+
+# Indexes of the counters along the last axis of the stats matrix
+TX, RX, DTX, DRX = 0, 1, 2, 3
+
+
+class PortStatsStore():
+
+    def __init__(self, n_ports: int, history: int = 16) -> None:
+        """ Port statistics of all the switches, stored as a (switch x port x {tx, rx, dtx, drx}) matrix
+        so that the scheduler can analyze them with vectorized operations.
+
+        @param n_ports: Number of ports of each switch
+        @param history: Number of polling rounds kept in the history ring buffer
+        """
+        self.n_ports: int = n_ports
+        self.rows: typing.Dict[int, int] = {}       # dpid -> row of the matrix
+        self.dpids: typing.List[int] = []           # row of the matrix -> dpid
+        self.stats = np.zeros((0, n_ports, 4), dtype=np.int64)
+        self.history = np.zeros((history, 0, n_ports, 4), dtype=np.int64)
+        self.rounds: int = 0                        # Number of rounds saved in the history
+
+
+    def __len__(self) -> int:
+        return len(self.dpids)
+
+
+    def get_row(self, dpid: int) -> int:
+        """ Return the row of the switch in the stats matrix, adding it if the switch is new
+
+        @param dpid: The datapath id of the switch
+        @return: The row index
+        """
+        row = self.rows.get(dpid)
+        if row is None:
+            row = len(self.dpids)
+            self.rows[dpid] = row
+            self.dpids.append(dpid)
+            if row == self.stats.shape[0]:
+                # Double the capacity of the matrices
+                capacity = max(1, 2 * row)
+                self.stats = np.concatenate((self.stats, np.zeros((capacity - row, self.n_ports, 4), dtype=np.int64)))
+                self.history = np.concatenate((self.history, np.zeros((self.history.shape[0], capacity - row, self.n_ports, 4), dtype=np.int64)), axis=1)
+        return row
+
+
+    def update(self, dpid: int, ports: typing.List[int], tx_bytes: typing.List[int], rx_bytes: typing.List[int]) -> None:
+        """ Update the current transmitted and received bytes counters of a switch along with the delta counters
+
+        @param dpid: The datapath id of the switch
+        @param ports: The port numbers (ports numbering starts from 1)
+        @param tx_bytes: The new tx_bytes value of each port
+        @param rx_bytes: The new rx_bytes value of each port
+        """
+        stats = self.stats[self.get_row(dpid)]
+        ports = np.asarray(ports, dtype=np.int64) - 1
+        tx_bytes = np.asarray(tx_bytes, dtype=np.int64)
+        rx_bytes = np.asarray(rx_bytes, dtype=np.int64)
+
+        stats[ports, DTX] = tx_bytes - stats[ports, TX]
+        stats[ports, DRX] = rx_bytes - stats[ports, RX]
+        stats[ports, TX] = tx_bytes
+        stats[ports, RX] = rx_bytes
+
+
+    def get(self, rows: typing.Optional[np.ndarray] = None) -> np.ndarray:
+        """ Return the stats matrix (only the rows in use)
+
+        @param rows: Optional selection of rows (indexes or boolean mask)
+        @return: Matrix of shape (switches, ports, 4)
+        """
+        stats = self.stats[:len(self.dpids)]
+        return stats if rows is None else stats[rows]
+
+
+    def commit_round(self) -> None:
+        """ Save the current stats as the latest polling round of the history """
+        self.history[self.rounds % self.history.shape[0]] = self.stats
+        self.rounds += 1
+
+
+    def get_history(self, n_rounds: int) -> np.ndarray:
+        """ Return the stats of the last polling rounds, from the oldest to the latest
+
+        @param n_rounds: Number of rounds (at most the size of the ring buffer)
+        @return: Matrix of shape (rounds, switches, ports, 4)
+        """
+        n_rounds = min(n_rounds, self.rounds, self.history.shape[0])
+        slots = [ (self.rounds - n_rounds + i) % self.history.shape[0] for i in range(n_rounds) ]
+        return self.history[slots, :len(self.dpids)]
@@ -0,0 +1,76 @@
+import json
+import typing
+
+
+class TraceWriter():
+
+    def __init__(self, path: str, header: dict) -> None:
+        """ Append-only JSONL trace of the scheduler cycles. Entries of a cycle are collected in memory
+        and written as a single line when the cycle ends, so tracing costs one write per cycle.
+
+        @param path: Path of the trace file
+        @param header: Configuration of the scheduler, written as first line of the trace
+        """
+        self.file = open(path, 'a', buffering=1 << 16)
+        self.cycle: typing.Optional[dict] = None
+        self.cycles: int = 0
+        self.write({ 'type': 'header', **header })
+
+
+    def begin_cycle(self, now: float, round_duration: float, stats: typing.Dict[int, list]) -> None:
+        """ Start recording a scheduler cycle
+
+        @param now: Time of the cycle
+        @param round_duration: Duration of the polling round
+        @param stats: Snapshot of the port counters, core dpid -> list of [tx, rx] per port
+        """
+        self.cycle = {
+            'type': 'cycle', 'cycle': self.cycles, 't': now, 'round_duration': round_duration,
+            'stats': { str(dpid): ports for dpid, ports in stats.items() },
+            'flows': [], 'expired': [], 'congestions': [], 'decisions': [], 'slices': [], 'flowmods': [], 'groups': [],
+        }
+        self.cycles += 1
+
+
+    def add(self, kind: str, entry: typing.Any) -> None:
+        """ Record an event of the current cycle
+
+        @param kind: 'flows' | 'expired' | 'congestions' | 'decisions' | 'slices' | 'flowmods' | 'groups'
+        @param entry: JSON serializable description of the event
+        """
+        if self.cycle is not None:
+            self.cycle[kind].append(entry)
+
+
+    def end_cycle(self) -> None:
+        """ Write the current cycle to the trace """
+        if self.cycle is not None:
+            self.write(self.cycle)
+            self.cycle = None
+
+
+    def write(self, record: dict) -> None:
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.file.flush()
+
+
+    def close(self) -> None:
+        self.end_cycle()
+        self.file.close()
+
+
+def read_trace(path: str) -> typing.Tuple[dict, typing.List[dict]]:
+    """ Load a trace written by TraceWriter
+
+    @param path: Path of the trace file
+    @return: The header and the list of cycles
+    """
+    header, cycles = {}, []
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+            if record['type'] == 'header':
+                header = record
+            else:
+                cycles.append(record)
+    return header, cycles
@@ -0,0 +1,125 @@
+import socket
+import struct
+import typing
+
+
+def ip_to_int(ip: str) -> int:
+    """ Pack a dotted IPv4 address into a 32-bit integer
+
+    @param ip: IPv4 address in dotted notation
+    @return: The packed integer address
+    """
+    return struct.unpack('!I', socket.inet_aton(ip))[0]
+
+
+def int_to_ip(ip: int) -> str:
+    """ Unpack a 32-bit integer into a dotted IPv4 address
+
+    @param ip: The packed integer address
+    @return: IPv4 address in dotted notation
+    """
+    return socket.inet_ntoa(struct.pack('!I', ip))
+
+
+class SliceRegistry():
+
+    def __init__(self, slices: typing.Dict[int, typing.List[str]]) -> None:
+        """ Index the slices by host, so that checking whether two hosts share a slice
+        does not require scanning every slice list.
+
+        @param slices: The slices dict (slice id -> list of host IPs), kept in sync by the registry
+        """
+        self.slices: typing.Dict[int, typing.List[str]] = slices
+        self.__host_slices: typing.Dict[int, typing.Set[int]] = {}   # Packed host IP -> slice IDs
+        self.__listeners: typing.List[typing.Callable] = []          # Called every time a slice changes
+
+        for slice_id, hosts in slices.items():
+            for ip in hosts:
+                self.__host_slices.setdefault(ip_to_int(ip), set()).add(slice_id)
+
+
+    def add_listener(self, callback: typing.Callable) -> None:
+        """ Register a callback to be invoked (without arguments) after every slice update
+
+        @param callback: The function to call
+        """
+        self.__listeners.append(callback)
+
+
+    def is_allowed(self, src: int, dst: int) -> bool:
+        """ Check whether two hosts can communicate, i.e. they share at least one slice
+
+        @param src: Packed IP address of the source host
+        @param dst: Packed IP address of the destination host
+        @return: True if src and dst are in the same slice, False otherwise
+        """
+        src_slices = self.__host_slices.get(src)
+        if src_slices is None:
+            return False
+        return not src_slices.isdisjoint(self.__host_slices.get(dst, ()))
+
+
+    def get_slices(self, ip: str) -> typing.Set[int]:
+        """ Return the IDs of the slices the host belongs to
+
+        @param ip: IP address of the host
+        @return: Set of slice IDs (empty if the host is not in any slice)
+        """
+        return set(self.__host_slices.get(ip_to_int(ip), ()))
+
+
+    def add_host(self, slice_id: int, ip: str) -> None:
+        """ Add a host to a slice
+
+        @param slice_id: The slice to update
+        @param ip: IP address of the host to add
+        """
+        self.__add(slice_id, ip)
+        self.__notify()
+
+
+    def remove_host(self, slice_id: int, ip: str) -> None:
+        """ Remove a host from a slice
+
+        @param slice_id: The slice to update
+        @param ip: IP address of the host to remove
+        """
+        self.__remove(slice_id, ip)
+        self.__notify()
+
+
+    def move_host(self, old_slice: typing.Optional[int], new_slice: int, ip: str) -> None:
+        """ Move a host to another slice, notifying the listeners once
+
+        @param old_slice: The slice to remove the host from, None if the host is only added
+        @param new_slice: The slice to add the host to
+        @param ip: IP address of the host to move
+        """
+        self.__add(new_slice, ip)
+        if old_slice is not None:
+            self.__remove(old_slice, ip)
+        self.__notify()
+
+
+    def __add(self, slice_id: int, ip: str) -> None:
+        if ip not in self.slices[slice_id]:
+            self.slices[slice_id].append(ip)
+        self.__host_slices.setdefault(ip_to_int(ip), set()).add(slice_id)
+
+
+    def __remove(self, slice_id: int, ip: str) -> None:
+        if ip in self.slices[slice_id]:
+            self.slices[slice_id].remove(ip)
+
+        key = ip_to_int(ip)
+        host_slices = self.__host_slices.get(key)
+        if host_slices is not None:
+            host_slices.discard(slice_id)
+            if not host_slices:
+                del self.__host_slices[key]
+
+
+    def __notify(self) -> None:
+        """ Inform the listeners that the slices changed """
+        for callback in self.__listeners:
+            callback()
@@ -1,84 +1,80 @@
-from network.globals import FAT_TREE_K
 import typing
 
+# Role of the switch, stored in the highest 16 bits of the dpid
+CORE, AGGREGATION, EDGE = 1, 2, 3
+
 class Switch():
 
-    def __init__(self, dpid: int = 0) -> None:
-        self.dpid64 = dpid
-        if len(bin(dpid)) > 18: 
-            dpid = self.__dpid64_to_dpid16(dpid)
+    # Immutable identity of the switch decoded from its dpid (statistics are kept by the scheduler)
+    __slots__ = ('dpid64', 'is_core', 'is_edge', 'pod', 'swn', 'j', 'i', 'name')
 
-        self.dpid: int = dpid
-        # is a core switch
-        self.is_core: bool = self.dpid >> 15
+    # Interned switch descriptors, see Switch.get()
+    registry: typing.Dict[int, 'Switch'] = {}
 
-        # Initialize port stats for the switch, knowing that the number of ports = FAT_TREE_K
-        self.port_stats: typing.Dict[int, PortStats] = { i : PortStats(0, 0) for i in range(1, FAT_TREE_K + 1) }
+    def __init__(self, dpid: int = 0) -> None:
+        self.dpid64: int = dpid
+        role = dpid >> 48
+        x = (dpid >> 24) & 0xFFFFFF
+        y = dpid & 0xFFFFFF
+        # is a core switch
+        self.is_core: bool = role == CORE
+        self.is_edge: bool = role == EDGE
 
         if self.is_core:
             # Coordinates within core grid
-            self.j: int = (self.dpid & 0x3F00) >> 8
-            self.i: int = self.dpid & 0xFF
-            self.name: str = f"c{self.j}{self.i}" 
-            self.is_edge: bool = False
+            self.j: int = x
+            self.i: int = y
+            self.pod: typing.Optional[int] = None
+            self.swn: typing.Optional[int] = None
+            self.name: str = f"c{self.j}_{self.i}"
         else:
-            # Pod number 
-            self.pod: int = (self.dpid & 0x3F00) >> 8
-            # Switch number inside pod 
-            self.swn: int = self.dpid & 0xFF
+            # Pod number
+            self.pod: int = x
+            # Switch number inside pod
+            self.swn: int = y
+            self.j: typing.Optional[int] = None
+            self.i: typing.Optional[int] = None
             self.name: str = f"p{self.pod}_s{self.swn}"
-            self.is_edge: bool = self.dpid >> 14
 
 
-    def set_dpid(self, core: bool, x: int, y: int) -> str:
+    @classmethod
+    def get(cls, dpid: int) -> 'Switch':
+        """ Return the interned descriptor of a switch, decoding its dpid only the first time
+
+        @param dpid: The 64-bit dpid of the switch
+        @return: The switch descriptor
+        """
+        switch = cls.registry.get(dpid)
+        if switch is None:
+            switch = cls.registry.setdefault(dpid, cls(dpid))
+        return switch
+
+
+    @staticmethod
+    def make_dpid(core: bool, x: int, y: int, k: int) -> str:
         """Create OpenFlow Datapath ID for the switch. It is used to identify the switch
-        by the SDN controller. It is a 16-bit int composed as follows:
-            is_core  | is_edge | pod_number | switch_number    
-             1 bit   |  1 bit  |   6 bits   |    8 bits   
-        
+        by the SDN controller. It is a 64-bit int, passed to Mininet as 16 hex digits, composed as follows:
+              role   | pod_number or j | switch_number or i
+             16 bits |     24 bits     |      24 bits
+
         @param core: If switch is a core switch
         @param x: X-Coordinate of the switch within the pod or the core grid
-        @param y: Y-Coordinate of the switch within the pod or the core grid  
+        @param y: Y-Coordinate of the switch within the pod or the core grid
+        @param k: The fat-tree parameter, used to tell edge and aggregation switches apart
         @return: dpid
         """
-        self.dpid = bin(core << 15 | (y < (int)(FAT_TREE_K / 2)) << 14 | x << 8 | y)[2:] 
-        return self.dpid
+        role = CORE if core else EDGE if y < k // 2 else AGGREGATION
+        return f'{role:04x}{x:06x}{y:06x}'
 
 
-    def reset_downlink_flows(self) -> None:
-        for port in range(1, FAT_TREE_K + 1):
-            self.port_stats[port].downlink_flows = 0
+    def get_uplink_port(self, dst_hostid: int, k: int) -> int:
+        """ Return the uplink port used by a pod switch to reach a host outside its subtree.
+        Implements the suffix-based port selection of the two-level routing (Al-Fares et al.)
 
-    
-    def __dpid64_to_dpid16(self, dpid_64: int) -> int:
-        """ Convert a 64-bit format dpid to an OpenFlow-standard 16-bit format dpid
-        
-        @param dpid_64: The 64-bit dpid
-        @return: The 16-bit dpid
+        @param dst_hostid: The host ID of the destination, i.e. the last byte of its IP address
+        @param k: The fat-tree parameter
+        @return: The output port (ports numbering starts from 1)
         """
-        dpid_16 = ''
-        dpid_bin = bin(dpid_64)
-        for i in range(2, len(dpid_bin), 4):
-            dpid_16 += dpid_bin[i]
-        return int(dpid_16, 2)
-
-
-class PortStats():
+        k_2 = k // 2
+        return (dst_hostid - 2 + self.swn) % k_2 + k_2 + 1
 
-    def __init__(self, tx_bytes: int = 0, rx_bytes: int = 0) -> None:
-        self.tx_bytes: int = tx_bytes    # Total amount of transmitted bytes (from the beginning of the simulation)
-        self.rx_bytes: int = rx_bytes    # Total amount of received bytes (from the beginning of the simulation)
-        self.dtx_bytes: int = tx_bytes   # Difference between the transmitted bytes now and before the update  
-        self.drx_bytes: int = rx_bytes   # Difference between the received bytes now and before the update
-        self.downlink_flows: int = 0
-
-
-    def update_stats(self, tx_bytes: int, rx_bytes: int) -> None:
-        """ Update the current transmitted and received bytes counters along with the delta counters
-        @param tx_bytes: The new tx_bytes value
-        @param rx_bytes: The new rx_bytes value
-        """
-        self.dtx_bytes = tx_bytes - self.tx_bytes
-        self.drx_bytes = rx_bytes - self.rx_bytes
-        self.tx_bytes = tx_bytes
-        self.rx_bytes = rx_bytes
\ No newline at end of file
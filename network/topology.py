@@ -1,19 +1,28 @@
 #!/usr/bin/python3
 
 from mininet.topo import Topo
+from mininet.util import macColonHex
 from network.switch import Switch
 from network.globals import FAT_TREE_K
 from comnetsemu.node import DockerHost
+import typing
 
 
 class FatTreeTopo(Topo):
     
-    def __init__(self, k: int) -> None:
-        
+    def __init__(self, k: int, hosts: typing.Optional[typing.Set[str]] = None) -> None:
+        """ Build the k-ary fat-tree. Port numbers are explicit, so that deferred hosts can be added
+        later on the same edge switch ports expected by the two-level routing.
+
+        @param k: The fat-tree parameter
+        @param hosts: Names of the hosts to create, the others are deferred (see self.deferred). None creates all the hosts
+        """
         # Initialize topology
         Topo.__init__(self)
         self.k: int = k
         self.k_2: int = int(k / 2)
+        self.created_hosts: typing.Optional[typing.Set[str]] = hosts
+        self.deferred: typing.Dict[str, typing.Tuple[dict, str, int]] = {}   # Host name -> (host params, edge switch, switch port)
 
         # Create k pods
         for n in range(self.k):
@@ -22,10 +31,9 @@ class FatTreeTopo(Topo):
         # Create core switches and link to each pod
         for i in range(1, self.k_2 + 1):
             for j in range(1, self.k_2 + 1):
-                sw = Switch()
-                switch = self.addSwitch(f"c{j}{i}", ip=f"10.{self.k}.{j}.{i}", dpid=sw.set_dpid(True, j, i))
+                switch = self.addSwitch(f"c{j}_{i}", ip=f"10.{self.k}.{j}.{i}", dpid=Switch.make_dpid(True, j, i, self.k))
                 for n in range(self.k):
-                    self.addLink(switch, f"p{n}_s{self.k_2 + j - 1}")
+                    self.addLink(switch, f"p{n}_s{self.k_2 + j - 1}", port1=n + 1, port2=self.k_2 + i)
 
 
     def __add_pod(self, n: int) -> None:
@@ -40,21 +48,29 @@ class FatTreeTopo(Topo):
         # Create k aggregation and edge switches
         for s in range(self.k):
             # Switch name: p{n}_s{s}   IP: 10.n.s.1 
-            sw = Switch()
-            self.addSwitch(f"p{n}_s{s}", ip=f"10.{n}.{s}.1", dpid=sw.set_dpid(False, n, s))
+            self.addSwitch(f"p{n}_s{s}", ip=f"10.{n}.{s}.1", dpid=Switch.make_dpid(False, n, s, self.k))
 
         # Create (k/2)^2 hosts and links to edge switches
         for s in range(self.k_2):
             for h in range(2, self.k_2 + 2):
                 # Host name: p{n}_s{s}_h{h}   IP: 10.n.s.h
-                hostname = self.addHost(f"p{n}_s{s}_h{h}", ip=f"10.{n}.{s}.{h}", cls=DockerHost, dimage="dev_test", docker_args={})
+                hostname = f"p{n}_s{s}_h{h}"
+                # MAC from the position of the host in the fat-tree, since the counter used by autoSetMacs is
+                # not thread safe and deferred hosts are created later
+                mac = macColonHex((n * self.k_2 + s) * self.k_2 + h - 1)
+                params = dict(ip=f"10.{n}.{s}.{h}", mac=mac, cls=DockerHost, dimage="dev_test", docker_args={})
+                if self.created_hosts is not None and hostname not in self.created_hosts:
+                    self.deferred[hostname] = (params, f"p{n}_s{s}", h - 1)
+                    continue
+                self.addHost(hostname, **params)
                 # Link host with lower-layer switch
-                self.addLink(hostname, f"p{n}_s{s}")
+                self.addLink(hostname, f"p{n}_s{s}", port2=h - 1)
 
         # Create Aggregation-Edge links
         for edge in range(self.k_2):
             for aggr in range(self.k_2, self.k):
-                self.addLink(f"p{n}_s{edge}", f"p{n}_s{aggr}")
+                self.addLink(f"p{n}_s{edge}", f"p{n}_s{aggr}", port1=aggr + 1, port2=edge + 1)
 
 
-topos = {"fat-tree": (lambda: FatTreeTopo(FAT_TREE_K))}
+# Usage: mn --custom network/topology.py --topo fat-tree[,k]
+topos = {"fat-tree": (lambda k=FAT_TREE_K: FatTreeTopo(int(k)))}
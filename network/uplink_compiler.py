@@ -0,0 +1,97 @@
+from switch import Switch
+from slice_registry import SliceRegistry, int_to_ip
+from flow_programmer import FlowProgrammer
+from flow_table import ROUTE_PRIORITY
+from uplink_groups import UPLINK_GROUP
+from ryu.controller.controller import Datapath
+import typing
+
+
+class UplinkCompiler():
+
+    def __init__(self, k: int, datapaths: typing.Dict[int, Datapath], slice_registry: SliceRegistry, flow_programmer: FlowProgrammer, use_groups: bool = False) -> None:
+        """ Precompute the uplink flow entries of the pod switches from the slices, so that they can be
+        installed proactively instead of waiting for a PacketIn for every new destination.
+
+        @param k: The fat-tree parameter
+        @param datapaths: The datapaths connected to the controller
+        @param slice_registry: The slices used to decide which destinations each switch can reach
+        @param flow_programmer: Used to send the entries in batches
+        @param use_groups: Point the entries to the uplink select group instead of a single uplink
+        """
+        self.k: int = k
+        self.datapaths: typing.Dict[int, Datapath] = datapaths
+        self.slice_registry: SliceRegistry = slice_registry
+        self.flow_programmer: FlowProgrammer = flow_programmer
+        self.group: typing.Optional[int] = UPLINK_GROUP if use_groups else None
+        self.compiled: typing.Dict[int, typing.Dict[str, int]] = {}     # dpid -> { dst IP: uplink port } of the last compile
+
+
+    def compile(self, switch: Switch) -> typing.Dict[str, int]:
+        """ Compute the uplink entries of a pod switch: a destination gets an entry if it shares a slice
+        with at least one host below the switch and it is not reachable through the downlinks.
+
+        @param switch: The pod switch
+        @return: Dict of destination IP -> output port
+        """
+        if switch.is_edge:
+            local_prefix = f'10.{switch.pod}.{switch.swn}.'
+        else:
+            local_prefix = f'10.{switch.pod}.'
+
+        entries = {}
+        for hosts in self.slice_registry.slices.values():
+            if not any(host.startswith(local_prefix) for host in hosts):
+                continue    # No host below this switch belongs to the slice
+            for dst in hosts:
+                if not dst.startswith(local_prefix):
+                    entries[dst] = switch.get_uplink_port(int(dst.split('.')[3]), self.k)
+        return entries
+
+
+    def install(self, datapath: Datapath) -> None:
+        """ Push all the uplink entries to a pod switch that just connected to the controller
+
+        @param datapath: The datapath of the pod switch
+        """
+        entries = self.compile(Switch.get(datapath.id))
+        batch = self.flow_programmer.batch()
+        for ip, port in entries.items():
+            batch.add(datapath, ip=ip, mask=0xFFFFFFFF, port=port, group=self.group)
+        batch.commit()
+        self.compiled[datapath.id] = entries
+
+
+    def installed(self, dpid: int) -> typing.Dict[str, int]:
+        """ Return the uplink entries held by a pod switch, read from the shadow of its flow table so that
+        the entries evicted to respect the flow table budget are not considered installed
+
+        @param dpid: The datapath id of the pod switch
+        @return: Dict of destination IP -> output port
+        """
+        table = self.flow_programmer.tables.get(dpid)
+        if table is None:
+            return {}
+        return { int_to_ip(dst): entry.action[0] for dst, entry in table.destinations(ROUTE_PRIORITY).items()
+                 if not entry.static and entry.timeout == 0 }     # Not the two-level routes nor the PacketIn entries
+
+
+    def update(self) -> None:
+        """ Recompile the uplink entries after a slice change and send only the differences to the switches.
+        The entries evicted to respect the flow table budget are sent again only if they changed, otherwise
+        their destinations are left to PacketIn as the other evicted entries.
+        """
+        batch = self.flow_programmer.batch()
+        for dpid, previous in self.compiled.items():
+            datapath = self.datapaths[dpid]
+            installed = self.installed(dpid)
+            entries = self.compile(Switch.get(dpid))
+
+            for ip in installed.keys() - entries.keys():
+                batch.delete(datapath, ip=ip, mask=0xFFFFFFFF)
+            for ip, port in entries.items():
+                if previous.get(ip) != port and installed.get(ip) != port:
+                    batch.add(datapath, ip=ip, mask=0xFFFFFFFF, port=port, group=self.group)
+
+            self.compiled[dpid] = entries
+        batch.commit()
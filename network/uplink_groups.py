@@ -0,0 +1,96 @@
+from globals import FLOW_RATE_THRESHOLD
+from metrics import REGISTRY
+from ryu.controller.controller import Datapath
+import numpy as np
+import typing
+
+# Group of the uplinks on every pod switch
+UPLINK_GROUP = 1
+
+# Weight of an uplink when the load is balanced (OpenFlow weights are 16-bit)
+BASE_WEIGHT = 100
+MAX_WEIGHT = 1000
+
+GROUP_MODS = REGISTRY.counter('sdn_group_mods_total', 'Select group updates sent to the pod switches').labels()
+
+
+class UplinkGroups():
+
+    def __init__(self, k: int, datapaths: typing.Dict[int, Datapath], damping: float = 0.5, tolerance: float = 0.1) -> None:
+        """ Select groups that spread the uplink traffic of the pod switches over all their uplinks.
+        The switch picks a bucket for every flow (hash of the headers), so the load is balanced in the
+        data plane; the controller only corrects the bucket weights from the port stats of every round.
+
+        @param k: The fat-tree parameter
+        @param datapaths: The datapaths connected to the controller
+        @param damping: Exponent applied to the weight corrections, to avoid oscillations
+        @param tolerance: Minimum relative change of a weight that triggers a group update
+        """
+        self.k: int = k
+        self.k_2: int = k // 2
+        self.datapaths: typing.Dict[int, Datapath] = datapaths
+        self.damping: float = damping
+        self.tolerance: float = tolerance
+        self.weights: typing.Dict[int, np.ndarray] = {}     # dpid -> installed weight of each uplink
+
+
+    def install(self, datapath: Datapath) -> None:
+        """ Create the uplink group on a pod switch that just connected to the controller, with equal weights
+
+        @param datapath: The datapath of the pod switch
+        """
+        weights = np.full(self.k_2, BASE_WEIGHT, dtype=np.int64)
+        datapath.send_msg(self.__build_group_mod(datapath, datapath.ofproto.OFPGC_ADD, weights))
+        GROUP_MODS.inc()
+        self.weights[datapath.id] = weights
+
+
+    def update(self, dpid: int, rates: np.ndarray) -> bool:
+        """ Shift weight from the most utilized uplinks of a pod switch to the least utilized ones
+
+        @param dpid: The datapath id of the pod switch
+        @param rates: Byte rate (bytes/s) transmitted by each uplink in the last round
+        @return: True if the new weights were sent to the switch
+        """
+        installed = self.weights.get(dpid)
+        if installed is None:
+            return False    # Not a pod switch
+
+        weights = self.compute_weights(installed, rates)
+        if np.all(np.abs(weights - installed) <= self.tolerance * installed):
+            return False    # Not worth rehashing the flows of the switch
+
+        datapath = self.datapaths[dpid]
+        datapath.send_msg(self.__build_group_mod(datapath, datapath.ofproto.OFPGC_MODIFY, weights))
+        GROUP_MODS.inc()
+        self.weights[dpid] = weights
+        return True
+
+
+    def compute_weights(self, weights: np.ndarray, rates: np.ndarray) -> np.ndarray:
+        """ Scale every weight by the ratio between the mean uplink rate and the rate of the uplink, so that
+        the weights converge to the ones that equalize the utilization. Idle uplinks keep their weights.
+
+        @param weights: The installed weights
+        @param rates: Byte rate (bytes/s) transmitted by each uplink
+        @return: The new weights, normalized to BASE_WEIGHT on average
+        """
+        rates = np.asarray(rates, dtype=np.float64) + FLOW_RATE_THRESHOLD     # Ignore the noise of idle links
+        corrected = weights * (rates.mean() / rates) ** self.damping
+        corrected *= BASE_WEIGHT * len(corrected) / corrected.sum()
+        return np.clip(np.rint(corrected), 1, MAX_WEIGHT).astype(np.int64)
+
+
+    def __build_group_mod(self, datapath: Datapath, command: int, weights: np.ndarray):
+        """ Create the OFPGroupMod of the uplink group, one bucket for each uplink port """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        buckets = [
+            parser.OFPBucket(
+                bucket_id=n,
+                actions=[ parser.OFPActionOutput(self.k_2 + n + 1) ],
+                properties=[ parser.OFPGroupBucketPropWeight(type_=ofproto.OFPGBPT_WEIGHT, weight=int(weight)) ],
+            )
+            for n, weight in enumerate(weights)
+        ]
+        return parser.OFPGroupMod(datapath, command=command, type_=ofproto.OFPGT_SELECT, group_id=UPLINK_GROUP, buckets=buckets)
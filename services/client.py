@@ -1,23 +1,168 @@
+import argparse
+import json
+import math
 import requests
+import threading
 import time
 import sys
-import pickle
+from service_directory import ServiceDirectory
+
+
+class LatencyHistogram():
+
+    def __init__(self, sub_buckets: int = 64) -> None:
+        """ HDR-style histogram of latencies in microseconds: every power of two is split in sub_buckets
+        linear buckets, so percentiles have a constant relative error (about 1/sub_buckets)
+
+        @param sub_buckets: Number of buckets of every power of two
+        """
+        self.sub_buckets: int = sub_buckets
+        self.counts: dict = {}
+        self.count: int = 0
+        self.max: float = 0
+
+
+    def record(self, seconds: float) -> None:
+        us = max(seconds * 1e6, 1)
+        exponent = int(math.log2(us))
+        sub = int((us / (1 << exponent) - 1) * self.sub_buckets)
+        key = exponent * self.sub_buckets + sub
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+
+    def percentile(self, p: float) -> float:
+        """ Return the latency (seconds) below which falls p percent of the samples """
+        if self.count == 0:
+            return 0
+        rank = math.ceil(p / 100 * self.count)
+        seen = 0
+        for key in sorted(self.counts):
+            seen += self.counts[key]
+            if seen >= rank:
+                exponent, sub = divmod(key, self.sub_buckets)
+                return min((1 << exponent) * (1 + (sub + 1) / self.sub_buckets) / 1e6, self.max)
+        return self.max
+
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.count += other.count
+        self.max = max(self.max, other.max)
+
+
+class LoadGenerator():
+
+    def __init__(self, directory: ServiceDirectory, target_srv: str, threads: int, rate: float, timeout: float) -> None:
+        """ Send requests to a service from a pool of threads, each with its own keep-alive session.
+        With a rate, requests follow an open-loop schedule and latencies are measured from the scheduled
+        send time, so that a slow service does not hide its queueing delay (coordinated omission).
+
+        @param directory: The service directory used to find the service host
+        @param target_srv: The ID of the service
+        @param threads: Number of concurrent requests
+        @param rate: Target requests per second, 0 sends requests back to back (closed loop)
+        @param timeout: Timeout of a request in seconds
+        """
+        self.directory: ServiceDirectory = directory
+        self.target_srv: str = target_srv
+        self.threads: int = threads
+        self.rate: float = rate
+        self.timeout: float = timeout
+        self.lock = threading.Lock()
+        self.next_request: int = 0          # Index of the next request in the open-loop schedule
+        self.start: float = time.monotonic()
+        self.window = LatencyHistogram()    # Latencies since the last report
+        self.errors: int = 0
+        self.bytes: int = 0
+
+
+    def run(self) -> None:
+        for _ in range(self.threads):
+            threading.Thread(target=self.__worker, daemon=True).start()
+
+
+    def collect(self) -> tuple:
+        """ Return and reset the latencies, errors and received bytes since the last call """
+        with self.lock:
+            window, errors, received = self.window, self.errors, self.bytes
+            self.window, self.errors, self.bytes = LatencyHistogram(), 0, 0
+        return window, errors, received
+
+
+    def __worker(self) -> None:
+        session = requests.Session()
+        version, services = self.directory.read()
+        while True:
+            scheduled = time.monotonic()
+            if self.rate > 0:
+                with self.lock:
+                    scheduled = self.start + self.next_request / self.rate
+                    self.next_request += 1
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if self.directory.version() != version:
+                version, services = self.directory.read()
+            try:
+                res = session.get(f'http://{services[self.target_srv]}:8080', timeout=self.timeout)
+                latency = time.monotonic() - scheduled
+                with self.lock:
+                    self.window.record(latency)
+                    self.bytes += len(res.content)
+            except Exception:
+                with self.lock:
+                    self.errors += 1
+                session = requests.Session()    # Drop the broken connection
+
+
+def load(target_srv: str, args: argparse.Namespace) -> None:
+    """ Generate load towards a service and report throughput and latency percentiles every interval """
+    directory = ServiceDirectory(args.directory)
+    generator = LoadGenerator(directory, target_srv, args.threads, args.rate, args.timeout)
+    generator.run()
+    results = open(args.results, 'a') if args.results else None
+    total = LatencyHistogram()
+    start = time.monotonic()
+
+    while args.duration == 0 or time.monotonic() - start < args.duration:
+        time.sleep(args.interval)
+        window, errors, received = generator.collect()
+        total.merge(window)
+        record = {
+            't': time.time(), 'target': target_srv, 'host': directory.read()[1].get(target_srv),
+            'requests': window.count, 'errors': errors, 'throughput': window.count / args.interval,
+            'bytes_per_second': received / args.interval, 'max': window.max,
+            **{ f'p{p}': window.percentile(p) for p in (50, 90, 99, 99.9) },
+        }
+        print(f"{record['throughput']:.1f} req/s, {errors} errors, p50 {record['p50'] * 1000:.2f} ms, "
+              f"p99 {record['p99'] * 1000:.2f} ms, max {record['max'] * 1000:.2f} ms")
+        if results is not None:
+            results.write(json.dumps(record) + '\n')
+            results.flush()
+
+    print(f'Total: {total.count} requests, ' + ', '.join(f'p{p} {total.percentile(p) * 1000:.2f} ms' for p in (50, 90, 99, 99.9)))
 
 
 def main(target_srv: str) -> None:
 
+    directory = ServiceDirectory('/home/services.dir')
+    version, services = directory.read()
+
     while True:
         try:
-            # Get target srv ip address
-            server_ip = ''
-            with open('/home/services.obj', 'rb') as file:
-                services = pickle.load(file)
-                server_ip = services[target_srv]
+            # Get target srv ip address, reading the directory again only if it changed
+            if directory.version() != version:
+                version, services = directory.read()
+            server_ip = services[target_srv]
 
             # Send HTTP request
             res = requests.get(f'http://{server_ip}:8080', timeout=5)
             print(f'Got response code {res.status_code} in {res.elapsed}')
-        
+
         except requests.exceptions.Timeout:
             print('Request timed out')
         except Exception as ex:
@@ -27,8 +172,22 @@ def main(target_srv: str) -> None:
 
 
 if __name__ == '__main__':
-    
+
     if len(sys.argv) < 2:
         exit()
 
-    main(sys.argv[1])
\ No newline at end of file
+    if len(sys.argv) == 2:
+        main(sys.argv[1])
+        exit()
+
+    parser = argparse.ArgumentParser(description='Generate load towards a service')
+    parser.add_argument('target_srv', help='ID of the service')
+    parser.add_argument('--threads', type=int, default=4, help='Concurrent requests')
+    parser.add_argument('--rate', type=float, default=0, help='Target requests per second (open loop), 0 for closed loop')
+    parser.add_argument('--duration', type=float, default=0, help='Duration in seconds, 0 runs forever')
+    parser.add_argument('--interval', type=float, default=10, help='Reporting interval in seconds')
+    parser.add_argument('--timeout', type=float, default=5, help='Request timeout in seconds')
+    parser.add_argument('--results', help='File where to append the results of every interval (JSON lines)')
+    parser.add_argument('--directory', default='/home/services.dir', help='Path of the service directory')
+    args = parser.parse_args()
+    load(args.target_srv, args)
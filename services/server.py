@@ -1,20 +1,86 @@
 # Python 3 server example
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
 import sys
+import threading
+import time
+
+
+class Stats():
+
+    def __init__(self) -> None:
+        """ Requests served and their service time (from the request line read to the response sent), shared by the server threads """
+        self.lock = threading.Lock()
+        self.requests: int = 0
+        self.total: int = 0
+        self.latency: float = 0
+        self.max_latency: float = 0
+
+
+    def record(self, latency: float) -> None:
+        with self.lock:
+            self.requests += 1
+            self.total += 1
+            self.latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+
+    def report(self, interval: float) -> None:
+        """ Print the requests served in every interval """
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                requests, latency, max_latency = self.requests, self.latency, self.max_latency
+                self.requests, self.latency, self.max_latency = 0, 0, 0
+            mean = latency / requests if requests > 0 else 0
+            print(f'{requests / interval:.1f} req/s ({self.total} total), latency mean {mean * 1000:.3f} ms, max {max_latency * 1000:.3f} ms', flush=True)
+
+
+def encode_response(payload: bytes) -> bytes:
+    """ Encode the whole HTTP response once, so that every request is answered with a single write """
+    headers = f'HTTP/1.1 200 OK\r\nContent-Type: text/plain\r\nContent-Length: {len(payload)}\r\n\r\n'
+    return headers.encode() + payload
+
 
 class WebServer(BaseHTTPRequestHandler):
 
+    protocol_version = 'HTTP/1.1'       # Keep the connections alive
+    disable_nagle_algorithm = True
+    response: bytes = encode_response(bytes("UNITN " * 100, "utf-8"))
+    stats = Stats()
+
+    def parse_request(self) -> bool:
+        self.request_start = time.perf_counter()    # The request line was just read by handle_one_request
+        return super().parse_request()
+
     def do_GET(self):
-        self.send_response(200)
-        self.wfile.write(bytes("UNITN " * 100, "utf-8"))
+        self.wfile.write(self.response)
+        self.stats.record(time.perf_counter() - self.request_start)
+
+    def log_message(self, format, *args):
+        pass    # Logging every request limits the throughput, see Stats.report
+
+
+class Server(ThreadingHTTPServer):
 
+    daemon_threads = True
 
-def main(hostname: str):
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return      # Clients closing their keep-alive connections
+        super().handle_error(request, client_address)
+
+
+def main(hostname: str, payload_size: int, report_interval: float):
     port = 8080
-    
-    webServer = HTTPServer((hostname, port), WebServer)
-    
-    print(f'Server started http://{hostname}:{port}')
+    if payload_size > 0:
+        WebServer.response = encode_response((b'UNITN ' * (payload_size // 6 + 1))[:payload_size])
+
+    webServer = Server((hostname, port), WebServer)
+    if report_interval > 0:
+        threading.Thread(target=WebServer.stats.report, args=(report_interval,), daemon=True).start()
+
+    print(f'Server started http://{hostname}:{port}, response {len(WebServer.response)} bytes', flush=True)
 
     try:
         webServer.serve_forever()
@@ -25,10 +91,12 @@ def main(hostname: str):
 
 
 
-if __name__ == "__main__":     
+if __name__ == "__main__":
     # Parse arguments
-    if len(sys.argv) < 2:
-        exit()
-    hostname = sys.argv[1]
+    parser = argparse.ArgumentParser(description='HTTP service')
+    parser.add_argument('hostname', help='Address to listen on')
+    parser.add_argument('--payload', type=int, default=0, help='Size of the response in bytes, 0 for the default response')
+    parser.add_argument('--report', type=float, default=10, help='Interval in seconds between two stats reports, 0 disables them')
+    args = parser.parse_args()
 
-    main(hostname)
\ No newline at end of file
+    main(args.hostname, args.payload, args.report)
@@ -0,0 +1,170 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+import time
+import typing
+
+# Header of the directory file: version counter and length of the JSON payload
+HEADER = struct.Struct('<QI')
+
+
+class ServiceDirectory():
+
+    def __init__(self, path: str, writable: bool = False, size: int = 1 << 16) -> None:
+        """ Versioned directory of the running services (service id -> host IP) shared through a
+        memory-mapped file. The version is even when the content is consistent and odd while a writer is
+        updating it, so readers never see a partially written directory (seqlock).
+        The directory also holds the pending migrations (service id -> target host IP): a service keeps
+        its current host until the migration is completed, i.e. the new instance is ready.
+
+        @param path: Path of the directory file
+        @param writable: Open the directory to publish updates (creates the file if missing)
+        @param size: Size of the file, i.e. the maximum size of the directory
+        """
+        self.path: str = path
+        self.writable: bool = writable
+        if writable:
+            self.fd: int = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+            if os.fstat(self.fd).st_uid == os.geteuid():
+                os.fchmod(self.fd, 0o666)   # Controller and simulation can run as different users
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+            self.map = mmap.mmap(self.fd, size, access=mmap.ACCESS_WRITE)
+        else:
+            self.fd: int = os.open(path, os.O_RDONLY)
+            self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+
+
+    def version(self) -> int:
+        """ Return the current version of the directory, incremented at every update """
+        return HEADER.unpack_from(self.map, 0)[0]
+
+
+    def read(self) -> typing.Tuple[int, typing.Dict[str, str]]:
+        """ Return a consistent snapshot of the directory
+
+        @return: The version of the snapshot and the services dict
+        """
+        version, services, _ = self.read_pending()
+        return version, services
+
+
+    def read_pending(self) -> typing.Tuple[int, typing.Dict[str, str], typing.Dict[str, str]]:
+        """ Return a consistent snapshot of the directory, including the pending migrations
+
+        @return: The version of the snapshot, the services dict and the pending migrations dict
+        """
+        while True:
+            version, length = HEADER.unpack_from(self.map, 0)
+            if version % 2 == 1:
+                time.sleep(0.001)   # An update is in progress
+                continue
+            payload = self.map[HEADER.size:HEADER.size + length]
+            if self.version() == version:
+                return (version, *self.__decode(payload, length))
+
+
+    def wait(self, version: int, timeout: typing.Optional[float] = None, poll_interval: float = 0.005) -> typing.Tuple[int, typing.Dict[str, str]]:
+        """ Block until the directory version differs from the provided one, then return the new snapshot
+
+        @param version: The version already known by the caller
+        @param timeout: Maximum waiting time in seconds (None waits forever)
+        @param poll_interval: Time between two checks of the version in shared memory
+        @return: The version and the services dict (unchanged if the timeout expired)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.version() == version:
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(poll_interval)
+        return self.read()
+
+
+    def publish(self, services: typing.Dict[str, str], pending: typing.Optional[typing.Dict[str, str]] = None) -> int:
+        """ Replace the content of the directory
+
+        @param services: The new services dict
+        @param pending: The new pending migrations dict
+        @return: The new version of the directory
+        """
+        def replace(current_services: dict, current_pending: dict) -> None:
+            current_services.clear()
+            current_services.update(services)
+            current_pending.clear()
+            current_pending.update(pending or {})
+        return self.__modify(replace)
+
+
+    def request_migration(self, service_id: str, ip: str) -> int:
+        """ Add a pending migration, the service keeps its current host until complete_migration is called
+
+        @param service_id: The ID of the service to migrate
+        @param ip: The target host
+        @return: The new version of the directory
+        """
+        def request(services: dict, pending: dict) -> None:
+            pending[service_id] = ip
+        return self.__modify(request)
+
+
+    def complete_migration(self, service_id: str) -> int:
+        """ Move the service to the target host of its pending migration
+
+        @param service_id: The ID of the migrated service
+        @return: The new version of the directory
+        """
+        def complete(services: dict, pending: dict) -> None:
+            if service_id in pending:
+                services[service_id] = pending.pop(service_id)
+        return self.__modify(complete)
+
+
+    def cancel_migration(self, service_id: str) -> int:
+        """ Remove the pending migration of a service that could not be moved, the service keeps its current host
+
+        @param service_id: The ID of the service
+        @return: The new version of the directory
+        """
+        def cancel(services: dict, pending: dict) -> None:
+            pending.pop(service_id, None)
+        return self.__modify(cancel)
+
+
+    def __modify(self, function: typing.Callable) -> int:
+        """ Atomically read, update and write back the directory
+
+        @param function: Called with the services and the pending migrations dicts, which it updates in place
+        @return: The new version of the directory
+        """
+        fcntl.flock(self.fd, fcntl.LOCK_EX)     # One writer at a time
+        try:
+            version, length = HEADER.unpack_from(self.map, 0)
+            version &= ~1                       # Recover from a writer that crashed while updating
+            services, pending = self.__decode(self.map[HEADER.size:HEADER.size + length], length)
+            function(services, pending)
+            payload = json.dumps({ 'services': services, 'pending': pending }).encode()
+            if HEADER.size + len(payload) > len(self.map):
+                raise ValueError('Service directory is full')
+
+            HEADER.pack_into(self.map, 0, version + 1, 0)
+            self.map[HEADER.size:HEADER.size + len(payload)] = payload
+            HEADER.pack_into(self.map, 0, version + 2, len(payload))
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        return version + 2
+
+
+    @staticmethod
+    def __decode(payload: bytes, length: int) -> typing.Tuple[typing.Dict[str, str], typing.Dict[str, str]]:
+        """ Return the services and the pending migrations encoded in the payload """
+        if length == 0:
+            return {}, {}
+        content = json.loads(payload)
+        return content.get('services', {}), content.get('pending', {})
+
+
+    def close(self) -> None:
+        self.map.close()
+        os.close(self.fd)